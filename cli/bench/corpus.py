@@ -0,0 +1,170 @@
+"""Benchmarks of the commands that work on raw sample directories, using
+synthetic freeze-dried samples
+
+Run ``make bench`` or ``python bench/corpus.py --help``.
+
+"""
+from contextlib import redirect_stdout
+import io
+from pathlib import Path
+from shutil import copytree, rmtree
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+import click
+from click import command, option
+
+from fathom_web.commands.extract import extract
+from fathom_web.commands.label import label
+from fathom_web.commands.list import list as list_command
+from fathom_web.utils import samples_from_dir
+from fathom_web.vectorizer import out_of_date
+from results import comparison_table, previous_results, record_results
+from synthetic import synthetic_samples
+
+
+def sample_folders(tree):
+    """Return the folders under ``tree`` that directly contain samples.
+    ``extract`` and ``label`` don't recurse, so we run them on each."""
+    return sorted({path.parent for path in samples_from_dir(tree)})
+
+
+def best_time(function, tree, scratch, repeat, modifies):
+    """Return the shortest of ``repeat`` wall times of calling ``function``
+    on ``tree``.
+
+    If the function ``modifies`` the tree, each run gets a fresh copy of it
+    in ``scratch``, and the copying isn't counted.
+
+    """
+    times = []
+    for _ in range(repeat):
+        if modifies:
+            rmtree(scratch, ignore_errors=True)
+            copytree(tree, scratch)
+            target = scratch
+        else:
+            target = tree
+        with redirect_stdout(io.StringIO()):
+            start = perf_counter()
+            function(target)
+            times.append(perf_counter() - start)
+    return min(times)
+
+
+def time_corpus_commands(tree, extracted_tree, temp, repeat, workers):
+    """Return a dict of the best wall time of each corpus command, keyed by
+    command name.
+
+    :arg tree: A Path to a tree of unextracted samples
+    :arg extracted_tree: A Path to the same samples, already extracted
+    :arg temp: A Path to a scratch folder
+
+    """
+    ruleset = temp / 'rulesets.js'
+    ruleset.write_text('// Only hashed, never run\n')
+    scratch = temp / 'scratch'
+
+    def run_extract(target):
+        for folder in sample_folders(target):
+            extract.callback(str(folder), preserve_originals=False)
+
+    def run_label(target):
+        for folder in sample_folders(target):
+            label.callback(str(folder), 'article', preserve_originals=False, number_of_workers=workers)
+
+    def run_list(target):
+        list_command.callback(str(target), base_dir=None, out_file=None, show_urls=True)
+
+    def run_out_of_date(target):
+        out_of_date(temp / 'no_such_cache.json', ruleset, target)
+
+    return {'extract': best_time(run_extract, tree, scratch, repeat, modifies=True),
+            'label': best_time(run_label, extracted_tree, scratch, repeat, modifies=True),
+            'list --show-urls': best_time(run_list, tree, scratch, repeat, modifies=False),
+            'out_of_date': best_time(run_out_of_date, extracted_tree, scratch, repeat, modifies=False)}
+
+
+def tree_size(tree):
+    """Return the number of samples in ``tree`` and their total bytes, not
+    counting extracted resources."""
+    sizes = [path.stat().st_size for path in samples_from_dir(tree)]
+    return len(sizes), sum(sizes)
+
+
+@command()
+@option('--files', '-n',
+        default=10000,
+        show_default=True,
+        help='The number of samples in the tree')
+@option('--page-kb',
+        default=16,
+        show_default=True,
+        help='About how many KB of text each page has, not counting embedded resources')
+@option('--data-uris',
+        default=8,
+        show_default=True,
+        help='The number of embedded resources per page')
+@option('--resource-kb',
+        default=2,
+        show_default=True,
+        help='The size of each resource, in KB, before base64 encoding')
+@option('--duplicate-ratio',
+        default=0.3,
+        show_default=True,
+        help='The fraction of resources that repeat one from a small shared pool')
+@option('--per-directory',
+        type=int,
+        help='Put this many samples in each subdirectory rather than all in one. [default: all in one]')
+@option('--workers',
+        default=1,
+        show_default=True,
+        help='The --number-of-workers to pass to `fathom label`')
+@option('--repeat', '-r',
+        default=1,
+        show_default=True,
+        help='How many times to run each command. The fastest time is kept.')
+@option('--results',
+        type=click.Path(dir_okay=False, writable=True),
+        default=str(Path(__file__).parent / 'results.jsonl'),
+        show_default=True,
+        help='A JSON-lines file to append the throughputs to and compare them against')
+def main(files, page_kb, data_uris, resource_kb, duplicate_ratio, per_directory, workers, repeat, results):
+    """Measure the throughput of ``fathom extract``, ``label``, and ``list``
+    and of the vector cache's change check on a tree of synthetic
+    freeze-dried samples, so no real corpus is needed.
+
+    ``extract`` and ``list`` see the samples as freeze-dried, with their
+    resources embedded. ``label`` and the change check see them as
+    extracted, with ``resources/`` folders alongside. Throughputs are in
+    samples and in MB of sample HTML per second. Each run is appended to the
+    results file and compared with the previous one.
+
+    """
+    results_path = Path(results)
+    with TemporaryDirectory() as temp:
+        temp = Path(temp)
+        click.echo(f'Writing {files} samples...', err=True)
+        shape = dict(files=files,
+                     page_kb=page_kb,
+                     data_uris=data_uris,
+                     resource_kb=resource_kb,
+                     duplicate_ratio=duplicate_ratio,
+                     per_directory=per_directory)
+        synthetic_samples(temp / 'freeze-dried', **shape)
+        synthetic_samples(temp / 'extracted', extracted=True, **shape)
+        sizes = {'freeze-dried': tree_size(temp / 'freeze-dried'),
+                 'extracted': tree_size(temp / 'extracted')}
+        click.echo('Timing commands...', err=True)
+        times = time_corpus_commands(temp / 'freeze-dried', temp / 'extracted', temp, repeat, workers)
+    by_command = {}
+    for name, seconds in times.items():
+        num_files, num_bytes = sizes['extracted' if name in ('label', 'out_of_date') else 'freeze-dried']
+        by_command[name] = {'files/s': num_files / seconds,
+                            'MB/s': num_bytes / 1e6 / seconds}
+    print(comparison_table(by_command, previous_results(results_path, 'corpus'), '', higher_is_better=True))
+    record_results(results_path, 'corpus', by_command)
+
+
+if __name__ == '__main__':
+    main()
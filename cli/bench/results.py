@@ -0,0 +1,90 @@
+"""Storing benchmark results and comparing them with the previous run"""
+
+from datetime import datetime, timezone
+from json import dumps, loads
+from pathlib import Path
+import platform
+import subprocess
+
+from click import style
+
+
+def current_commit():
+    """Return the abbreviated hash of the checked-out commit, marked dirty if
+    there are uncommitted changes, or None outside a git checkout."""
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'],
+                              cwd=Path(__file__).parent,
+                              capture_output=True,
+                              text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def previous_results(path, benchmark):
+    """Return the results of the last recorded run of ``benchmark`` in the
+    JSON-lines file at ``path``, or {} if there isn't one."""
+    try:
+        with path.open(encoding='utf-8') as file:
+            runs = [loads(line) for line in file if line.strip()]
+    except FileNotFoundError:
+        return {}
+    return next((run['results'] for run in reversed(runs) if run['benchmark'] == benchmark), {})
+
+
+def record_results(path, benchmark, results):
+    """Append a run of ``benchmark`` to the JSON-lines file at ``path``, along
+    with enough about the machine and code to tell runs apart.
+
+    :arg results: A dict of {row name: {column name: number}}
+
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open('a', encoding='utf-8') as file:
+        file.write(dumps({'benchmark': benchmark,
+                          'time': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                          'commit': current_commit(),
+                          'machine': platform.node(),
+                          'python': platform.python_version(),
+                          'results': results}) + '\n')
+
+
+def comparison_table(results, previous, unit, higher_is_better=False, tolerance=0.2):
+    """Return a printable table of ``results``, each number followed by how
+    it compares with the same one in ``previous``.
+
+    Changes for the worse by more than ``tolerance`` are shown in red and
+    those for the better in green.
+
+    :arg results: A dict of {row name: {column name: number}}
+    :arg previous: The same, from an earlier run, or {}
+    :arg unit: What to label the numbers with, like "s"
+
+    """
+    columns = list(dict.fromkeys(column for row in results.values() for column in row))
+    name_width = max(len(name) for name in results)
+    lines = [' ' * name_width + ''.join(f'{column: >22}' for column in columns)]
+    for name, row in results.items():
+        cells = []
+        for column in columns:
+            if column not in row:
+                cells.append(' ' * 22)
+                continue
+            value = row[column]
+            old = previous.get(name, {}).get(column)
+            if old:
+                ratio = value / old
+                change = f'{ratio:6.2f}x'
+                worse = ratio < 1 - tolerance if higher_is_better else ratio > 1 + tolerance
+                better = ratio > 1 + tolerance if higher_is_better else ratio < 1 - tolerance
+                if worse:
+                    change = style(change, fg='red')
+                elif better:
+                    change = style(change, fg='green')
+            else:
+                change = ' ' * 7
+            cells.append(f'{value: >11.4g} {unit: <2} {change}')
+        lines.append(f'{name: <{name_width}}' + ''.join(cells))
+    lines.append(f'\nRatios compare with the previous run. {"Higher" if higher_is_better else "Lower"} is better.')
+    return '\n'.join(lines)
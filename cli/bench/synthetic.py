@@ -0,0 +1,199 @@
+"""Generators of synthetic corpora for benchmarking the Fathom CLI tools
+without real samples or a browser
+
+Run ``python bench/synthetic.py --help`` to write them to disk.
+
+"""
+from base64 import b64encode
+from json import dump
+from pathlib import Path
+
+import click
+from click import group, option
+import numpy
+
+from fathom_web.commands.extract import NEW_CSP
+
+
+def synthetic_vectors(pages=100, nodes_per_page=100, features=8, positive_rate=0.02, pruned_fraction=0.1, seed=0):
+    """Return the contents of a v2-format vector file with made-up pages.
+
+    Features alternate between boolean ones and continuous ones, and targets
+    score a bit higher on each, so training has something to find. Nodes have
+    inline markup, as a FathomFox-made vector file does.
+
+    :arg pages: The number of pages
+    :arg nodes_per_page: The number of candidate nodes on each page,
+        including pruned ones
+    :arg features: The number of features per node
+    :arg positive_rate: The fraction of nodes that are targets. Each page
+        gets at least one.
+    :arg pruned_fraction: The fraction of targets that were pruned
+    :arg seed: The seed for the random number generator, so the same
+        arguments always give the same vectors
+
+    """
+    rng = numpy.random.default_rng(seed)
+    is_boolean = numpy.arange(features) % 2 == 0
+    result = []
+    for page in range(pages):
+        is_target = rng.random(nodes_per_page) < positive_rate
+        is_target[rng.integers(nodes_per_page)] = True
+        is_pruned = is_target & (rng.random(nodes_per_page) < pruned_fraction)
+        is_target = is_target[~is_pruned]
+        shift = is_target[:, None] * rng.uniform(0.5, 1.5, features)
+        values = numpy.where(is_boolean,
+                             rng.random((len(is_target), features)) < 0.2 + 0.5 * shift,
+                             rng.normal(shift * 2, 1)).astype(float).round(4).tolist()
+        nodes = [{'isTarget': bool(target),
+                  'features': feature_values,
+                  'markup': f'<div class="c{page}-{node}" data-kind="{"target" if target else "other"}">'}
+                 for node, (target, feature_values) in enumerate(zip(is_target, values))]
+        # Pruned nodes come last and have no features, as FathomFox emits them:
+        nodes.extend({'isTarget': True, 'features': [], 'pruned': True, 'markup': f'<span class="pruned{page}-{i}">'}
+                     for i in range(is_pruned.sum()))
+        result.append({'filename': f'{page:06}.html',
+                       'nodes': nodes,
+                       'time': float(rng.gamma(2, 40))})
+    return {'header': {'version': 2,
+                       'featureNames': [f'{"is" if boolean else "score"}{i}' for i, boolean in enumerate(is_boolean)]},
+            'pages': result}
+
+
+# The CSP FathomFox writes into freeze-dried pages, which `fathom extract`
+# rewrites:
+FREEZE_DRIED_CSP = "default-src 'none'; img-src data:; media-src data:; style-src data: 'unsafe-inline'; font-src data:; frame-src data:"
+RESOURCE_TYPES = [('image/png', 'png', '<img src="{}" width="64" height="64">'),
+                  ('image/jpeg', 'jpg', '<img src="{}" width="320" height="240">'),
+                  ('image/gif', 'gif', '<img src="{}" width="16" height="16">'),
+                  ('font/woff2', 'woff2', '<style>@font-face {{ font-family: f; src: url({}) format("woff2"); }}</style>')]
+WORDS = ('the of and to in is for on that by with from at as this are be or an '
+         'news article product price cart checkout login sign account search menu '
+         'home about contact privacy terms share comment reply posted updated').split()
+
+
+def synthetic_samples(directory, files=100, page_kb=16, data_uris=8, resource_kb=2, duplicate_ratio=0.3,
+                      per_directory=None, domains=50, extracted=False, seed=0):
+    """Write a tree of made-up samples shaped like the ones FathomFox
+    freeze-dries, and return the Paths of the HTML files.
+
+    Each page has a doctype, FathomFox's Content Security Policy, a ``<base>``
+    tag, and a ``<link rel="original">``, followed by filler text and embedded
+    images and fonts.
+
+    :arg directory: The Path to write the tree under. It is created if need be.
+    :arg files: The number of HTML files
+    :arg page_kb: About how many KB of text each page has, not counting
+        embedded resources
+    :arg data_uris: The number of embedded resources per page
+    :arg resource_kb: The size of each resource, in KB, before base64 encoding
+    :arg duplicate_ratio: The fraction of resources that repeat one from a
+        small shared pool, like icons and fonts recurring across a site
+    :arg per_directory: If given, put this many pages in each subdirectory
+        rather than all in ``directory``, for exercising the commands that
+        recurse
+    :arg domains: The number of distinct sites the original URLs come from
+    :arg extracted: Whether to write the resources into ``resources/``
+        folders and point at them, as ``fathom extract`` would have, rather
+        than embedding them as ``data:`` URIs
+    :arg seed: The seed for the random number generator, so the same
+        arguments always give the same tree
+
+    """
+    rng = numpy.random.default_rng(seed)
+    directory = Path(directory)
+    resource_bytes = resource_kb * 1024
+    shared_pool = [(kind, rng.bytes(resource_bytes)) for kind in range(len(RESOURCE_TYPES)) for _ in range(4)]
+    words_per_page = page_kb * 1024 // 7  # about 7 bytes per word, counting the space
+    paths = []
+    for page in range(files):
+        folder = directory / f'{page // per_directory:04}' if per_directory else directory
+        path = folder / f'{page:06}.html'
+        path.parent.mkdir(parents=True, exist_ok=True)
+        resources = []
+        for _ in range(data_uris):
+            if rng.random() < duplicate_ratio:
+                resources.append(shared_pool[rng.integers(len(shared_pool))])
+            else:
+                resources.append((int(rng.integers(len(RESOURCE_TYPES))), rng.bytes(resource_bytes)))
+        if extracted:
+            resource_folder = folder / 'resources' / path.stem
+            resource_folder.mkdir(parents=True, exist_ok=True)
+            urls = []
+            for number, (kind, payload) in enumerate(resources, 1):
+                name = f'{number}.{RESOURCE_TYPES[kind][1]}'
+                (resource_folder / name).write_bytes(payload)
+                urls.append(f'resources/{path.stem}/{name}')
+        else:
+            urls = [f'data:{RESOURCE_TYPES[kind][0]};base64,{b64encode(payload).decode("ascii")}'
+                    for kind, payload in resources]
+        # Spread the resources through the text:
+        words = numpy.array(WORDS)[rng.integers(len(WORDS), size=words_per_page)]
+        paragraphs = numpy.array_split(words, len(urls) + 1)
+        body = [f'<p>{" ".join(paragraphs[0])}</p>']
+        for (kind, _), url, paragraph in zip(resources, urls, paragraphs[1:]):
+            body.append(RESOURCE_TYPES[kind][2].format(url))
+            body.append(f'<p>{" ".join(paragraph)}</p>')
+        domain = f'site{rng.integers(domains)}.example.com'
+        # Extraction drops the <base> tag and lets the CSP allow local files:
+        head = (f'<meta http-equiv="Content-Security-Policy" content="{NEW_CSP}">' if extracted else
+                f'<meta http-equiv="Content-Security-Policy" content="{FREEZE_DRIED_CSP}"><base href="https://{domain}/">')
+        path.write_text('<!DOCTYPE html>\n'
+                        f'<html lang="en"><head>{head}'
+                        f'<link rel="original" href="https://{domain}/page/{page}">'
+                        f'<title>Page {page}</title></head>\n'
+                        f'<body>{"".join(body)}</body></html>\n',
+                        encoding='utf-8')
+        paths.append(path)
+    return paths
+
+
+@group()
+def synthetic():
+    """Make synthetic corpora for benchmarking."""
+
+
+@synthetic.command()
+@option('--pages', default=100, show_default=True, help='The number of pages')
+@option('--nodes-per-page', default=100, show_default=True, help='The number of candidate nodes on each page, including pruned ones')
+@option('--features', default=8, show_default=True, help='The number of features per node')
+@option('--positive-rate', default=0.02, show_default=True, help='The fraction of nodes that are targets')
+@option('--pruned-fraction', default=0.1, show_default=True, help='The fraction of targets that were pruned')
+@option('--seed', default=0, show_default=True, help='The random seed. The same options and seed always make the same file.')
+@option('--output', '-o',
+        type=click.File('w', encoding='utf-8'),
+        default='-',
+        help='Where to write the vector file [default: stdout]')
+def vectors(pages, nodes_per_page, features, positive_rate, pruned_fraction, seed, output):
+    """Write a v2-format vector file of made-up pages, usable anywhere
+    ``fathom train``, ``test``, or ``histogram`` take one."""
+    dump(synthetic_vectors(pages, nodes_per_page, features, positive_rate, pruned_fraction, seed),
+         output,
+         separators=(',', ':'))
+
+
+@synthetic.command()
+@option('--files', default=100, show_default=True, help='The number of HTML files')
+@option('--page-kb', default=16, show_default=True, help='About how many KB of text each page has, not counting embedded resources')
+@option('--data-uris', default=8, show_default=True, help='The number of embedded resources per page')
+@option('--resource-kb', default=2, show_default=True, help='The size of each resource, in KB, before base64 encoding')
+@option('--duplicate-ratio', default=0.3, show_default=True, help='The fraction of resources that repeat one from a small shared pool')
+@option('--per-directory',
+        type=int,
+        help='Put this many pages in each subdirectory rather than all in one. [default: all in one]')
+@option('--domains', default=50, show_default=True, help='The number of distinct sites the original URLs come from')
+@option('--extracted',
+        default=False,
+        is_flag=True,
+        help='Write the resources into resources/ folders, as `fathom extract` would, rather than embedding them.')
+@option('--seed', default=0, show_default=True, help='The random seed. The same options and seed always make the same tree.')
+@click.argument('directory', type=click.Path(file_okay=False))
+def samples(directory, files, page_kb, data_uris, resource_kb, duplicate_ratio, per_directory, domains, extracted, seed):
+    """Write a tree of made-up freeze-dried samples into DIRECTORY, usable
+    anywhere ``fathom extract``, ``label``, ``list``, or ``pick`` take
+    one."""
+    synthetic_samples(directory, files, page_kb, data_uris, resource_kb, duplicate_ratio, per_directory, domains, extracted, seed)
+
+
+if __name__ == '__main__':
+    synthetic()
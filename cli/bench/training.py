@@ -0,0 +1,116 @@
+"""Benchmarks of the training and reporting stack on synthetic vectors
+
+Run ``make bench`` or ``python bench/training.py --help``.
+
+"""
+from contextlib import redirect_stdout
+import io
+import os
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+import click
+from click import command, option
+import torch
+
+from fathom_web.accuracy import accuracy_per_tag, per_tag_metrics, print_per_tag_report
+from fathom_web.commands.histogram import feature_metrics
+from fathom_web.commands.train import find_optimal_cutoff, learn
+from fathom_web.utils import tensors_from
+from results import comparison_table, previous_results, record_results
+from synthetic import synthetic_vectors
+
+
+def best_time(function, repeat):
+    """Return the shortest of ``repeat`` wall times of calling ``function``,
+    along with what it returned the last time."""
+    times = []
+    for _ in range(repeat):
+        start = perf_counter()
+        result = function()
+        times.append(perf_counter() - start)
+    return min(times), result
+
+
+def time_training_stack(num_nodes, nodes_per_page, features, iterations, repeat):
+    """Return a dict of the best wall time of each benchmarked function on a
+    synthetic corpus of about ``num_nodes`` nodes."""
+    vectors = synthetic_vectors(pages=max(1, num_nodes // nodes_per_page),
+                                nodes_per_page=nodes_per_page,
+                                features=features,
+                                seed=num_nodes)
+    pages = vectors['pages']
+    feature_names = vectors['header']['featureNames']
+    times = {}
+
+    times['tensors_from'], (x, y, num_yes, num_prunes) = best_time(lambda: tensors_from(pages), repeat)
+    with TemporaryDirectory() as temp:
+        # Keep learn()'s Tensorboard logs out of the way:
+        old_dir = os.getcwd()
+        os.chdir(temp)
+        try:
+            times['learn'], model = best_time(
+                lambda: learn(0.1, iterations, x, y, num_prunes, len(x) + num_prunes, num_yes, quiet=True),
+                repeat)
+        finally:
+            os.chdir(old_dir)
+    with torch.no_grad():
+        y_pred = model(x)
+        times['find_optimal_cutoff'], cutoff = best_time(lambda: find_optimal_cutoff(y, y_pred, num_prunes), repeat)
+        times['accuracy_per_tag'], _ = best_time(lambda: accuracy_per_tag(y, y_pred, cutoff, num_prunes), repeat)
+    times['per_tag_metrics'], metricses = best_time(lambda: [per_tag_metrics(page, model, cutoff) for page in pages], repeat)
+    with redirect_stdout(io.StringIO()):
+        times['print_per_tag_report'], _ = best_time(lambda: print_per_tag_report(metricses), repeat)
+    times['feature_metrics'], _ = best_time(lambda: list(feature_metrics(feature_names, x, y, 10, feature_names)), repeat)
+    return times
+
+
+@command()
+@option('sizes', '--nodes', '-n',
+        type=int,
+        multiple=True,
+        default=[10000, 100000, 1000000],
+        show_default=True,
+        help='How many nodes to benchmark with. Can be repeated.')
+@option('--nodes-per-page',
+        default=100,
+        show_default=True,
+        help='The number of candidate nodes on each synthetic page')
+@option('--features',
+        default=8,
+        show_default=True,
+        help='The number of features per node')
+@option('--iterations', '-i',
+        default=20,
+        show_default=True,
+        help='The number of training iterations to time')
+@option('--repeat', '-r',
+        default=3,
+        show_default=True,
+        help='How many times to run each function. The fastest time is kept.')
+@option('--results',
+        type=click.Path(dir_okay=False, writable=True),
+        default=str(Path(__file__).parent / 'results.jsonl'),
+        show_default=True,
+        help='A JSON-lines file to append the timings to and compare them against')
+def main(sizes, nodes_per_page, features, iterations, repeat, results):
+    """Time how the training and reporting functions scale with the number of
+    nodes, using synthetic vectors, so no samples or browser are needed.
+
+    Each run is appended to the results file, and the numbers are compared
+    with those of the previous run so regressions stand out.
+
+    """
+    results_path = Path(results)
+    by_function = {}
+    for num_nodes in sizes:
+        click.echo(f'Timing {num_nodes} nodes...', err=True)
+        for function, seconds in time_training_stack(num_nodes, nodes_per_page, features, iterations, repeat).items():
+            by_function.setdefault(function, {})[f'{num_nodes} nodes'] = seconds
+    print(comparison_table(by_function, previous_results(results_path, 'training'), 's'))
+    record_results(results_path, 'training', by_function)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,22 +1,31 @@
 """Routines to do with calculating or reporting accuracy"""
 
 
+from concurrent.futures import ThreadPoolExecutor
+from heapq import nlargest
 from itertools import repeat
-from math import floor, inf, nan, sqrt
+from json import dumps
+from math import ceil, floor, inf, nan, sqrt
+from os import cpu_count
+from pathlib import PurePath
 
 from click import get_terminal_size, style
+import numpy
 import torch
 
-from .utils import tensors_from, fit_unicode
+from .index import original_urls
+from .utils import is_manifest, page_markup, page_sizes, phase, tensors_from, fit_unicode
 
 
-def accuracy_per_tag(y, y_pred, cutoff, num_prunes):
+def accuracy_per_tag(y, y_pred, cutoff, num_prunes, counts=None):
     """Return the accuracy 0..1 of the model on a per-tag basis, given the
     correct output tensors and the prediction tensors from the model for the
     same samples.
 
     :arg num_prunes: The number of targets that didn't get matched by a dom()
         call: FNs, inevitably
+    :arg counts: How many tags each row stands for, as from
+        ``deduplicated()``, or None if each stands for one
 
     """
     # Use `torch.no_grad()` so the sigmoid on y_pred is not tracked by pytorch's autograd
@@ -26,18 +35,34 @@ def accuracy_per_tag(y, y_pred, cutoff, num_prunes):
         y_pred_confidence = y_pred.sigmoid().numpy().flatten()
 
         predicted_positives = y_pred_confidence >= cutoff
-        successes = (predicted_positives == y).sum()
-        false_positives = (predicted_positives & (y == 0)).sum()
-        number_of_tags = len(y) + num_prunes
+        successful = predicted_positives == y
+        false_positive = predicted_positives & (y == 0)
+        if counts is None:
+            successes = successful.sum()
+            false_positives = false_positive.sum()
+            number_of_tags = len(y) + num_prunes
+        else:
+            counts = counts.numpy()
+            successes = counts @ successful
+            false_positives = counts @ false_positive
+            number_of_tags = counts.sum() + num_prunes
         false_negatives = number_of_tags - successes - false_positives
-        return (successes / number_of_tags), int(false_positives), int(false_negatives)
+        return (successes / number_of_tags), int(round(false_positives)), int(round(false_negatives))
 
 
-def per_tag_metrics(page, model, cutoff):
+def per_tag_metrics(page, model, cutoff, columns=None, markup=True):
     """Return the per-tag numbers to be templated into a human-readable report
-    by ``print_per_tag_report``."""
+    by ``print_per_tag_report``.
+
+    :arg columns: The feature columns the model was trained on, if some were
+        excluded. See ``feature_columns()``.
+    :arg markup: Whether to fetch the markup of the tags. If False, it can be
+        filled in later, once the tags to show are decided, with
+        ``add_markup()``.
+
+    """
     # Get scores for all tags:
-    inputs, correct_outputs, _, num_prunes = tensors_from([page])
+    inputs, correct_outputs, _, num_prunes = tensors_from([page], columns=columns)
     with torch.no_grad():
         try:
             scores = model(inputs).sigmoid().numpy().flatten().tolist()
@@ -48,8 +73,8 @@ def per_tag_metrics(page, model, cutoff):
     scores.extend(repeat(0, num_prunes))
     true_negatives = 0
     tag_metrics = []
-    for tag, score in zip(page['nodes'], scores):
-        tag_metric = {}  # {filename: '123.html', markup: '<input id=', error_type='FP'|'FN'|'', score: 0.534876}
+    for node, (tag, score) in enumerate(zip(page['nodes'], scores)):
+        tag_metric = {'node': node}  # {node: 3, markup: '<input id=', error_type='FP'|'FN'|'', score: 0.534876}
         is_target = tag['isTarget']
         predicted = score >= cutoff
         is_error = is_target ^ predicted
@@ -61,13 +86,25 @@ def per_tag_metrics(page, model, cutoff):
             elif is_target and predicted:
                 tag_metric['error_type'] = ''
             tag_metric['score'] = 'pruned' if tag.get('pruned') else score
-            tag_metric['markup'] = tag.get('markup', 'Use a newer FathomFox to see markup.')
             tag_metrics.append(tag_metric)
         else:  # not is_target and not is_error: TNs
             true_negatives += 1
-    return {'filename': page['filename'],
-            'tags': tag_metrics,
-            'true_negative_count': true_negatives}
+    metrics = {'filename': page['filename'],
+               'tags': tag_metrics,
+               'true_negative_count': true_negatives}
+    if markup:
+        add_markup(metrics, page)
+    return metrics
+
+
+def add_markup(metrics, page):
+    """Fill in the markup of the tags in the ``per_tag_metrics()`` of a page.
+    The markup is read only if there are tags to show it for."""
+    if metrics['tags']:
+        markups = page_markup(page)
+        for tag in metrics['tags']:
+            markup = markups[tag['node']]
+            tag['markup'] = 'Use a newer FathomFox to see markup.' if markup is None else markup
 
 
 def max_default(iterable, default):
@@ -82,27 +119,86 @@ FAT_COLORS = {'good': {'fg': 'black', 'bg': 'bright_green', 'bold': True},
               'bad': {'fg': 'white', 'bg': 'red', 'bold': True}}
 
 
-def print_per_tag_report(metricses):
-    """Given a list of results from multiple ``per_tag_metrics()`` calls,
-    return a human-readable report."""
+def filtered_per_tag_metrics(pages, model, cutoff, columns=None, only_errors=False, worst=None, min_score=None):
+    """Yield the ``per_tag_metrics()`` of each page, in filename order,
+    leaving out what the filters say not to show.
+
+    Filtering happens as each page is computed, so only what will be shown
+    is ever held in memory, and markup is read only for the tags that are
+    left. Each page's ``error_count``, and whether it got ``any_right``, are
+    added too, counting tags filtered out, so it can still be judged whole.
+
+    :arg only_errors: Show only FPs and FNs, and only pages that have some.
+    :arg worst: If not None, show only this many pages, those with the most
+        errors, worst first.
+    :arg min_score: If not None, show only tags the model scored at least
+        this high. Pruned tags count as scoring 0.
+
+    """
+    def shown(metricses_and_pages):
+        for metrics, page in metricses_and_pages:
+            tags = metrics['tags']
+            # Judge the page by all its tags, not just the ones shown:
+            error_count = sum(1 for t in tags if t['error_type'])
+            any_right = error_count < len(tags) or metrics['true_negative_count'] > 0
+            if only_errors:
+                tags = [t for t in tags if t['error_type']]
+            if min_score is not None:
+                tags = [t for t in tags if t['score'] != 'pruned' and t['score'] >= min_score]
+            if tags or not (only_errors or min_score is not None):
+                yield dict(metrics, tags=tags, error_count=error_count, any_right=any_right), page
+
+    sorted_pages = sorted(pages, key=lambda p: p['filename'])
+    shown_metricses = shown((per_tag_metrics(page, model, cutoff, columns, markup=False), page)
+                            for page in sorted_pages)
+    if worst is not None:
+        shown_metricses = nlargest(worst, shown_metricses, key=lambda shown: shown[0]['error_count'])
+    for metrics, page in shown_metricses:
+        add_markup(metrics, page)
+        yield metrics
+
+
+def page_color(metrics):
+    """Return which of the ``FAT_COLORS`` to show a page's filename in,
+    given what ``filtered_per_tag_metrics()`` yielded for it: good if it has
+    no errors, medium if it has some right, and bad otherwise."""
+    if not metrics['error_count']:
+        return 'good'
+    return 'medium' if metrics['any_right'] else 'bad'
+
+
+def print_per_tag_report(metricses, filename_width=None):
+    """Given a list of results from ``filtered_per_tag_metrics()``, print a
+    human-readable report.
+
+    :arg filename_width: The width of the filename column. If None, the
+        widths of both columns are fit to the results, which means they must
+        all be computed before anything is printed. If given, the results can
+        be any iterable, and each page is printed as soon as it comes out of
+        it, in the order it comes out. Markup is then cut off at the terminal
+        width.
+
+    """
     THIN_COLORS = {True: {'fg': 'green'},
                    False: {'fg': 'red'}}
 
-    max_filename_len = max(len(metrics['filename']) for metrics in metricses)
-
-    max_tag_len = max_default((len(tag['markup']) for metrics in metricses for tag in metrics['tags']),
-                              inf)
+    if filename_width is None:
+        metricses = sorted(metricses, key=lambda m: m['filename'])
+        max_filename_len = max(len(metrics['filename']) for metrics in metricses)
+        max_tag_len = max_default((len(tag['markup']) for metrics in metricses for tag in metrics['tags']),
+                                  inf)
+    else:
+        max_filename_len = filename_width
+        max_tag_len = inf
     template_width_minus_tag = max_filename_len + 2 + 3 + 2 + 3 + 10
     tag_max_width = min(get_terminal_size()[0] - template_width_minus_tag, max_tag_len)
 
     template = '{file_style}{file: >' + str(max_filename_len) + '}{style_reset}  {tag_style}{tag_and_padding}   {error_type: >2}{style_reset}   {score}'
     style_reset = style('', reset=True)
-    for metrics in sorted(metricses, key=lambda m: m['filename']):
+    for metrics in metricses:
         first = True
         true_negative_count = metrics['true_negative_count']
-        all_right = not any(t['error_type'] for t in metrics['tags'])
-        any_right = not all(t['error_type'] for t in metrics['tags']) or true_negative_count
-        file_color = 'good' if all_right else ('medium' if any_right else 'bad')
+        file_color = page_color(metrics)
         for tag in metrics['tags']:
             print(template.format(
                 file=metrics['filename'] if first else '',
@@ -137,6 +233,61 @@ def print_per_tag_report(metricses):
                     tag_style=style('', fg='green', reset=False),
                     error_type='',
                     score=''))
+        if metrics.get('url'):
+            print(template.format(
+                file='',
+                file_style='',
+                style_reset=style_reset,
+                tag_and_padding=fit_unicode(metrics['url'], tag_max_width),
+                tag_style=style('', dim=True, reset=False),
+                error_type='',
+                score=''))
+
+
+def write_per_tag_json(metricses, file, **extra):
+    """Write results from ``per_tag_metrics()`` calls to a file as JSON
+    lines, one page per line, for consumption by other tools.
+
+    :arg extra: Additional keys to add to each line, like which set of
+        samples the page came from
+
+    """
+    for metrics in metricses:
+        file.write(dumps(dict(metrics, **extra)) + '\n')
+
+
+@phase('per-tag report')
+def report_per_tag(description, pages, model, cutoff, columns=None, json_file=None, sample_set=None, **filters):
+    """Print a per-tag report on some pages, streaming it out as it is
+    computed. Or, if ``json_file`` is given, write it there as JSON lines.
+
+    :arg description: What set the pages are from, like "Training"
+    :arg sample_set: The Path the pages were vectorized from. If it is a
+        folder (or a manifest in a folder) with an index made by ``fathom
+        index``, each page's original URL is included.
+    :arg filters: Keyword args for ``filtered_per_tag_metrics()``
+
+    """
+    metricses = filtered_per_tag_metrics(pages, model, cutoff, columns, **filters)
+    if sample_set is not None:
+        if is_manifest(sample_set):
+            # Pages from a manifest are named by their paths, like the index:
+            urls = original_urls(sample_set.parent)
+        else:
+            # FathomFox names pages by their last path segments, which are
+            # unique within a set:
+            urls = {PurePath(path).name: url for path, url in original_urls(sample_set).items()}
+        if urls:
+            metricses = (dict(metrics, url=urls[metrics['filename']]) if metrics['filename'] in urls else metrics
+                         for metrics in metricses)
+    if json_file:
+        write_per_tag_json(metricses, json_file, set=description)
+    else:
+        print(f'\n{description} per-tag results:')
+        # Estimate the filename column from the pages rather than waiting for
+        # all the metrics:
+        print_per_tag_report(metricses,
+                             filename_width=max_default((len(page['filename']) for page in pages), 0))
 
 
 def confidence_interval(success_ratio, number_of_samples):
@@ -153,6 +304,82 @@ def confidence_interval(success_ratio, number_of_samples):
     return max(0., success_ratio - addend), min(1., success_ratio + addend)
 
 
+def page_confusion_counts(y, y_pred, cutoff, pages):
+    """Return a (pages x 4) numpy array of each page's true positive, false
+    positive, false negative, and true negative counts.
+
+    :arg y: The correct outputs, from the unshuffled ``tensors_from(pages)``
+    :arg y_pred: The model's outputs for the same
+    :arg pages: The pages the tensors came from. Their prematurely pruned
+        targets count as false negatives, as in ``accuracy_per_tag()``.
+
+    """
+    unpruned, _, prunes = page_sizes(pages)
+    page_of_row = numpy.repeat(numpy.arange(len(pages)), unpruned)
+    with torch.no_grad():
+        is_target = y.numpy().flatten() == 1
+        predicted_positive = y_pred.sigmoid().numpy().flatten() >= cutoff
+    counts = numpy.stack([numpy.bincount(page_of_row, weights=kind, minlength=len(pages))
+                          for kind in (is_target & predicted_positive,
+                                       ~is_target & predicted_positive,
+                                       is_target & ~predicted_positive,
+                                       ~is_target & ~predicted_positive)],
+                         axis=1).astype(numpy.int64)
+    counts[:, 2] += prunes
+    return counts
+
+
+@phase('bootstrap')
+def bootstrap_confidence_intervals(page_counts, resamples=1000):
+    """Return 95% confidence intervals for accuracy, FPR, FNR, precision, and
+    MCC, found by resampling whole pages with replacement.
+
+    Tags on a page tend to succeed or fail together, so treating them as
+    independent, as ``confidence_interval()`` does, makes intervals too
+    narrow. Resampling pages respects that, and it doesn't depend on the
+    normal approximation, which is poor at small counts.
+
+    All the resamples are tallied at once with numpy, in chunks spread across
+    threads so memory stays bounded and big jobs use every core.
+
+    :arg page_counts: Per-page confusion counts from
+        ``page_confusion_counts()``
+    :arg resamples: How many times to resample the pages
+
+    Return a dict mapping the keys "accuracy", "false_positive_rate",
+    "false_negative_rate", "precision", and "mcc" to (low, high) tuples.
+
+    """
+    num_pages = len(page_counts)
+    # Keep each chunk's page draws to about a million:
+    chunk_size = max(1, 1000000 // max(num_pages, 1))
+    num_chunks = ceil(resamples / chunk_size)
+    sizes = [chunk_size] * (num_chunks - 1) + [resamples - chunk_size * (num_chunks - 1)]
+
+    def resample(seed_and_size):
+        seed, size = seed_and_size
+        draws = numpy.random.default_rng(seed).integers(0, num_pages, size=(size, num_pages))
+        return page_counts[draws].sum(axis=1)
+
+    seeds = numpy.random.SeedSequence().spawn(num_chunks)
+    with ThreadPoolExecutor(min(num_chunks, cpu_count() or 1)) as executor:
+        totals = numpy.concatenate(list(executor.map(resample, zip(seeds, sizes))))
+    true_positives, false_positives, false_negatives, true_negatives = totals.T.astype(numpy.float64)
+
+    def ratio(numerator, denominator):
+        """Divide, calling it 0 where the denominator is, as
+        ``accuracy_metrics()`` does."""
+        return numpy.divide(numerator, denominator, out=numpy.zeros_like(numerator), where=denominator != 0)
+
+    mcc_denom = numpy.sqrt((true_positives + false_positives) * (true_positives + false_negatives) * (true_negatives + false_positives) * (true_negatives + false_negatives))
+    samples = {'accuracy': ratio(true_positives + true_negatives, totals.sum(axis=1).astype(numpy.float64)),
+               'false_positive_rate': ratio(false_positives, false_positives + true_negatives),
+               'false_negative_rate': ratio(false_negatives, false_negatives + true_positives),
+               'precision': ratio(true_positives, true_positives + false_positives),
+               'mcc': ratio(true_positives * true_negatives - false_positives * false_negatives, mcc_denom)}
+    return {name: tuple(numpy.percentile(values, [2.5, 97.5]).tolist()) for name, values in samples.items()}
+
+
 def thermometer(ratio):
     """Return a graphical representation of a decimal with linear scale."""
     text = f'{ratio:.8f}'
@@ -161,29 +388,18 @@ def thermometer(ratio):
             style(text[tenth:], bg='bright_white', fg='black'))
 
 
-def pretty_accuracy(description, accuracy, number_of_samples, false_positives, false_negatives, positives):
-    """Return a big printable block of numbers describing the accuracy and
-    error bars of a model.
+def accuracy_metrics(accuracy, number_of_samples, false_positives, false_negatives, positives):
+    """Return a dict of the numbers ``pretty_accuracy()`` reports, derived
+    from the output of ``accuracy_per_tag()``.
 
-    :arg description: What kind of set this is: "Validation", "Training", etc.
-    :arg accuracy: The accuracy of the model, expressed as a ratio 0..1
-    :arg number_of_samples: The number of tags considered while training or
-        testing the model
-    :arg false_positives: The number of positives the model yielded that should
-        have been negative
-    :arg false_negatives: The number of negatives the model yielded that should
-        have been positive
-    :arg positives: The number of real positive tags in the corpus
+    Arguments are as for ``pretty_accuracy()``.
 
     """
-    ci_low, ci_high = confidence_interval(accuracy, number_of_samples)
     negatives = number_of_samples - positives
     # Think of this as the ratio of negatives we got wrong. If there were no
     # negatives, we can't have got any of them wrong:
     false_positive_rate = (false_positives / negatives) if negatives else 0
     false_negative_rate = (false_negatives / positives) if positives else 0
-    fpr_ci_low, fpr_ci_high = confidence_interval(false_positive_rate, negatives)
-    fnr_ci_low, fnr_ci_high = confidence_interval(false_negative_rate, positives)
     # https://en.wikipedia.org/wiki/Precision_and_recall#/media/File:Precisionrecall.svg
     # really helps when thinking about the Venn diagrams of these values.
     true_positives = positives - false_negatives
@@ -203,12 +419,93 @@ def pretty_accuracy(description, accuracy, number_of_samples, false_positives, f
         # I figure "same as chance" value 0 is the worst you can get. Wikipedia
         # agrees.
         mcc = 0
+    return {'accuracy': accuracy,
+            'false_positive_rate': false_positive_rate,
+            'false_negative_rate': false_negative_rate,
+            'precision': precision,
+            'recall': recall,
+            'mcc': mcc,
+            'true_positives': true_positives,
+            'true_negatives': true_negatives,
+            'false_positives': false_positives,
+            'false_negatives': false_negatives,
+            'positives': positives,
+            'negatives': negatives}
+
+
+def pretty_accuracy(description, accuracy, number_of_samples, false_positives, false_negatives, positives, bootstrap_cis=None):
+    """Return a big printable block of numbers describing the accuracy and
+    error bars of a model.
+
+    :arg description: What kind of set this is: "Validation", "Training", etc.
+    :arg accuracy: The accuracy of the model, expressed as a ratio 0..1
+    :arg number_of_samples: The number of tags considered while training or
+        testing the model
+    :arg false_positives: The number of positives the model yielded that should
+        have been negative
+    :arg false_negatives: The number of negatives the model yielded that should
+        have been positive
+    :arg positives: The number of real positive tags in the corpus
+    :arg bootstrap_cis: Confidence intervals from
+        ``bootstrap_confidence_intervals()`` to show instead of the
+        normal-approximation ones, or None
+
+    """
+    metrics = accuracy_metrics(accuracy, number_of_samples, false_positives, false_negatives, positives)
+    false_positive_rate = metrics['false_positive_rate']
+    false_negative_rate = metrics['false_negative_rate']
+    true_positives = metrics['true_positives']
+    true_negatives = metrics['true_negatives']
+    precision, recall, mcc = metrics['precision'], metrics['recall'], metrics['mcc']
+    if bootstrap_cis:
+        (ci_low, ci_high), (fpr_ci_low, fpr_ci_high), (fnr_ci_low, fnr_ci_high) = (
+            bootstrap_cis[key] for key in ('accuracy', 'false_positive_rate', 'false_negative_rate'))
+    else:
+        ci_low, ci_high = confidence_interval(accuracy, number_of_samples)
+        fpr_ci_low, fpr_ci_high = confidence_interval(false_positive_rate, metrics['negatives'])
+        fnr_ci_low, fnr_ci_high = confidence_interval(false_negative_rate, positives)
     red = style('', fg='red', reset=False)
     green = style('', fg='green', reset=False)
     reset = style('', reset=True)
+    if bootstrap_cis:
+        mcc_ci_low, mcc_ci_high = bootstrap_cis['mcc']
+        precision_ci_low, precision_ci_high = bootstrap_cis['precision']
+        mcc_line = f'{f"                 MCC: {mcc:.4f}   95% CI: ({mcc_ci_low:.4f}, {mcc_ci_high:.4f})": <63}╰───┴────────┴────────╯\n'
+        footer = (f'           Precision: {precision:.4f}   95% CI: ({precision_ci_low:.4f}, {precision_ci_high:.4f})\n'
+                  '                      CIs come from resampling pages with replacement.')
+    else:
+        mcc_line = f'                 MCC: {mcc:.4f}                                   ╰───┴────────┴────────╯'
+        footer = ''
     return ('\n'
             f'{description: >10} precision: {precision:.4f}   Recall: {recall:.4f}                           Predicted\n'
             f'            Accuracy: {accuracy:.4f}   95% CI: ({ci_low:.4f}, {ci_high:.4f})        ╭───┬── + ───┬── - ───╮\n'
             f'                 FPR: {false_positive_rate:.4f}   95% CI: ({fpr_ci_low:.4f}, {fpr_ci_high:.4f})   True │ + │ {green}{true_positives: >6}{reset} │ {red}{false_negatives: >6}{reset} │\n'
             f'                 FNR: {false_negative_rate:.4f}   95% CI: ({fnr_ci_low:.4f}, {fnr_ci_high:.4f})        │ - │ {red}{false_positives: >6}{reset} │ {green}{true_negatives: >6}{reset} │\n'
-            f'                 MCC: {mcc:.4f}                                   ╰───┴────────┴────────╯')
+            + mcc_line + footer)
+
+
+def pretty_accuracy_comparison(rows):
+    """Return a printable table comparing the accuracy and error bars of
+    several models on the same set, one line per model.
+
+    :arg rows: An iterable of tuples, each a model's name followed by the
+        arguments ``pretty_accuracy()`` takes after its ``description``,
+        optionally including ``bootstrap_cis``
+
+    """
+    lines = ['',
+             'Weights   Accuracy   95% CI              FPR      95% CI              FNR      95% CI              Precision   Recall   MCC']
+    for name, accuracy, number_of_samples, false_positives, false_negatives, positives, *bootstrap_cis in rows:
+        metrics = accuracy_metrics(accuracy, number_of_samples, false_positives, false_negatives, positives)
+        if bootstrap_cis and bootstrap_cis[0]:
+            (ci_low, ci_high), (fpr_ci_low, fpr_ci_high), (fnr_ci_low, fnr_ci_high) = (
+                bootstrap_cis[0][key] for key in ('accuracy', 'false_positive_rate', 'false_negative_rate'))
+        else:
+            ci_low, ci_high = confidence_interval(accuracy, number_of_samples)
+            fpr_ci_low, fpr_ci_high = confidence_interval(metrics['false_positive_rate'], metrics['negatives'])
+            fnr_ci_low, fnr_ci_high = confidence_interval(metrics['false_negative_rate'], positives)
+        lines.append(f'{name: >7}   {accuracy:.4f}     ({ci_low:.4f}, {ci_high:.4f})    '
+                     f'{metrics["false_positive_rate"]:.4f}   ({fpr_ci_low:.4f}, {fpr_ci_high:.4f})    '
+                     f'{metrics["false_negative_rate"]:.4f}   ({fnr_ci_low:.4f}, {fnr_ci_high:.4f})    '
+                     f'{metrics["precision"]:.4f}      {metrics["recall"]:.4f}   {metrics["mcc"]:.4f}')
+    return '\n'.join(lines)
@@ -1,27 +1,63 @@
+from .ablate import ablate
+from .dedupe import dedupe
 from .extract import extract
 from .fox import fox
 from .histogram import histogram
+from .index import index
 from .label import label
+from .label_elements import label_elements
 from .list import list
 from .pick import pick
 from .serve import serve
+from .slim import slim
 from .test import test
 from .train import train
 
-from click import group
+from json import dump
+
+import click
+from click import echo, group, option, pass_context
+
+from ..utils import start_timings, timing_records, timings_report
 
 
 @group()
-def fathom():
+@option('--timings',
+        default=False,
+        is_flag=True,
+        envvar='FATHOM_TIMINGS',
+        help='After the command finishes, show how much wall time, CPU time, and memory (peak traced by Python) went to each phase of its work, like vectorizing, tensorizing, and training. This slows things down somewhat. Also settable by the FATHOM_TIMINGS environment variable.')
+@option('--timings-json',
+        type=click.Path(dir_okay=False, writable=True),
+        envvar='FATHOM_TIMINGS_JSON',
+        metavar='FILE',
+        help='Write the --timings breakdown to a file as JSON, for tracking over time, as in CI. Also settable by the FATHOM_TIMINGS_JSON environment variable.')
+@pass_context
+def fathom(ctx, timings, timings_json):
     """Pass fathom COMMAND --help to learn more about an individual command."""
+    if timings or timings_json:
+        start_timings(ctx.invoked_subcommand)
+
+        def report_timings():
+            if timings_json:
+                with open(timings_json, 'w', encoding='utf-8') as file:
+                    dump({'command': ctx.invoked_subcommand, 'phases': timing_records()}, file, indent=2)
+            if timings:
+                echo('\n' + timings_report(), err=True)
+        ctx.call_on_close(report_timings)
 
 
+fathom.add_command(ablate)
+fathom.add_command(dedupe)
 fathom.add_command(extract)
 fathom.add_command(fox)
 fathom.add_command(histogram)
+fathom.add_command(index)
 fathom.add_command(label)
+fathom.add_command(label_elements)
 fathom.add_command(list)
 fathom.add_command(pick)
 fathom.add_command(serve)
+fathom.add_command(slim)
 fathom.add_command(test)
 fathom.add_command(train)
@@ -0,0 +1,228 @@
+from multiprocessing import cpu_count, Pool
+from pathlib import Path
+
+import click
+from click import argument, BadOptionUsage, command, option, progressbar, style
+import torch
+
+from ..accuracy import accuracy_metrics, accuracy_per_tag
+from ..utils import feature_columns, init_worker, needs_vectorizing, path_or_none, phase, tensors_from, worker_state
+from ..vectorizer import make_or_find_vectors
+from .train import fit
+
+
+def train_without(exclude):
+    """Train a model with the given features left out of the tensors in
+    ``worker_state``, and return its validation metrics, as computed by
+    ``accuracy_metrics()``."""
+    x, y, num_yes, num_prunes = worker_state['training']
+    validation_ins, validation_outs, validation_yes, validation_prunes = worker_state['validation']
+    settings = dict(worker_state['settings'])
+    columns, _ = feature_columns(worker_state['feature_names'], exclude)
+    if len(columns) != x.shape[1]:
+        x = x[:, columns]
+        validation_ins = validation_ins[:, columns]
+    comment = settings.pop('comment')
+    settings['run_comment'] = '.ablate={e}{c}'.format(
+        e='+'.join(exclude) or 'none',
+        c=(',' + comment) if comment else '')
+
+    model, optimal_cutoff = fit(x=x,
+                                y=y,
+                                num_prunes=num_prunes,
+                                positives=num_yes,
+                                validation=(validation_ins, validation_outs),
+                                quiet=True,
+                                **settings)
+    with torch.no_grad():
+        accuracy, false_positives, false_negatives = accuracy_per_tag(validation_outs, model(validation_ins), optimal_cutoff, validation_prunes)
+    return accuracy_metrics(accuracy, len(validation_ins) + validation_prunes, false_positives, false_negatives, validation_yes)
+
+
+@command()
+@argument('training_set',
+          type=click.Path(exists=True, resolve_path=True),
+          metavar='TRAINING_SET_FOLDER')
+@option('--validation-set', '-a',
+        type=click.Path(exists=True, resolve_path=True),
+        callback=path_or_none,
+        required=True,
+        metavar='FOLDER',
+        help="Either a folder of validation pages, a manifest of them from `fathom pick --manifest`, or a JSON file made manually by FathomFox's Vectorizer. The reported accuracy numbers come from this set.")
+@option('--ruleset', '-r',
+        type=click.Path(exists=True, dir_okay=False, resolve_path=True),
+        callback=path_or_none,
+        help='The rulesets.js file containing your rules. The file must have no imports except from fathom-web, so pre-bundle if necessary.')
+@option('--trainee',
+        type=str,
+        metavar='ID',
+        help='The trainee ID of the ruleset you want to evaluate. Usually, this is the same as the type you are training for.')
+@option('--training-cache',
+        type=click.Path(dir_okay=False, resolve_path=True),
+        callback=path_or_none,
+        help='Where to cache training vectors to speed future runs. Any existing file will be overwritten. [default: vectors/training_yourTraineeId.json next to your ruleset]')
+@option('--validation-cache',
+        type=click.Path(dir_okay=False, resolve_path=True),
+        callback=path_or_none,
+        help='Where to cache validation vectors to speed future runs. Any existing file will be overwritten. [default: vectors/validation_yourTraineeId.json next to your ruleset]')
+@option('--delay',
+        default=5,
+        type=int,
+        show_default=True,
+        help='Number of seconds to wait for a page to load before vectorizing it')
+@option('--tabs',
+        default=16,
+        type=int,
+        show_default=True,
+        help='Number of concurrent browser tabs to use while vectorizing')
+@option('--show-browser',
+        default=False,
+        is_flag=True,
+        help='Show browser window while vectorizing. (Browser runs in headless mode by default.)')
+@option('--stop-early/--no-early-stopping', '-s',
+        default=True,
+        show_default=True,
+        help='Stop 1 iteration before validation loss begins to rise, to avoid overfitting.')
+@option('--learning-rate', '-l',
+        default=1.0,
+        show_default=True,
+        help='The learning rate to start from')
+@option('--iterations', '-i',
+        default=1000,
+        show_default=True,
+        help='The number of training iterations to run through')
+@option('--pos-weight', '-p',
+        type=float,
+        default=None,
+        show_default=True,
+        help='The weighting factor given to all positive samples by the loss function')
+@option('--comment', '-c',
+        default='',
+        help='Additional comment to append to the Tensorboard run names, for display in the web UI')
+@option('layers', '--layer', '-y',
+        type=int,
+        multiple=True,
+        help='Add a hidden layer of the given size. You can specify more than one, and they will be connected in the given order. EXPERIMENTAL.')
+@option('--standardize',
+        default=False,
+        is_flag=True,
+        help='Rescale each feature to mean 0 and standard deviation 1 while training, as with `fathom train --standardize`.')
+@option('--deduplicate',
+        default=False,
+        is_flag=True,
+        help='Train on only the distinct tags, counting each as many times as it occurs, as with `fathom train --deduplicate`.')
+@option('--negative-ratio',
+        type=click.FloatRange(min=0),
+        default=0,
+        metavar='RATIO',
+        help='Train on all the targets but only about this many randomly chosen non-targets per target, as with `fathom train --negative-ratio`. 0 turns it off. [default: 0]')
+@option('groups', '--group', '-g',
+        type=str,
+        multiple=True,
+        metavar='RULE,RULE,...',
+        help='A comma-separated group of rules to leave out together. Can be repeated. Omitting this leaves out each rule on its own, in turn.')
+@option('--number-of-workers',
+        default=cpu_count(),
+        show_default=True,
+        help='The number of models to train at once')
+def ablate(training_set, validation_set, ruleset, trainee, training_cache, validation_cache, delay, tabs, show_browser, stop_early, learning_rate, iterations, pos_weight, comment, layers, standardize, deduplicate, negative_ratio, groups, number_of_workers):
+    """Measure how much each rule contributes to accuracy.
+
+    Train a baseline model using all of a ruleset's features, and then one
+    more model for each rule (or ``--group`` of rules) left out, and show how
+    validation accuracy and MCC change. This is equivalent to running ``fathom
+    train --exclude`` once per rule and comparing the validation numbers, but
+    the vectors are loaded only once, and the models train in parallel.
+
+    The usual invocation is something like this::
+
+        fathom ablate samples/training --validation-set samples/validation --ruleset rulesets.js --trainee new
+
+    A rule whose removal makes accuracy drop is pulling its weight. One whose
+    removal changes nothing or improves accuracy may be a candidate for
+    rethinking or deletion.
+
+    """
+    training_set = Path(training_set)
+    if needs_vectorizing(validation_set) or needs_vectorizing(training_set):
+        if not ruleset:
+            raise BadOptionUsage('ruleset', 'A --ruleset file must be specified when TRAINING_SET_FOLDER or --validation-set are passed a directory or manifest.')
+        if not trainee:
+            raise BadOptionUsage('trainee', 'A --trainee ID must be specified when TRAINING_SET_FOLDER or --validation-set are passed a directory or manifest.')
+
+    training_data = make_or_find_vectors(ruleset,
+                                         trainee,
+                                         training_set,
+                                         training_cache,
+                                         show_browser,
+                                         'training',
+                                         delay,
+                                         tabs)
+    validation_data = make_or_find_vectors(ruleset,
+                                           trainee,
+                                           validation_set,
+                                           validation_cache,
+                                           show_browser,
+                                           'validation',
+                                           delay,
+                                           tabs)
+    feature_names = training_data['header']['featureNames']
+    if validation_data['header']['featureNames'] != feature_names:
+        raise BadOptionUsage('validation_set', 'The training and validation vectors have different features. Make sure both were made with the same ruleset.')
+
+    exclusions = [[name.strip() for name in group.split(',')] for group in groups] or [[name] for name in feature_names]
+    for exclusion in exclusions:
+        feature_columns(feature_names, exclusion)  # Complain about typos before we spend time training.
+
+    settings = {'learning_rate': learning_rate,
+                'iterations': iterations,
+                'stop_early': stop_early,
+                'pos_weight': pos_weight,
+                'comment': comment,
+                'layers': list(layers),
+                'standardize': standardize,
+                'deduplicate': deduplicate,
+                'negative_ratio': negative_ratio}
+    jobs = [[]] + exclusions  # The first is the baseline.
+    with Pool(min(number_of_workers, len(jobs)),
+              initializer=init_worker,
+              initargs=({'training': tensors_from(training_data['pages']),
+                         'validation': tensors_from(validation_data['pages']),
+                         'feature_names': feature_names,
+                         'settings': settings},)) as pool:
+        with phase('train models'), progressbar(pool.imap(train_without, jobs),
+                                                label=f'Training {len(jobs)} models',
+                                                length=len(jobs)) as bar:
+            baseline, *results = list(bar)
+
+    print(ablation_report(baseline, zip(exclusions, results)))
+
+
+def ablation_report(baseline, results):
+    """Return a printable table of how validation metrics changed when each
+    rule or group of rules was left out.
+
+    :arg baseline: The ``accuracy_metrics()`` of the model trained on all
+        features
+    :arg results: An iterable of (list of excluded feature names,
+        ``accuracy_metrics()``) pairs
+
+    """
+    def signed(delta):
+        text = f'{delta:+9.4f}'
+        if round(delta, 4) == 0:
+            return text
+        # Dropping a rule and seeing the numbers fall means the rule helps.
+        return style(text, fg='green' if delta < 0 else 'red')
+
+    rows = [(', '.join(excluded), metrics) for excluded, metrics in results]
+    # Show the most helpful rules first:
+    rows.sort(key=lambda row: (row[1]['accuracy'], row[1]['mcc']))
+    name_width = max([len('Left out')] + [len(name) for name, _ in rows])
+    lines = ['',
+             f'{"Left out": <{name_width}}   Accuracy      Change        MCC      Change',
+             f'{"(nothing)": <{name_width}}   {baseline["accuracy"]:8.4f}   {"": >9}   {baseline["mcc"]:8.4f}']
+    for name, metrics in rows:
+        lines.append(f'{name: <{name_width}}   {metrics["accuracy"]:8.4f}   {signed(metrics["accuracy"] - baseline["accuracy"])}   {metrics["mcc"]:8.4f}   {signed(metrics["mcc"] - baseline["mcc"])}')
+    lines.append('\nNumbers are for the validation set. A drop when a rule is left out means the rule helps.')
+    return '\n'.join(lines)
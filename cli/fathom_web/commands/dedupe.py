@@ -0,0 +1,229 @@
+from collections import defaultdict
+from multiprocessing import cpu_count, Pool
+import pathlib
+import re
+from shutil import move
+from zlib import crc32
+
+from click import argument, BadParameter, command, option, Path, progressbar, UsageError
+import numpy
+
+from ..index import cache_signatures, cached_signatures, transfer_samples, update_index
+from ..utils import stop_timings
+
+
+SCRIPT_OR_STYLE = re.compile(r'<(script|style)\b.*?</\1\s*>', re.IGNORECASE | re.DOTALL)
+TAG = re.compile(r'<[^>]*>')
+WORD = re.compile(r'\w+')
+#: How many words in a row make a shingle
+SHINGLE_SIZE = 5
+NUM_PERMUTATIONS = 128
+#: How many bands of the signature to bucket samples by. A pair of samples
+#: becomes a candidate if any band matches exactly, which with 32 bands of 4
+#: is likely for any pair more than about 50% similar.
+BANDS = 32
+# An odd number to combine the word hashes of a shingle with:
+SHINGLE_MULTIPLIER = numpy.uint64(1000003)
+# The coefficients of the multiply-shift hash functions that stand in for
+# random permutations, fixed so cached signatures stay comparable across runs:
+_random = numpy.random.RandomState(0)
+PERMUTATION_A = _random.randint(0, 1 << 63, NUM_PERMUTATIONS, dtype=numpy.uint64) * numpy.uint64(2) + numpy.uint64(1)
+PERMUTATION_B = _random.randint(0, 1 << 63, NUM_PERMUTATIONS, dtype=numpy.uint64)
+
+
+@command()
+@argument('in_directory', type=Path(exists=True, file_okay=False))
+@option('--threshold', '-t',
+        type=float,
+        default=0.9,
+        show_default=True,
+        help='How similar two samples must be to count as near-duplicates: the estimated fraction of their runs of 5 words that they share')
+@option('--move-to', '-m',
+        type=Path(file_okay=False, writable=True),
+        help='A folder to move all but one sample of each group of near-duplicates into, along with their resources, keeping their paths relative to IN_DIRECTORY. [default: just report them]')
+@option('--number-of-workers',
+        default=cpu_count(),
+        show_default=True,
+        help='The number of processes to read samples with')
+def dedupe(in_directory, threshold, move_to, number_of_workers):
+    """
+    Find samples that are nearly the same as others.
+
+    Crawled corpora tend to have many near-identical pages, like paginated
+    listings and A/B variants. Each costs as much to vectorize as any other
+    page, yet they teach the trainer little and give their layout too much
+    weight. List each group of near-duplicates in IN_DIRECTORY
+    (recursively), or, with ``--move-to``, set aside all but one of each.
+    The one kept is a labeled sample, if any are, otherwise the first found.
+
+    Samples are compared by their visible text, so pages that differ only in
+    markup, scripts, or styles count as duplicates. Samples with fewer than 5
+    words of text can't be compared and are skipped. Signatures are cached
+    in IN_DIRECTORY's index (see ``fathom index``), which this creates if
+    necessary, so later runs read only new or changed samples.
+
+    """
+    in_directory = pathlib.Path(in_directory)
+    if move_to is not None:
+        move_to = pathlib.Path(move_to)
+        if in_directory.resolve() in [move_to.resolve(), *move_to.resolve().parents]:
+            raise BadParameter('Samples set aside within IN_DIRECTORY would still count as part of it.', param_hint='--move-to')
+
+    samples = list(update_index(in_directory, number_of_workers=number_of_workers, show_progress=True).values())
+    signatures = cached_signatures(in_directory)
+    stale = [sample for sample in samples if sample.hash not in signatures]
+    if stale:
+        paths = [in_directory / sample.path for sample in stale]
+        if number_of_workers > 1 and len(paths) > 1:
+            with Pool(number_of_workers, initializer=stop_timings) as pool:
+                computed = list(progress(pool.imap(signature_of_path, paths, chunksize=8), len(paths)))
+        else:
+            computed = list(progress(map(signature_of_path, paths), len(paths)))
+        signatures.update(zip((sample.hash for sample in stale), computed))
+    cache_signatures(in_directory, {sample.hash: signatures[sample.hash] for sample in stale})
+    # Leave out samples with too little text to compare:
+    samples_with_text = [sample for sample in samples if signatures[sample.hash]]
+    too_short = len(samples) - len(samples_with_text)
+    signature_arrays = [numpy.frombuffer(signatures[sample.hash], dtype=numpy.uint64) for sample in samples_with_text]
+    samples = samples_with_text
+
+    duplicates = []
+    for cluster in near_duplicate_clusters(signature_arrays, threshold):
+        # Prefer to keep a labeled sample, since it's likely already in use:
+        keeper = min(cluster, key=lambda i: (not samples[i].labels, i))
+        print(f'{samples[keeper].path} has {len(cluster) - 1} near-duplicate{"s" if len(cluster) > 2 else ""}:')
+        for i in cluster:
+            if i != keeper:
+                print(f'    {samples[i].path} ({similarity(signature_arrays[keeper], signature_arrays[i]):.0%} similar)')
+                duplicates.append(samples[i].path)
+
+    if too_short:
+        print(f'Skipped {too_short} samples with fewer than {SHINGLE_SIZE} words of text.')
+    if not duplicates:
+        print('Found no near-duplicates.')
+    elif move_to is None:
+        print(f'Setting aside the near-duplicates would leave {len(samples) + too_short - len(duplicates)} of {len(samples) + too_short} samples.')
+    else:
+        move_samples(in_directory, move_to, duplicates)
+        print(f'Moved {len(duplicates)} near-duplicates to {move_to}.')
+
+
+def progress(iterable, length):
+    with progressbar(iterable, length=length, label='Computing signatures') as bar:
+        yield from bar
+
+
+def move_samples(from_dir, to_dir, relative_paths):
+    """Move some samples and their resources from one folder to another,
+    keeping their relative paths. Move nothing if anything would be
+    overwritten."""
+    moves = []
+    for relative_path in relative_paths:
+        source = from_dir / relative_path
+        destination = to_dir / relative_path
+        moves.append((source, destination))
+        resources = source.parent / 'resources' / source.stem
+        if resources.exists():
+            moves.append((resources, destination.parent / 'resources' / source.stem))
+    for _, destination in moves:
+        if destination.exists():
+            raise UsageError(f'Tried to move a sample to {destination.as_posix()}, but something is already there. To'
+                             f' protect against unwanted data loss, please move or remove it.')
+    for source, destination in moves:
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        move(str(source), str(destination))
+    transfer_samples(from_dir, to_dir, relative_paths)
+
+
+def visible_text(html):
+    """Return the text of some HTML, as a string, leaving out markup,
+    scripts, and styles."""
+    return TAG.sub(' ', SCRIPT_OR_STYLE.sub(' ', html))
+
+
+def signature(text):
+    """Return the MinHash signature of the shingles of some text, as an array
+    of ``NUM_PERMUTATIONS`` unsigned ints, or None if it's too short to have
+    any shingles.
+
+    The fraction of places where the signatures of two texts match estimates
+    the Jaccard similarity of their sets of shingles.
+
+    """
+    words = WORD.findall(text.lower())
+    if len(words) < SHINGLE_SIZE:
+        # Pages with next to no text, like image galleries, would all look
+        # alike. We can't tell whether they're duplicates, so don't guess.
+        return None
+    # Hash each word once, and then combine the hashes of each run of words,
+    # rather than hashing each shingle afresh:
+    word_hashes = numpy.empty(len(words), dtype=numpy.uint64)
+    vocabulary = {word: crc32(word.encode('utf-8')) for word in set(words)}
+    word_hashes[:] = numpy.fromiter(map(vocabulary.__getitem__, words),
+                                    dtype=numpy.uint64,
+                                    count=len(words))
+    num_shingles = len(word_hashes) - SHINGLE_SIZE + 1
+    shingles = numpy.zeros(num_shingles, dtype=numpy.uint64)
+    for offset in range(SHINGLE_SIZE):
+        shingles = shingles * SHINGLE_MULTIPLIER + word_hashes[offset:offset + num_shingles]
+    shingles = numpy.unique(shingles)
+    minima = numpy.full(NUM_PERMUTATIONS, numpy.iinfo(numpy.uint64).max, dtype=numpy.uint64)
+    # Permute a batch at a time to bound memory use on huge pages:
+    for start in range(0, len(shingles), 4096):
+        batch = shingles[start:start + 4096]
+        permuted = numpy.multiply.outer(PERMUTATION_A, batch)
+        permuted += PERMUTATION_B[:, None]
+        # Comparing whole values compares the high bits first, which are the
+        # well-mixed ones, so there's no need to shift them down.
+        numpy.minimum(minima, permuted.min(axis=1), out=minima)
+    return minima
+
+
+def signature_of_path(path):
+    """Return the signature of the sample at a Path, as bytes for caching,
+    or empty bytes if it has none."""
+    html = path.read_bytes().decode('utf-8', errors='replace')
+    sample_signature = signature(visible_text(html))
+    return b'' if sample_signature is None else sample_signature.tobytes()
+
+
+def similarity(a, b):
+    """Return the estimated Jaccard similarity of the texts with signatures
+    ``a`` and ``b``."""
+    return numpy.count_nonzero(a == b) / len(a)
+
+
+def near_duplicate_clusters(signatures, threshold):
+    """Return a list of the groups of near-duplicates among some signatures,
+    each a sorted list of indices into ``signatures``. Leave out items that
+    have no near-duplicates.
+
+    Rather than compare every pair, compare only those sharing a bucket in
+    at least one band of their signatures (locality-sensitive hashing).
+    Groups are transitive: if A is like B and B like C, all 3 are grouped.
+
+    """
+    parents = list(range(len(signatures)))
+
+    def root(i):
+        while parents[i] != i:
+            parents[i] = parents[parents[i]]
+            i = parents[i]
+        return i
+
+    rows = NUM_PERMUTATIONS // BANDS
+    for band in range(BANDS):
+        buckets = defaultdict(list)
+        for i, signature in enumerate(signatures):
+            buckets[signature[band * rows:(band + 1) * rows].tobytes()].append(i)
+        for bucket in buckets.values():
+            for position, i in enumerate(bucket):
+                for j in bucket[position + 1:]:
+                    root_i, root_j = root(i), root(j)
+                    if root_i != root_j and similarity(signatures[i], signatures[j]) >= threshold:
+                        parents[max(root_i, root_j)] = min(root_i, root_j)
+
+    clusters = defaultdict(list)
+    for i in range(len(signatures)):
+        clusters[root(i)].append(i)
+    return [cluster for cluster in clusters.values() if len(cluster) > 1]
@@ -3,10 +3,9 @@ from pathlib import Path
 
 import click
 from click import argument, BadOptionUsage, command, get_terminal_size, option, style
-from more_itertools import pairwise
 import numpy
 
-from ..utils import path_or_none, tensors_from
+from ..utils import feature_columns, needs_vectorizing, path_or_none, phase, tensors_from
 from ..vectorizer import make_or_find_vectors
 
 
@@ -49,7 +48,11 @@ from ..vectorizer import make_or_find_vectors
         type=str,
         multiple=True,
         help='The rule to graph. Can be repeated. Omitting this graphs all rules.')
-def histogram(training_set, ruleset, trainee, training_cache, delay, tabs, show_browser, buckets, rules):
+@option('--exclude', '-x',
+        type=str,
+        multiple=True,
+        help='Exclude a rule from the graphs. Can be repeated.')
+def histogram(training_set, ruleset, trainee, training_cache, delay, tabs, show_browser, buckets, rules, exclude):
     """Show a histogram of rule scores.
 
     We also break down what proportion of each bucket comprised positive or
@@ -58,11 +61,11 @@ def histogram(training_set, ruleset, trainee, training_cache, delay, tabs, show_
 
     """
     training_set = Path(training_set)
-    if training_set.is_dir():
+    if needs_vectorizing(training_set):
         if not ruleset:
-            raise BadOptionUsage('ruleset', 'A --ruleset file must be specified when TRAINING_SET_FOLDER is passed a directory.')
+            raise BadOptionUsage('ruleset', 'A --ruleset file must be specified when TRAINING_SET_FOLDER is passed a directory or manifest.')
         if not trainee:
-            raise BadOptionUsage('trainee', 'A --trainee ID must be specified when TRAINING_SET_FOLDER is passed a directory.')
+            raise BadOptionUsage('trainee', 'A --trainee ID must be specified when TRAINING_SET_FOLDER is passed a directory or manifest.')
 
     training_data = make_or_find_vectors(
         ruleset,
@@ -74,36 +77,77 @@ def histogram(training_set, ruleset, trainee, training_cache, delay, tabs, show_
         delay,
         tabs)
     training_pages = training_data['pages']
-    x, y, num_yes, _ = tensors_from(training_pages)
-    feature_names = training_data['header']['featureNames']
-    print_feature_report(feature_metrics(feature_names, x, y, buckets, rules or feature_names))
+    columns, feature_names = feature_columns(training_data['header']['featureNames'], exclude)
+    x, y, num_yes, _ = tensors_from(training_pages, columns=columns)
+    with phase('histogram'):
+        print_feature_report(feature_metrics(feature_names, x, y, buckets, rules or feature_names))
 
 
 def feature_metrics(feature_names, x, y, buckets, enabled_rules):
-    x_t = x.T  # [[...feature0 values across all pages...], [...feature1 values...], ...].
-    for name, values in zip(feature_names, x_t):
-        if name not in enabled_rules:
-            continue
-        is_boolean = is_boolean_feature(values)
-        _, boundaries = numpy.histogram(values.numpy(),
-                                        bins=2 if is_boolean else buckets)
-        highest_boundary = boundaries[-1]
-        bars = []
-        for boundary, (low_bound, high_bound) in zip(boundaries, pairwise(boundaries)):
-            is_last_time = high_bound == highest_boundary
+    """Yield, for each enabled feature, its name and a list of histogram bars
+    as (label, positives, negatives) tuples.
 
-            # Whether each feature value is a member of this bucket. Last
-            # interval is inclusive on the right.
-            x_is_for_this_bar = ((values >= low_bound) &
-                                 ((values <= high_bound) if is_last_time else
-                                  (values < high_bound)))
+    Rather than masking out each bucket of each feature separately, we bin
+    every enabled column of ``x`` at once and then tally the bins for all
+    features and both labels with a single ``bincount()``. The bin edges match
+    what ``numpy.histogram()`` would pick for each column: 2 bins for
+    yes/no features and ``buckets`` bins otherwise, with the last interval
+    inclusive on the right.
 
-            y_for_this_bar = y.T[0].masked_select(x_is_for_this_bar)
-            positives = (y_for_this_bar.numpy() == 1).sum()
-            negatives = len(y_for_this_bar) - positives
-            label = str(ceil(boundary)) if is_boolean else f'{boundary:.1f}'
-            bars.append((label, positives, negatives))
-        yield name, bars
+    """
+    columns = [i for i, name in enumerate(feature_names) if name in enabled_rules]
+    if not columns:
+        return
+    values = x.numpy()[:, columns]
+    if not numpy.issubdtype(values.dtype, numpy.floating):
+        values = values.astype(numpy.float64)
+    is_positive = y.numpy()[:, 0] == 1
+    num_features = len(columns)
+
+    if len(values):
+        firsts = values.min(axis=0)
+        lasts = values.max(axis=0)
+    else:
+        firsts = numpy.zeros(num_features, dtype=values.dtype)
+        lasts = numpy.ones(num_features, dtype=values.dtype)
+    # numpy.histogram() widens degenerate ranges like this, so we do too:
+    degenerate = firsts == lasts
+    firsts = numpy.where(degenerate, firsts - 0.5, firsts).astype(values.dtype)
+    lasts = numpy.where(degenerate, lasts + 0.5, lasts).astype(values.dtype)
+
+    is_boolean = ((values == 0) | (values == 1)).all(axis=0)
+    num_bins = numpy.where(is_boolean, 2, buckets)
+    max_bins = num_bins.max()
+
+    # Row i holds the edges for feature i, computed in the values' own
+    # precision, as numpy.histogram() does, so values on an edge land in the
+    # same bin. Only the first num_bins[i] + 1 are meaningful; the rest are
+    # never indexed.
+    edges = numpy.full((num_features, max_bins + 1), numpy.inf, dtype=values.dtype)
+    for i in range(num_features):
+        edges[i, :num_bins[i] + 1] = numpy.linspace(firsts[i], lasts[i], num_bins[i] + 1, dtype=values.dtype)
+
+    # Guess each value's bin arithmetically, then nudge the guesses that
+    # floating-point error put on the wrong side of an edge, as
+    # numpy.histogram() does:
+    feature_indices = numpy.arange(num_features)
+    bins = ((values - firsts) * (num_bins / (lasts - firsts))).astype(numpy.intp)
+    numpy.clip(bins, 0, num_bins - 1, out=bins)
+    bins[values < edges[feature_indices, bins]] -= 1
+    bins[(values >= edges[feature_indices, bins + 1]) & (bins != num_bins - 1)] += 1
+
+    # Number each (feature, label, bin) triple, and count them all at once:
+    slots = (feature_indices * 2 + is_positive[:, None]) * max_bins + bins
+    counts = numpy.bincount(slots.ravel(),
+                            minlength=num_features * 2 * max_bins).reshape(num_features, 2, max_bins)
+
+    for i, column in enumerate(columns):
+        bars = []
+        for index in range(num_bins[i]):
+            boundary = edges[i, index]
+            label = str(ceil(boundary)) if is_boolean[i] else f'{boundary:.1f}'
+            bars.append((label, int(counts[i, 1, index]), int(counts[i, 0, index])))
+        yield feature_names[column], bars
 
 
 def print_feature_report(metrics):
@@ -138,9 +182,3 @@ def print_feature_report(metrics):
             pos_bar = bar(pos_length, positives)
             neg_bar = bar(neg_length, negatives)
             print(f'  {padded_label} {pos_style}{pos_bar}{style_reset}{neg_style}{neg_bar}{style_reset}{" " if (positives + negatives) else ""}{positives + negatives}')
-
-
-def is_boolean_feature(t):
-    """Given a 1-D Tensor of a single feature's value across many samples,
-    return whether it appears to be a yes/no feature."""
-    return ((t == 0) | (t == 1)).min().item()
@@ -0,0 +1,53 @@
+from multiprocessing import cpu_count
+
+from click import argument, command, option, Path
+
+from ..index import index_path, update_index
+
+
+@command()
+@argument('in_directory', type=Path(exists=True, file_okay=False))
+@option('--rebuild',
+        default=False,
+        is_flag=True,
+        help='Throw away any existing index, and reread every sample.')
+@option('--number-of-workers',
+        default=cpu_count(),
+        show_default=True,
+        help='The number of processes to read samples with')
+def index(in_directory, rebuild, number_of_workers):
+    """
+    Build or update an index of the samples in a directory.
+
+    Record the hash, original URL, labels, and size of each sample in
+    IN_DIRECTORY (recursively) in a small database kept there, called
+    ``.fathom-index.sqlite3``. Only samples added or changed since the last
+    run are read, so it's cheap to run again.
+
+    Once a directory has an index, ``fathom list``, ``fathom pick``, and the
+    vector cache's check for changed samples use it instead of rescanning the
+    samples, keeping it up to date as they go. The per-tag reports of
+    ``fathom train`` and ``fathom test`` show the original URLs it recorded.
+    Delete the file to stop using it.
+
+    Like git, the index assumes a sample is unchanged if its size and
+    modification time are, so that it needn't reread it. Samples modified
+    within a couple of seconds of being indexed are reread to be safe, but a
+    tool that changes a sample without changing its size while keeping its
+    old modification time, like some backup restorers, will go unnoticed,
+    and so will the vectors cached from it. Run with ``--rebuild`` after
+    using one.
+
+    """
+    if rebuild:
+        try:
+            index_path(in_directory).unlink()
+        except FileNotFoundError:
+            pass
+    samples = update_index(in_directory, number_of_workers=number_of_workers, show_progress=True).values()
+    labels = sorted({label for sample in samples for label in sample.labels})
+    print(f'Indexed {len(samples)} samples from {len({sample.domain for sample in samples})} domains,'
+          f' totaling {sum(sample.size for sample in samples) / 1e6:.1f} MB of HTML and'
+          f' {sum(sample.resource_bytes for sample in samples) / 1e6:.1f} MB of resources.')
+    for label in labels:
+        print(f'{sum(label in sample.labels for sample in samples)} are labeled "{label}".')
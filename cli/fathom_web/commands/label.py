@@ -3,10 +3,18 @@ from html.parser import HTMLParser
 import multiprocessing
 import os
 import pathlib
+import re
 import shutil
 
 from click import argument, command, option, Path, progressbar, STRING
 
+from ..utils import stop_timings
+from ..vectorizer import replacing
+
+
+# An html start tag's name, ended as HTMLParser ends tag names:
+HTML_TAG_NAME = re.compile(rb'<html(?=[\t\n\r\f />\x00])', re.IGNORECASE)
+
 
 @command()
 @option('--preserve-originals/--no-preserve-originals',
@@ -45,7 +53,7 @@ def label(in_directory, in_type, preserve_originals, number_of_workers):
 
     # Make a pool of workers. Each worker is in its own process. We use a scaling factor to account for the overhead of
     # setting up all of the processes.
-    pool = multiprocessing.Pool(number_of_workers)
+    pool = multiprocessing.Pool(number_of_workers, initializer=stop_timings)
     # Curry ``task``, so we can pass more than one argument into pool.imap_unordered.
     task = partial(label_task, in_directory, in_type, originals_dir, preserve_originals)
 
@@ -69,16 +77,68 @@ def label_task(in_directory, in_type, originals_dir, preserve_originals, filenam
     if file.suffix != '.html':
         return f'Skipped {file.name}; not an HTML file'
 
-    with file.open(encoding='utf-8') as fp:
-        html = fp.read()
+    new_html = label_html_tags_in_html_bytes(file.read_bytes(), in_type)
 
-    new_html = label_html_tags_in_html_string(html, in_type)
+    # Write the labeled page beside the original and rename it into place,
+    # so an interrupted run never leaves a half-written sample.
+    with replacing(file, 'wb') as fp:
+        fp.write(new_html)
+        if preserve_originals:
+            shutil.move(file, originals_dir / file.name)
 
-    if preserve_originals:
-        shutil.move(file, originals_dir / file.name)
 
-    with file.open('w', encoding='utf-8') as fp:
-        fp.write(new_html)
+def label_html_tags_in_html_bytes(html: bytes, in_type: str) -> bytes:
+    """
+    Add a ``' data-fathom="${in_type}"'`` attribute to the opening ``html``
+    tag(s) of an HTML document's bytes.
+
+    Nearly every page has exactly one ``<html>`` tag, preceded by at most a
+    doctype and some comments, so we look for it with a scanner that stops
+    at the first real tag and splice the attribute in there, without
+    decoding or parsing the rest of the page. If the page doesn't fit that
+    mold—there is other content before the tag, or something else in the
+    page looks like an ``html`` tag—we fall back to finding the tags with
+    ``HTMLParser``.
+    """
+    offset = first_html_tag_name_end(html)
+    if offset is None or HTML_TAG_NAME.search(html, offset) is not None:
+        return label_html_tags_in_html_string(
+            html.decode('utf-8', errors='surrogateescape'),
+            in_type).encode('utf-8', errors='surrogateescape')
+    return b''.join([html[:offset], f' data-fathom="{in_type}"'.encode('utf-8'), html[offset:]])
+
+
+def first_html_tag_name_end(html: bytes):
+    """
+    Return the offset just past the tag name of the ``<html>`` tag that
+    opens an HTML document, or None if we can't be sure where it is.
+
+    We skip a leading byte-order mark and any whitespace, comments,
+    doctypes, and processing instructions, as a parser would. Anything else
+    before the tag makes us give up rather than risk labeling, say, an
+    ``<html>`` in a script.
+    """
+    position = 3 if html.startswith(b'\xef\xbb\xbf') else 0
+    while True:
+        start = html.find(b'<', position)
+        if start == -1 or html[position:start].strip():
+            return None
+        if html.startswith(b'<!--', start):
+            end = html.find(b'-->', start + 4)
+            if end == -1:
+                return None
+            position = end + 3
+        elif html.startswith((b'<!', b'<?'), start):
+            end = html.find(b'>', start)
+            if end == -1:
+                return None
+            position = end + 1
+        else:
+            match = HTML_TAG_NAME.match(html, start)
+            # Make sure the tag is closed, as HTMLParser would:
+            if match is None or html.find(b'>', match.end()) == -1:
+                return None
+            return match.end()
 
 
 def label_html_tags_in_html_string(html: str, in_type: str) -> str:
@@ -0,0 +1,330 @@
+from functools import partial
+from html.parser import HTMLParser
+from json import JSONDecodeError, load
+import multiprocessing
+import pathlib
+import re
+import shutil
+from urllib.parse import urlparse
+
+from click import argument, BadParameter, command, File, option, Path, progressbar, STRING, style, UsageError
+
+from ..utils import stop_timings
+from ..vectorizer import replacing
+from .list import ORIGINAL_URL
+
+
+SELECTOR_TOKEN = re.compile(r"""
+    \s*(?P<combinator>[>,])\s*
+    | (?P<descendant>\s+)
+    | (?P<tag>[a-zA-Z][\w-]*|\*)
+    | \#(?P<id>[\w-]+)
+    | \.(?P<class>[\w-]+)
+    | \[\s*(?P<attribute>[\w:-]+)\s*
+        (?:(?P<operator>[~^$*]?=)\s*
+           (?:"(?P<double_quoted>[^"]*)"|'(?P<single_quoted>[^']*)'|(?P<bare>[\w-]+))\s*)?
+      \]
+    """, re.VERBOSE)
+# Elements that never have end tags:
+VOID_ELEMENTS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'param', 'source',
+                 'track', 'wbr'}
+TAG_NAME = re.compile(r'<[^\t\n\r\f />\x00]+')
+
+
+@command('label-elements')
+@option('--selector', '-s',
+        metavar='SELECTOR',
+        help='A CSS selector for the elements to label on every page. Required unless --selectors-file covers every page.')
+@option('--selectors-file', '-f',
+        type=File(encoding='utf-8'),
+        help='A JSON file of per-site selectors, like {"example.com": "article .price", ...}. A page uses the selector of the most specific domain that matches the host of its original URL, falling back to --selector.')
+@option('--max-matches',
+        default=1,
+        show_default=True,
+        help='The most elements a page may match. Pages that match more are flagged and left unlabeled, since the selector is probably too loose for them.')
+@option('--preserve-originals/--no-preserve-originals',
+        default=True,
+        help='Save the original HTML files of changed pages in a newly created'
+             ' `originals` directory in IN_DIRECTORY (default: True)')
+@option('--number-of-workers',
+        default=multiprocessing.cpu_count(),
+        help='Use the specified number of workers to speed up the labeling'
+             ' process (default: the number of logical cores the machine has)')
+@argument('in_directory', type=Path(exists=True, file_okay=False))
+@argument('in_type', type=STRING)
+def label_elements(in_directory, in_type, selector, selectors_file, max_matches, preserve_originals, number_of_workers):
+    """
+    Label the elements matching a CSS selector on each page in a directory.
+
+    Add the ``data-fathom`` attribute with a value of IN_TYPE to the opening
+    tag of every element matching the selector in the HTML pages in
+    IN_DIRECTORY. This is a fast way to label a batch of pages from a site
+    whose targets a selector reliably finds. Elements that already have a
+    ``data-fathom`` attribute are left alone.
+
+    The number of matches on each page is reported, and pages with none or
+    with more than ``--max-matches`` are flagged for a closer look.
+
+    Selectors may use tag names, ``*``, ``#id``, ``.class``, and
+    ``[attribute]`` tests (with ``=``, ``~=``, ``^=``, ``$=``, or ``*=``),
+    combined with descendant and child (``>``) combinators. Separate several
+    selectors with commas.
+
+    """
+    if selector is None and selectors_file is None:
+        raise UsageError('Specify a --selector, a --selectors-file, or both.')
+    default_selector = parsed_selector(selector, '--selector') if selector is not None else None
+    selectors_by_domain = selectors_from_file(selectors_file) if selectors_file is not None else {}
+
+    if preserve_originals:
+        originals_dir = pathlib.Path(in_directory) / 'originals'
+        try:
+            originals_dir.mkdir(parents=True)
+        except FileExistsError:
+            raise RuntimeError(f'Tried to make directory {originals_dir.as_posix()}, but it already exists. To protect'
+                               f' against unwanted data loss, please move or remove the existing directory.')
+    else:
+        originals_dir = None
+
+    list_of_items = [item for item in pathlib.Path(in_directory).iterdir()
+                     if item != originals_dir and item.is_file() and item.suffix == '.html']
+
+    # Curry ``task``, so we can pass more than one argument into pool.imap_unordered.
+    task = partial(label_elements_task, in_type, default_selector, selectors_by_domain, max_matches, originals_dir)
+    with multiprocessing.Pool(number_of_workers, initializer=stop_timings) as pool:
+        with progressbar(pool.imap_unordered(task, list_of_items),
+                         label='Labeling elements',
+                         length=len(list_of_items)) as bar:
+            results = sorted(bar)
+
+    print(match_report(results, max_matches))
+
+
+def label_elements_task(in_type, default_selector, selectors_by_domain, max_matches, originals_dir, file):
+    """Label the matching elements of one page, and return its filename,
+    match count (None if we had no selector for it), and anything worth
+    flagging about it."""
+    html = file.read_bytes().decode('utf-8', errors='surrogateescape')
+    domain = original_domain(html)
+    selector = selector_for_domain(domain, selectors_by_domain, default_selector)
+    if selector is None:
+        return file.name, None, f'no selector for {domain or "its domain"}'
+
+    new_html, matches = label_matching_elements(html, selector, in_type)
+    if matches == 0:
+        return file.name, matches, 'no matches'
+    if matches > max_matches:
+        return file.name, matches, 'too many matches; left unlabeled'
+    if new_html != html:
+        with replacing(file, 'wb') as fp:
+            fp.write(new_html.encode('utf-8', errors='surrogateescape'))
+            if originals_dir is not None:
+                shutil.move(file, originals_dir / file.name)
+    return file.name, matches, None
+
+
+def match_report(results, max_matches):
+    """Return a printable list of pages and their match counts, with the
+    ones needing attention flagged, followed by a summary."""
+    lines = []
+    flagged = 0
+    for filename, matches, problem in results:
+        count = '' if matches is None else matches
+        if problem:
+            flagged += 1
+            lines.append(f'{count: >5}  {filename}  ' + style(problem, fg='red'))
+        else:
+            lines.append(f'{count: >5}  {filename}')
+    lines.append(f'\n{len(results) - flagged} of {len(results)} pages matched between 1 and {max_matches} elements.')
+    if flagged:
+        lines.append(style(f'{flagged} pages were flagged and left unchanged.', fg='red'))
+    return '\n'.join(lines)
+
+
+def original_domain(html):
+    """Return the host of the original URL FathomFox recorded for a page,
+    or '' if there isn't one."""
+    match = ORIGINAL_URL.search(html)
+    return (urlparse(match.group(1)).hostname or '') if match else ''
+
+
+def selector_for_domain(domain, selectors_by_domain, default_selector):
+    """Return the selector for the most specific domain in
+    ``selectors_by_domain`` that ``domain`` is or is under, or else
+    ``default_selector``.
+
+    For example, ``www.example.com`` gets the selector for ``example.com``
+    if there isn't one for ``www.example.com`` itself.
+
+    """
+    labels = domain.split('.')
+    for start in range(len(labels)):
+        selector = selectors_by_domain.get('.'.join(labels[start:]))
+        if selector is not None:
+            return selector
+    return default_selector
+
+
+def selectors_from_file(file):
+    """Return a dict of domains and parsed selectors, loaded from a JSON
+    file mapping domains to selector strings."""
+    try:
+        mapping = load(file)
+    except JSONDecodeError as exc:
+        raise BadParameter(f'{file.name} is not valid JSON: {exc}', param_hint='--selectors-file')
+    if not isinstance(mapping, dict) or not all(isinstance(value, str) for value in mapping.values()):
+        raise BadParameter(f'{file.name} should hold a JSON object mapping domains to selectors.', param_hint='--selectors-file')
+    return {domain.lower(): parsed_selector(selector, f'--selectors-file ({domain})')
+            for domain, selector in mapping.items()}
+
+
+def parsed_selector(selector, param_hint):
+    """Parse a CSS selector list into a list of selectors, each a list of
+    (combinator, compound selector) pairs from left to right.
+
+    The combinator says how a compound relates to the previous one: ``' '``
+    for descendant or ``'>'`` for child. A compound selector is a pair of a
+    tag name (or None for any) and a list of (attribute, operator, value)
+    tests. We raise BadParameter for anything we don't support.
+
+    """
+    selectors = [[]]
+    combinator = ' '
+    compound = None
+    position = 0
+    selector = selector.strip()
+    while position < len(selector):
+        token = SELECTOR_TOKEN.match(selector, position)
+        if token is None:
+            raise BadParameter(f'Unsupported syntax at "{selector[position:]}" in the selector "{selector}".', param_hint=param_hint)
+        position = token.end()
+        kind = token.lastgroup
+        if kind in ('combinator', 'descendant'):
+            if compound is None:
+                raise BadParameter(f'"{selector}" has a combinator or comma without a selector before it.', param_hint=param_hint)
+            selectors[-1].append((combinator, compound))
+            compound = None
+            combinator = token.group('combinator') or ' '
+            if combinator == ',':
+                selectors.append([])
+                combinator = ' '
+            continue
+        if compound is None:
+            compound = (None, [])
+        tag, tests = compound
+        if kind == 'tag':
+            if tag is not None or tests:
+                raise BadParameter(f'A tag name must come first in each part of "{selector}".', param_hint=param_hint)
+            compound = (None if token.group('tag') == '*' else token.group('tag').lower(), tests)
+        elif kind == 'id':
+            tests.append(('id', '=', token.group('id')))
+        elif kind == 'class':
+            tests.append(('class', '~=', token.group('class')))
+        else:
+            value = next((v for v in token.group('double_quoted', 'single_quoted', 'bare') if v is not None), None)
+            tests.append((token.group('attribute').lower(), token.group('operator'), value))
+    if compound is None:
+        raise BadParameter(f'"{selector}" is empty or ends with a combinator or comma.', param_hint=param_hint)
+    selectors[-1].append((combinator, compound))
+    return selectors
+
+
+def compound_matches(compound, element):
+    """Return whether an element, a (tag, attribute dict) pair, matches a
+    compound selector."""
+    tag, tests = compound
+    name, attributes = element
+    if tag is not None and tag != name:
+        return False
+    for attribute, operator, value in tests:
+        actual = attributes.get(attribute)
+        if actual is None:
+            return False
+        if operator is None:
+            continue
+        if not value and operator != '=':
+            return False  # As in CSS, an empty substring matches nothing.
+        if not ((operator == '=' and actual == value) or
+                (operator == '~=' and value in actual.split()) or
+                (operator == '^=' and actual.startswith(value)) or
+                (operator == '$=' and actual.endswith(value)) or
+                (operator == '*=' and value in actual)):
+            return False
+    return True
+
+
+def selector_matches(selector, stack):
+    """Return whether the last element in ``stack``, whose ancestors precede
+    it there, matches a selector from ``parsed_selector()``."""
+    def matches_at(part, index):
+        combinator, compound = selector[part]
+        if not compound_matches(compound, stack[index]):
+            return False
+        if part == 0:
+            return True
+        if combinator == '>':
+            return index > 0 and matches_at(part - 1, index - 1)
+        return any(matches_at(part - 1, ancestor) for ancestor in range(index - 1, -1, -1))
+    return matches_at(len(selector) - 1, len(stack) - 1)
+
+
+def label_matching_elements(html: str, selectors, in_type: str):
+    """
+    Add a ``' data-fathom="${in_type}"'`` attribute to the opening tag of
+    each element matching any of ``selectors``, and return the new HTML and
+    how many elements matched.
+
+    We find the elements with a subclass of ``HTMLParser`` that keeps the
+    stack of open elements. Samples are DOMs serialized by FathomFox, so
+    every element has an end tag except the void ones, and that is all it
+    takes to track ancestry.
+    """
+    parser = SelectorParser(selectors)
+    parser.feed(html)
+    parser.close()
+
+    pieces = []
+    previous = 0
+    for offset in parser.insertion_offsets:
+        pieces.append(html[previous:offset])
+        pieces.append(f' data-fathom="{in_type}"')
+        previous = offset
+    pieces.append(html[previous:])
+    return ''.join(pieces), parser.matches
+
+
+class SelectorParser(HTMLParser):
+    def __init__(self, selectors, **kwargs):
+        self.selectors = selectors
+        self.stack = []
+        self.matches = 0
+        self.insertion_offsets = []
+        self.line_offsets = [0]
+        self.fed = 0
+        super().__init__(**kwargs)
+
+    def feed(self, data):
+        # Note where each line starts, to turn getpos() into an offset:
+        self.line_offsets.extend(self.fed + match.end() for match in re.finditer('\n', data))
+        self.fed += len(data)
+        super().feed(data)
+
+    def handle_starttag(self, tag, attrs):
+        attributes = {name: value or '' for name, value in attrs}
+        self.stack.append((tag, attributes))
+        if any(selector_matches(selector, self.stack) for selector in self.selectors):
+            self.matches += 1
+            if 'data-fathom' not in attributes:
+                line, column = self.getpos()
+                start = self.line_offsets[line - 1] + column
+                self.insertion_offsets.append(start + len(TAG_NAME.match(self.get_starttag_text()).group()))
+        if tag in VOID_ELEMENTS:
+            self.stack.pop()
+
+    def handle_endtag(self, tag):
+        # Close the element, along with any unclosed ones inside it. Ignore
+        # stray end tags.
+        for index in range(len(self.stack) - 1, -1, -1):
+            if self.stack[index][0] == tag:
+                del self.stack[index:]
+                break
@@ -1,35 +1,226 @@
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import errno
+from itertools import chain
+import os
 import pathlib
-from random import sample
-from shutil import move
+from random import Random
+from shutil import copy2, copytree, move
+from urllib.parse import urlparse
 
-from click import argument, command, Path, UsageError
+from click import argument, BadParameter, command, option, Path, UsageError
+from more_itertools import chunked
+
+from ..index import indexed_samples, LABEL, ORIGINAL_URL, transfer_samples
+from ..utils import manifest_samples, read_chunks
 
 
 @command()
 @argument('from_dir',
           type=Path(exists=True, file_okay=False, writable=True, dir_okay=True))
 @argument('to_dir',
-          type=Path(exists=True, file_okay=False, writable=True, dir_okay=True))
+          type=Path(writable=True))
 @argument('number', type=int)
-def pick(from_dir, to_dir, number):
+@option('--move', 'how',
+        flag_value='move',
+        default=True,
+        help='Move the samples into TO_DIR. (This is the default.)')
+@option('--link', 'how',
+        flag_value='link',
+        help='Hard-link the samples and their resources into TO_DIR, leaving FROM_DIR as it was. Where that is impossible, as across filesystems, copy them instead.')
+@option('--manifest', 'how',
+        flag_value='manifest',
+        help='Leave the samples where they are, and write a manifest file listing them to TO_DIR, which must be a new .txt file in FROM_DIR or a folder above it. Pass the manifest to `fathom train` or `test` in place of a folder of samples.')
+@option('--exclude', '-x',
+        type=Path(exists=True),
+        multiple=True,
+        help='A manifest or a folder of samples not to pick, like one you picked another set into with --manifest or --link. Can be repeated.')
+@option('--stratify', '-s',
+        default=False,
+        is_flag=True,
+        help='Pick from each combination of original domain and labeled-or-not in proportion to its share of the samples, so no one site dominates the set by chance.')
+@option('--seed',
+        type=int,
+        help='A number to seed the random choice with, so the same samples are picked again next time. [default: a different pick each time]')
+def pick(from_dir, to_dir, number, how, exclude, stratify, seed):
     """
     Randomly move samples to a training, validation, or test set.
 
     Move a random selection of HTML files and their extracted resources, if
     any, from one directory to another. Ignore hidden files.
 
+    Moving a large corpus around is slow, and moved samples have to be
+    vectorized again. With ``--link`` or ``--manifest``, a split costs
+    nearly nothing, and the samples stay in FROM_DIR, so you can pick again
+    freely. Manifests in the same folder share one cache of vectors, so any
+    page already vectorized for one manifest is reused by the others.
+
+    A small random pick can easily overrepresent one site. With
+    ``--stratify``, the samples are grouped by the domain of their original
+    URL and by whether they have any labels, and each group contributes
+    samples in proportion to its size.
+
+    If FROM_DIR has an index made by ``fathom index``, choose from the
+    samples it lists, and hand their entries over to TO_DIR's index, if it has
+    one. That also saves reading the samples to stratify them.
+
     """
     # Make these strings into ``Path``s so they are easier to work with
     from_dir = pathlib.Path(from_dir)
     to_dir = pathlib.Path(to_dir)
+    if how == 'manifest':
+        if to_dir.exists():
+            raise BadParameter(f'{to_dir} already exists. To protect against unwanted data loss, please pass a new filename.', param_hint='TO_DIR')
+        if to_dir.suffix != '.txt':
+            raise BadParameter('A manifest filename must end in .txt.', param_hint='TO_DIR')
+        if to_dir.parent.resolve() not in [from_dir.resolve(), *from_dir.resolve().parents]:
+            raise BadParameter('The manifest must be in FROM_DIR or a folder above it so the samples can be found relative to it.', param_hint='TO_DIR')
+    elif not to_dir.is_dir():
+        raise BadParameter(f'{to_dir} must be an existing folder.', param_hint='TO_DIR')
+
+    index = indexed_samples(from_dir)
+    if index is not None:
+        # Like the glob below, consider only the samples directly in from_dir:
+        candidates = [from_dir / path for path in index if len(pathlib.Path(path).parts) == 1]
+    else:
+        candidates = list(from_dir.glob('*.html'))
+    # Sort so a seed picks the same samples whatever order the OS lists them in:
+    candidates = sorted(without_excluded(candidates, [pathlib.Path(path) for path in exclude]))
+    if number > len(candidates):
+        raise UsageError(f'Tried to pick {number} samples, but there are only {len(candidates)} to pick from.')
+    random = Random(seed)
+    if stratify:
+        if index is not None:
+            strata = [(index[file.name].domain, bool(index[file.name].labels)) for file in candidates]
+        else:
+            with ThreadPoolExecutor() as executor:
+                strata = list(chain.from_iterable(executor.map(strata_of_paths, chunked(candidates, 32))))
+        picked = stratified_sample(candidates, strata, number, random)
+    else:
+        picked = random.sample(candidates, number)
+
+    if how == 'manifest':
+        root = to_dir.parent.resolve()
+        with to_dir.open('w', encoding='utf-8') as manifest:
+            manifest.writelines(file.resolve().relative_to(root).as_posix() + '\n' for file in sorted(picked))
+        return
+
+    # Make sure we don't overwrite any existing samples or resources
+    # directories before we transfer anything:
+    for file in picked:
+        if (to_dir / file.name).exists():
+            raise UsageError(f'Tried to make file {(to_dir / file.name).as_posix()}, but it already exists. To protect'
+                             f' against unwanted data loss, please move or remove the existing file.')
+        if (from_dir / 'resources' / file.stem).exists() and (to_dir / 'resources' / file.stem).exists():
+            raise UsageError(f'Tried to make directory {(to_dir / "resources" / file.stem).as_posix()}, but it'
+                             f' already exists. To protect against unwanted data loss, please move or remove the'
+                             f' existing directory.')
 
-    for file in sample(list(from_dir.glob('*.html')), number):
+    transfer = move if how == 'move' else link_tree
+    for file in picked:
         # If the file has resources, we must move those as well:
         if (from_dir / 'resources' / file.stem).exists():
-            # Make sure we don't overwrite an existing resources directory
-            if (to_dir / 'resources' / file.stem).exists():
-                raise UsageError(f'Tried to make directory {(to_dir / "resources" / file.stem).as_posix()}, but it'
-                                 f' already exists. To protect against unwanted data loss, please move or remove the'
-                                 f' existing directory.')
-            move(from_dir / 'resources' / file.stem, to_dir / 'resources' / file.stem)
-        move(file.as_posix(), to_dir)
+            transfer(from_dir / 'resources' / file.stem, to_dir / 'resources' / file.stem)
+        transfer(file.as_posix(), to_dir / file.name)
+    transfer_samples(from_dir, to_dir, [file.name for file in picked], keep=how == 'link')
+
+
+def strata_of_paths(paths):
+    """Return a list of the strata of the samples at some Paths. See
+    ``stratum()``."""
+    return [stratum(path) for path in paths]
+
+
+def stratum(path, chunk_size=64 * 1024):
+    """Return the domain of the original URL of the sample at a Path,
+    together with whether it has any labels.
+
+    FathomFox puts the URL in the head, and ``fathom label`` puts the label on
+    the <html> tag, so we can usually stop after the first chunk. We read
+    further only as long as we have yet to find either, which means reading
+    all of an unlabeled sample.
+
+    """
+    url = None
+    labeled = False
+    tail = b''
+    with path.open('rb') as file:
+        for chunk in read_chunks(file, chunk_size):
+            # Overlap the chunks a bit so we don't miss matches spanning them:
+            text = tail + chunk
+            if url is None:
+                match = ORIGINAL_URL.search(text)
+                if match:
+                    url = match.group(1).decode('utf-8', errors='replace')
+            labeled = labeled or LABEL.search(text) is not None
+            if url is not None and labeled:
+                break
+            tail = text[-4096:]
+    return urlparse(url or '').hostname or '', labeled
+
+
+def stratified_sample(population, strata, number, random):
+    """Return ``number`` items randomly chosen from ``population``, taking
+    from each stratum in proportion to its share of the population.
+
+    Where the proportions don't come out even, the leftover picks go to the
+    strata with the largest fractional shares, ties broken at random.
+
+    :arg strata: A list of hashable keys, the stratum of each item in
+        ``population``
+    :arg random: A ``random.Random`` to make the choices with
+
+    """
+    groups = defaultdict(list)
+    for item, stratum in zip(population, strata):
+        groups[stratum].append(item)
+    groups = list(groups.values())
+    shares = [number * len(group) / len(population) for group in groups]
+    quotas = [int(share) for share in shares]
+    order = list(range(len(groups)))
+    random.shuffle(order)
+    order.sort(key=lambda i: shares[i] - quotas[i], reverse=True)
+    for i in order[:number - sum(quotas)]:
+        quotas[i] += 1
+    return [item for group, quota in zip(groups, quotas) for item in random.sample(group, quota)]
+
+
+def without_excluded(candidates, exclusions):
+    """Return the candidate sample Paths that aren't in any of the given
+    manifests or folders.
+
+    Samples in folders are recognized by filename, since ``--move`` and
+    ``--link`` keep them, and those in manifests by location.
+
+    """
+    excluded_names = set()
+    excluded_paths = set()
+    for exclusion in exclusions:
+        if exclusion.is_dir():
+            excluded_names.update(file.name for file in exclusion.glob('*.html'))
+        else:
+            excluded_paths.update((exclusion.parent / path).resolve() for path in manifest_samples(exclusion))
+    return [file for file in candidates
+            if file.name not in excluded_names and file.resolve() not in excluded_paths]
+
+
+def link_tree(source, destination):
+    """Hard-link a file or a folder's contents from one place to another,
+    copying whatever can't be linked."""
+    source = pathlib.Path(source)
+    if source.is_dir():
+        copytree(source, destination, copy_function=link_or_copy)
+    else:
+        pathlib.Path(destination).parent.mkdir(parents=True, exist_ok=True)
+        link_or_copy(source, destination)
+
+
+def link_or_copy(source, destination):
+    try:
+        os.link(source, destination)
+    except OSError as error:
+        # Copy only where links are impossible, as across filesystems, not
+        # over something already there:
+        if error.errno not in (errno.EXDEV, errno.EPERM):
+            raise
+        copy2(source, destination)
@@ -0,0 +1,347 @@
+from functools import partial
+import multiprocessing
+import pathlib
+import re
+import shutil
+import struct
+from urllib.parse import unquote, urlsplit
+import zlib
+
+from click import argument, command, option, Path, progressbar
+
+from ..utils import stop_timings
+from ..vectorizer import replacing
+
+
+FONT_FACE = re.compile(r'@font-face\s*{[^}]*}', re.IGNORECASE)
+# A src descriptor, whose value may contain semicolons inside data: URLs:
+SRC_DESCRIPTOR = re.compile(r"""(?<![-\w])src\s*:\s*(?:url\([^)]*\)|"[^"]*"|'[^']*'|[^;}"'])*;?""", re.IGNORECASE)
+SRC_VALUE = re.compile(r'src\s*:\s*', re.IGNORECASE)
+SRC_ENTRY = re.compile(r"""(?:url\([^)]*\)|"[^"]*"|'[^']*'|[^,;}])+""")
+URL = re.compile(r"""url\(\s*(["']?)(.*?)\1\s*\)""", re.IGNORECASE | re.DOTALL)
+FORMAT = re.compile(r"""format\(\s*["']?([\w-]+)""", re.IGNORECASE)
+#: Font formats Firefox can use. It skips others without fetching them.
+SUPPORTED_FONT_FORMATS = {'woff2', 'woff', 'truetype', 'opentype'}
+UNSUPPORTED_FONT_EXTENSIONS = {'.eot', '.svg', '.svgz'}
+JPEG_START_OF_FRAME_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+EXIF_ORIENTATION_TAG = 0x0112
+#: EXIF orientations that turn an image 90 degrees one way or the other
+SIDEWAYS_ORIENTATIONS = {5, 6, 7, 8}
+#: The largest width or height of image we make a placeholder for
+MAX_PLACEHOLDER_SIDE = 16384
+#: The color of placeholder images
+PLACEHOLDER_GRAY = b'\xcc\xcc\xcc'
+
+
+@command()
+@option('--preserve-originals/--no-preserve-originals',
+        default=True,
+        help='Save original HTML files and any resources changed or removed'
+             ' in a newly created `originals` directory in IN_DIRECTORY'
+             ' (default: True)')
+@option('--number-of-workers',
+        default=multiprocessing.cpu_count(),
+        help='Use the specified number of workers to speed up slimming'
+             ' (default: the number of logical cores the machine has)')
+@argument('in_directory', type=Path(exists=True, file_okay=False))
+def slim(in_directory, preserve_originals, number_of_workers):
+    """
+    Shrink the extracted resources of samples so they load faster.
+
+    Replace each raster image in the resources of the extracted samples in
+    IN_DIRECTORY with a plain gray PNG of the same dimensions, so layout,
+    and with it the geometry rules see, is unchanged. And, where an
+    ``@font-face`` rule offers a font in several formats, keep only the one
+    Firefox would use, deleting the files of the rest. Firefox then has far
+    less to fetch and decode before a page settles, so vectorizing needs a
+    shorter ``--delay``.
+
+    Run this after ``fathom extract``. Don't slim samples whose rules look at
+    the content of images.
+
+    """
+    in_directory = pathlib.Path(in_directory)
+    if preserve_originals:
+        originals_dir = in_directory / 'originals'
+        try:
+            originals_dir.mkdir(parents=True)
+        except FileExistsError:
+            raise RuntimeError(f'Tried to make directory {originals_dir.as_posix()}, but it already exists. To protect'
+                               f' against unwanted data loss, please move or remove the existing directory.')
+    else:
+        originals_dir = None
+
+    samples = sorted(in_directory.glob('*.html'))
+    task = partial(slim_task, originals_dir)
+    with multiprocessing.Pool(number_of_workers, initializer=stop_timings) as pool:
+        with progressbar(pool.imap_unordered(task, samples),
+                         label='Slimming samples',
+                         length=len(samples)) as bar:
+            results = list(bar)
+
+    bytes_before = sum(result['bytes_before'] for result in results)
+    bytes_after = sum(result['bytes_after'] for result in results)
+    print(f'Replaced {sum(result["images"] for result in results)} images and removed'
+          f' {sum(result["fonts"] for result in results)} unused font files.')
+    print(f'Samples and their resources went from {bytes_before / 1e6:.1f} MB to {bytes_after / 1e6:.1f} MB'
+          f' ({1 - bytes_after / bytes_before if bytes_before else 0:.0%} smaller).')
+
+
+def slim_task(originals_dir, file):
+    """Slim one extracted sample, and return a dict of how many images
+    and fonts were replaced or removed and of its size, with resources, before
+    and after."""
+    resources = file.parent / 'resources' / file.stem
+    stats = {'images': 0, 'fonts': 0, 'bytes_before': file.stat().st_size, 'bytes_after': 0}
+    files = [path for path in resources.rglob('*') if path.is_file()] if resources.is_dir() else []
+    stats['bytes_before'] += sum(path.stat().st_size for path in files)
+
+    def set_aside(path):
+        """Keep the original of a resource before we change or remove it."""
+        if originals_dir is not None:
+            original = originals_dir / path.relative_to(file.parent)
+            original.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copy2(path, original)
+
+    unused = set()
+    # The text of each file that can refer to fonts, by the folder its URLs
+    # are relative to, once we're done with it:
+    referrers = []
+    for path in files:
+        if path.suffix.lower() == '.css':
+            css = path.read_text(encoding='utf-8', errors='surrogateescape')
+            new_css, dropped_urls = css_without_unused_fonts(css)
+            referrers.append((new_css, path.parent))
+            if new_css != css:
+                set_aside(path)
+                with replacing(path, 'w', encoding='utf-8', errors='surrogateescape') as css_file:
+                    css_file.write(new_css)
+                unused.update(resolved_url(url, path.parent) for url in dropped_urls)
+        else:
+            placeholder = placeholder_for(path.read_bytes())
+            if placeholder is not None:
+                set_aside(path)
+                with replacing(path, 'wb') as image_file:
+                    image_file.write(placeholder)
+                stats['images'] += 1
+
+    html = file.read_text(encoding='utf-8', errors='surrogateescape')
+    new_html, dropped_urls = css_without_unused_fonts(html)
+    if new_html != html:
+        unused.update(resolved_url(url, file.parent) for url in dropped_urls)
+        with replacing(file, 'w', encoding='utf-8', errors='surrogateescape') as html_file:
+            html_file.write(new_html)
+            if originals_dir is not None:
+                shutil.move(file, originals_dir / file.name)
+
+    referrers.append((new_html, file.parent))
+
+    # Remove only the fonts nothing refers to anymore:
+    still_used = {resolved_url(match.group(2), base) for text, base in referrers for match in URL.finditer(text)}
+    for path in files:
+        if path in unused and path not in still_used and path.exists():
+            set_aside(path)
+            path.unlink()
+            stats['fonts'] += 1
+
+    stats['bytes_after'] = file.stat().st_size + sum(path.stat().st_size for path in files if path.exists())
+    return stats
+
+
+def resolved_url(url, base):
+    """Return the Path a relative URL in a file in folder ``base`` refers to,
+    or None if it isn't a local one."""
+    url = url.strip()
+    if url.startswith('data:') or urlsplit(url).scheme or url.startswith('/'):
+        return None
+    return base / unquote(urlsplit(url).path)
+
+
+def css_without_unused_fonts(css):
+    """Return some CSS, or HTML with CSS in it, with each ``@font-face``
+    rule's ``src`` narrowed to what Firefox would use, along with a list of
+    the URLs no longer referred to.
+
+    Firefox uses the last ``src`` descriptor of a rule and, of its entries,
+    the first it supports, trying any ``local()`` fonts before it along the
+    way. We keep those and drop the others.
+
+    """
+    dropped_urls = []
+
+    def slimmed_rule(match):
+        rule = match.group(0)
+        descriptors = list(SRC_DESCRIPTOR.finditer(rule))
+        if not descriptors:
+            return rule
+        pieces = []
+        offset = 0
+        dropped_here = []
+        for descriptor in descriptors[:-1]:
+            pieces.append(rule[offset:descriptor.start()])
+            dropped_here.extend(url.group(2) for url in URL.finditer(descriptor.group(0)))
+            # Take the whitespace after it too, so as not to leave a blank line:
+            offset = descriptor.end() + len(rule[descriptor.end():]) - len(rule[descriptor.end():].lstrip())
+        last = descriptors[-1]
+        value_start = SRC_VALUE.match(rule, last.start()).end()
+        entries = [entry.group(0).strip() for entry in SRC_ENTRY.finditer(rule, value_start, last.end())]
+        entries = [entry for entry in entries if entry]
+        kept = []
+        for i, entry in enumerate(entries):
+            if entry.lower().startswith('local('):
+                kept.append(entry)
+            elif is_supported_font(entry):
+                kept.append(entry)
+                dropped = entries[i + 1:]
+                break
+            else:
+                dropped_here.extend(url.group(2) for url in URL.finditer(entry))
+        else:
+            # Nothing supported; leave the rule as it was rather than guess.
+            return rule
+        dropped_here.extend(url.group(2) for entry in dropped for url in URL.finditer(entry))
+        pieces.append(rule[offset:value_start])
+        pieces.append(', '.join(kept))
+        # Keep whatever whitespace and semicolon ended the value:
+        value = rule[value_start:last.end()]
+        pieces.append(value[len(value.rstrip('; \t\r\n\f')):])
+        pieces.append(rule[last.end():])
+        dropped_urls.extend(dropped_here)
+        return ''.join(pieces)
+
+    return FONT_FACE.sub(slimmed_rule, css), dropped_urls
+
+
+def is_supported_font(entry):
+    """Return whether Firefox can use the font of a ``src`` entry, judging
+    by its format hint or, lacking one, its file extension."""
+    url = URL.search(entry)
+    if url is None:
+        return False
+    format = FORMAT.search(entry)
+    if format:
+        return format.group(1).lower() in SUPPORTED_FONT_FORMATS
+    if url.group(2).startswith('data:'):
+        return True
+    return pathlib.PurePosixPath(urlsplit(url.group(2)).path).suffix.lower() not in UNSUPPORTED_FONT_EXTENSIONS
+
+
+def placeholder_for(data):
+    """Return a placeholder PNG with the dimensions of the raster image
+    whose bytes are ``data``, or None if it isn't a raster image we can
+    measure, its size is implausible, or the placeholder would be no
+    smaller."""
+    size = image_size(data)
+    # Malformed headers can claim negative or enormous sizes, which we'd
+    # either choke on or spend ages compressing:
+    if size is None or not all(0 < side <= MAX_PLACEHOLDER_SIDE for side in size):
+        return None
+    placeholder = placeholder_png(*size)
+    return placeholder if len(placeholder) < len(data) else None
+
+
+def image_size(data):
+    """Return the (width, height) of a PNG, GIF, JPEG, WebP, or BMP image,
+    reading just enough of its header, or None if it isn't one of those or
+    is malformed."""
+    try:
+        if data.startswith(b'\x89PNG\r\n\x1a\n') and data[12:16] == b'IHDR':
+            return struct.unpack('>II', data[16:24])
+        if data[:6] in (b'GIF87a', b'GIF89a'):
+            return struct.unpack('<HH', data[6:10])
+        if data.startswith(b'BM'):
+            width, height = struct.unpack('<ii', data[18:26])
+            return width, abs(height)
+        if data.startswith(b'RIFF') and data[8:12] == b'WEBP':
+            chunk = data[12:16]
+            if chunk == b'VP8 ':
+                width, height = struct.unpack('<HH', data[26:30])
+                return width & 0x3fff, height & 0x3fff
+            if chunk == b'VP8L':
+                bits, = struct.unpack('<I', data[21:25])
+                return (bits & 0x3fff) + 1, ((bits >> 14) & 0x3fff) + 1
+            if chunk == b'VP8X':
+                return (int.from_bytes(data[24:27], 'little') + 1,
+                        int.from_bytes(data[27:30], 'little') + 1)
+            return None
+        if data.startswith(b'\xff\xd8'):
+            return jpeg_size(data)
+    except struct.error:  # truncated
+        return None
+    return None
+
+
+def jpeg_size(data):
+    """Return the (width, height) of a JPEG from its start-of-frame
+    segment, or None if there isn't one.
+
+    The size is as displayed: Firefox rotates JPEGs as their EXIF orientation
+    says, so for orientations that turn the image on its side, we swap the
+    width and height.
+
+    """
+    position = 2
+    orientation = 1
+    while position + 4 <= len(data):
+        if data[position] != 0xff:
+            return None
+        marker = data[position + 1]
+        if marker == 0xff:  # fill byte
+            position += 1
+        elif marker in JPEG_START_OF_FRAME_MARKERS:
+            height, width = struct.unpack('>HH', data[position + 5:position + 9])
+            return (height, width) if orientation in SIDEWAYS_ORIENTATIONS else (width, height)
+        elif marker == 0x01 or 0xd0 <= marker <= 0xd8:  # no length
+            position += 2
+        else:
+            length, = struct.unpack('>H', data[position + 2:position + 4])
+            if marker == 0xe1:  # APP1, where EXIF lives
+                orientation = exif_orientation(data[position + 4:position + 2 + length]) or orientation
+            position += 2 + length
+    return None
+
+
+def exif_orientation(segment):
+    """Return the orientation recorded in the first IFD of an APP1 segment
+    of EXIF data, or None if there isn't one."""
+    if not segment.startswith(b'Exif\x00\x00'):
+        return None
+    tiff = segment[6:]
+    byte_order = {b'II': '<', b'MM': '>'}.get(tiff[:2])
+    if byte_order is None:
+        return None
+    try:
+        ifd_offset, = struct.unpack(byte_order + 'I', tiff[4:8])
+        num_entries, = struct.unpack(byte_order + 'H', tiff[ifd_offset:ifd_offset + 2])
+        for entry in range(ifd_offset + 2, ifd_offset + 2 + 12 * num_entries, 12):
+            tag, _, _, value = struct.unpack(byte_order + 'HHIH', tiff[entry:entry + 10])
+            if tag == EXIF_ORIENTATION_TAG:
+                return value
+    except struct.error:  # truncated
+        return None
+    return None
+
+
+def placeholder_png(width, height):
+    """Return the bytes of a solid gray PNG of the given dimensions.
+
+    It's a 1-bit paletted image, so even a large one compresses to almost
+    nothing.
+
+    """
+    row = b'\x00' + bytes((width + 7) // 8)  # filter type, then pixels
+    compressor = zlib.compressobj(9)
+    # Compress a bounded number of rows at a time to spare memory:
+    rows_per_piece = max(1, (1 << 20) // len(row))
+    pieces = [compressor.compress(row * min(rows_per_piece, height - start))
+              for start in range(0, height, rows_per_piece)]
+    pieces.append(compressor.flush())
+    return b''.join([b'\x89PNG\r\n\x1a\n',
+                     png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 1, 3, 0, 0, 0)),
+                     png_chunk(b'PLTE', PLACEHOLDER_GRAY),
+                     png_chunk(b'IDAT', b''.join(pieces)),
+                     png_chunk(b'IEND', b'')])
+
+
+def png_chunk(kind, data):
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
@@ -2,16 +2,19 @@ from json import JSONDecodeError, loads
 from pathlib import Path
 
 import click
-from click import argument, BadOptionUsage, BadParameter, command, option
+from click import argument, BadOptionUsage, BadParameter, command, option, UsageError
+import torch
 
-from ..accuracy import accuracy_per_tag, per_tag_metrics, pretty_accuracy, print_per_tag_report
-from ..utils import classifier, path_or_none, speed_readout, tensor, tensors_from
+from ..accuracy import accuracy_per_tag, bootstrap_confidence_intervals, page_confusion_counts, pretty_accuracy, pretty_accuracy_comparison, report_per_tag
+from ..utils import classifier, feature_columns, needs_vectorizing, path_or_none, phase, speed_readout, tensor, tensors_from
 from ..vectorizer import make_or_find_vectors
 
 
 def decode_weights(ctx, param, value):
     """Validate a click option, making sure it's a valid JSON object with
     properly formatted "coeff" and "bias" keys."""
+    if value is None:  # an omitted option
+        return None
     try:
         decoded_weights = loads(value)
     except JSONDecodeError:
@@ -30,6 +33,39 @@ def decode_weights(ctx, param, value):
     return decoded_weights
 
 
+def decode_weights_list(ctx, param, values):
+    """Validate a click argument that takes any number of WEIGHTS objects."""
+    return [decode_weights(ctx, param, value) for value in values]
+
+
+def decode_weights_file(ctx, param, file):
+    """Validate a click option naming a file of WEIGHTS objects, one per
+    line. Blank lines are skipped."""
+    if file is None:
+        return []
+    return [decode_weights(ctx, param, line) for line in file if line.strip()]
+
+
+def stacked_weights(weightses, feature_names):
+    """Return a tensor of coefficients, one column per set of weights, and a
+    tensor of biases, so ``x @ coeffs + biases`` scores every candidate linear
+    model in a single matrix multiplication.
+
+    :arg weightses: A list of dicts with coeff and bias keys, as decoded by
+        ``decode_weights()``
+    :arg feature_names: The ordered list of feature names so we can get the
+        coeffs lined up with the feature order used by the vectors
+
+    """
+    coeff_dicts = [dict(weights['coeffs']) for weights in weightses]
+    for number, coeffs in enumerate(coeff_dicts, start=1):
+        missing = [f for f in feature_names if f not in coeffs]
+        if missing:
+            raise BadParameter(f'Weights #{number} have no coefficients for these rules: {", ".join(missing)}.')
+    return (tensor([[coeffs[f] for coeffs in coeff_dicts] for f in feature_names]).reshape(len(feature_names), len(weightses)),
+            tensor([weights['bias'] for weights in weightses]))
+
+
 def model_from_json(weights, num_outputs, feature_names):
     """Return a linear model with the the passed in coeffs and biases.
 
@@ -40,7 +76,7 @@ def model_from_json(weights, num_outputs, feature_names):
         coeffs lined up with the feature order used by the vectors
 
     """
-    model = classifier(len(weights['coeffs']), num_outputs)
+    model = classifier(len(feature_names), num_outputs)
     coeffs = dict(weights['coeffs'])
     model.load_state_dict({'0.weight': tensor([[coeffs[f] for f in feature_names]]),
                            '0.bias': tensor([weights['bias']])})
@@ -51,7 +87,7 @@ def model_from_json(weights, num_outputs, feature_names):
 @argument('testing_set',
           type=click.Path(exists=True, resolve_path=True),
           metavar='TESTING_SET_FOLDER')
-@argument('weights', callback=decode_weights)
+@argument('weights', nargs=-1, callback=decode_weights_list)
 @option('--confidence-threshold', '-t',
         default=0.5,
         show_default=True,
@@ -86,12 +122,45 @@ def model_from_json(weights, num_outputs, feature_names):
         default=False,
         is_flag=True,
         help='Show per-tag diagnostics, even though that could ruin blinding for the test set.')
-def test(testing_set, weights, confidence_threshold, ruleset, trainee, testing_cache, delay, tabs, show_browser, verbose):
+@option('--exclude', '-x',
+        type=str,
+        multiple=True,
+        help='Exclude a rule while testing. Use this to test weights trained with the same --exclude options.')
+@option('--weights-file', '-f',
+        type=click.File(encoding='utf-8'),
+        callback=decode_weights_file,
+        help='A file of WEIGHTS objects, one per line, to test in addition to any passed as arguments')
+@option('--bootstrap', '-b',
+        type=click.IntRange(min=0),
+        default=0,
+        metavar='RESAMPLES',
+        help='Compute confidence intervals by resampling pages this many times (1000 is a good start) rather than with the normal approximation. This accounts for tags on a page succeeding or failing together and is sound even for small sets. 0 turns it off. [default: 0]')
+@option('--only-errors',
+        default=False,
+        is_flag=True,
+        help='Show only false positives and false negatives in the --verbose per-tag report.')
+@option('--worst',
+        type=click.IntRange(min=1),
+        default=None,
+        metavar='N',
+        help='Show only the N pages with the most errors in the --verbose per-tag report, worst first.')
+@option('--min-score',
+        type=click.FloatRange(0, 1),
+        default=None,
+        metavar='SCORE',
+        help='Show only tags the model scored at least this confident in the --verbose per-tag report.')
+@option('--json-report',
+        type=click.File('w', encoding='utf-8'),
+        default=None,
+        metavar='FILE',
+        help='Write the --verbose per-tag report to a file as JSON lines, one page per line, instead of printing it. Pass - for stdout.')
+def test(testing_set, weights, confidence_threshold, ruleset, trainee, testing_cache, delay, tabs, show_browser, verbose, exclude, weights_file, bootstrap, only_errors, worst, min_score, json_report):
     """
     Evaluate how well a trained ruleset does.
 
-    TESTING_SET_FOLDER is a directory of labeled testing pages. It can also be,
-    for backward compatibility, a JSON file of vectors from FathomFox's
+    TESTING_SET_FOLDER is a directory of labeled testing pages. It can also be
+    a manifest listing them, written by ``fathom pick --manifest``, or, for
+    backward compatibility, a JSON file of vectors from FathomFox's
     Vectorizer.
 
     WEIGHTS should be a JSON-formatted object, as follows. You can paste it
@@ -104,13 +173,21 @@ def test(testing_set, weights, confidence_threshold, ruleset, trainee, testing_c
     \b
          "bias": -8.645608901977539}
 
+    To compare several candidate sets of weights, pass more than one WEIGHTS
+    object, or put them in a ``--weights-file``. The testing vectors are then
+    loaded once, all the candidates are scored together, and their accuracy is
+    shown side by side, numbered in the order given.
+
     """
+    weights = weights + weights_file
+    if not weights:
+        raise UsageError('Pass at least one WEIGHTS object or a --weights-file.')
     testing_set = Path(testing_set)
-    if testing_set.is_dir():
+    if needs_vectorizing(testing_set):
         if not ruleset:
-            raise BadOptionUsage('ruleset', 'A --ruleset file must be specified when TESTING_SET_FOLDER is passed a directory.')
+            raise BadOptionUsage('ruleset', 'A --ruleset file must be specified when TESTING_SET_FOLDER is passed a directory or manifest.')
         if not trainee:
-            raise BadOptionUsage('trainee', 'A --trainee ID must be specified when TESTING_SET_FOLDER is passed a directory.')
+            raise BadOptionUsage('trainee', 'A --trainee ID must be specified when TESTING_SET_FOLDER is passed a directory or manifest.')
 
     testing_data = make_or_find_vectors(ruleset,
                                         trainee,
@@ -121,15 +198,38 @@ def test(testing_set, weights, confidence_threshold, ruleset, trainee, testing_c
                                         delay,
                                         tabs)
     testing_pages = testing_data['pages']
-    x, y, num_yes, num_prunes = tensors_from(testing_pages)
-    model = model_from_json(weights, len(y[0]), testing_data['header']['featureNames'])
-
-    accuracy, false_positives, false_negatives = accuracy_per_tag(y, model(x), confidence_threshold, num_prunes)
-    print(pretty_accuracy('Testing', accuracy, len(x), false_positives, false_negatives, num_yes + num_prunes))
+    columns, feature_names = feature_columns(testing_data['header']['featureNames'], exclude)
+    x, y, num_yes, num_prunes = tensors_from(testing_pages, columns=columns)
+    coeffs, biases = stacked_weights(weights, feature_names)
+    with phase('score'):
+        with torch.no_grad():
+            scores = x @ coeffs + biases  # one column per set of weights
+        accuracies = [accuracy_per_tag(y, scores[:, [i]], confidence_threshold, num_prunes)
+                      for i in range(len(weights))]
+    bootstrap_cises = [bootstrap_confidence_intervals(page_confusion_counts(y, scores[:, [i]], confidence_threshold, testing_pages),
+                                                      bootstrap) if bootstrap else None
+                       for i in range(len(weights))]
+    if len(weights) == 1:
+        (accuracy, false_positives, false_negatives), = accuracies
+        print(pretty_accuracy('Testing', accuracy, len(x) + num_prunes, false_positives, false_negatives, num_yes, bootstrap_cis=bootstrap_cises[0]))
+    else:
+        print(pretty_accuracy_comparison(
+            (f'#{number}', accuracy, len(x) + num_prunes, false_positives, false_negatives, num_yes, cis)
+            for number, ((accuracy, false_positives, false_negatives), cis) in enumerate(zip(accuracies, bootstrap_cises), start=1)))
 
     if testing_pages and 'time' in testing_pages[0]:
         print(speed_readout(testing_pages))
 
     if verbose:
-        print('\nTesting per-tag results:')
-        print_per_tag_report([per_tag_metrics(page, model, confidence_threshold) for page in testing_pages])
+        for number, candidate in enumerate(weights, start=1):
+            model = model_from_json(candidate, len(y[0]), feature_names)
+            report_per_tag('Testing' + (f' (weights #{number})' if len(weights) > 1 else ''),
+                           testing_pages,
+                           model,
+                           confidence_threshold,
+                           columns,
+                           json_report,
+                           testing_set,
+                           only_errors=only_errors,
+                           worst=worst,
+                           min_score=min_score)
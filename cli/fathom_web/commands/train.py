@@ -1,7 +1,11 @@
+from contextlib import nullcontext
+from copy import deepcopy
+from multiprocessing import cpu_count, Pool
 from pathlib import Path
 from more_itertools import pairwise
 from pprint import pformat
-from statistics import mean
+from random import sample
+from statistics import mean, stdev
 from bisect import bisect_left
 
 import click
@@ -13,18 +17,37 @@ from torch.nn import BCEWithLogitsLoss
 from torch.optim import Adam
 import numpy as np
 
-from ..accuracy import accuracy_per_tag, per_tag_metrics, pretty_accuracy, print_per_tag_report
-from ..utils import classifier, path_or_none, speed_readout, tensors_from
+from ..accuracy import accuracy_metrics, accuracy_per_tag, bootstrap_confidence_intervals, page_confusion_counts, pretty_accuracy, report_per_tag
+from ..utils import classifier, deduplicated, feature_columns, fold_standardization, init_worker, needs_vectorizing, page_sizes, path_or_none, phase, speed_readout, standardization, subsampled_negatives, tensors_from, unfold_standardization, worker_state
 from ..vectorizer import make_or_find_vectors
+from .test import decode_weights, model_from_json
 
 
-def learn(learning_rate, iterations, x, y, num_prunes, num_samples, positives, validation=None, stop_early=False, run_comment='', pos_weight=None, layers=[]):
-    # Define a neural network using high-level modules.
+@phase('learn')
+def learn(learning_rate, iterations, x, y, num_prunes, num_samples, positives, validation=None, stop_early=False, run_comment='', pos_weight=None, layers=[], quiet=False, model=None, counts=None):
+    """Train and return a model.
+
+    :arg quiet: Don't draw a progress bar or announce early stopping, as when
+        several models are training at once
+    :arg model: A model to continue training, or None to start from a new,
+        randomly initialized one with the given ``layers``
+    :arg counts: How many tags each row of ``x`` stands for, as from
+        ``deduplicated()``, or None if each stands for one
+
+    """
     writer = SummaryWriter(comment=run_comment)
-    model = classifier(len(x[0]), len(y[0]), layers)
+    if model is None:
+        # Define a neural network using high-level modules.
+        model = classifier(len(x[0]), len(y[0]), layers)
     if pos_weight:
         pos_weight = tensor([pos_weight])
     loss_fn = BCEWithLogitsLoss(reduction='sum', pos_weight=pos_weight)  # reduction=mean converges slower.
+    # Weighting each row's loss by its count is the same as summing over
+    # every copy:
+    if counts is None:
+        training_loss_fn = loss_fn
+    else:
+        training_loss_fn = BCEWithLogitsLoss(reduction='sum', pos_weight=pos_weight, weight=counts.to(y.dtype).reshape(-1, 1))
     # TODO: Maybe also graph using add_pr_curve(), which can show how that tradeoff is going.
     optimizer = Adam(model.parameters(), lr=learning_rate)
 
@@ -32,10 +55,10 @@ def learn(learning_rate, iterations, x, y, num_prunes, num_samples, positives, v
         validation_ins, validation_outs = validation
         previous_validation_loss = None
     stopped_early = False
-    with progressbar(range(iterations), label='Training') as bar:
+    with (nullcontext(range(iterations)) if quiet else progressbar(range(iterations), label='Training')) as bar:
         for t in bar:
             y_pred = model(x)  # Make predictions.
-            loss = loss_fn(y_pred, y)
+            loss = training_loss_fn(y_pred, y)
             # The loss function doesn't take num_prunes into account, but
             # that's okay; we're only trying to minimize it, not arrive at 0
             # precisely when accuracy is 1.
@@ -49,14 +72,17 @@ def learn(learning_rate, iterations, x, y, num_prunes, num_samples, positives, v
                         break
                     else:
                         previous_validation_loss = validation_loss
-                        previous_model = model.state_dict()
+                        # state_dict() shares storage with the live
+                        # parameters, which the optimizer updates in place,
+                        # so snapshot copies:
+                        previous_model = {k: v.clone() for k, v in model.state_dict().items()}
                 writer.add_scalar('validation_loss', validation_loss, t)
-            accuracy, _, _ = accuracy_per_tag(y, y_pred, cutoff=0.5, num_prunes=num_prunes)
+            accuracy, _, _ = accuracy_per_tag(y, y_pred, cutoff=0.5, num_prunes=num_prunes, counts=counts)
             writer.add_scalar('training_accuracy_per_tag', accuracy, t)
             optimizer.zero_grad()  # Zero the gradients.
             loss.backward()  # Compute gradients.
             optimizer.step()
-    if stopped_early:
+    if stopped_early and not quiet:
         print(f'Stopping early at iteration {t}, just before validation error rose.')
 
     # Horizontal axis is what confidence. Vertical is how many samples were that confidence.
@@ -65,11 +91,20 @@ def learn(learning_rate, iterations, x, y, num_prunes, num_samples, positives, v
     return model
 
 
-def possible_cutoffs(y_pred):
+def possible_cutoffs(y_pred, counts=None):
     """Using y_pred get the sigmoid values, round the values and get the unique list.
-    This will reduce the number of cutoffs to be evaluated."""
+    This will reduce the number of cutoffs to be evaluated.
+
+    :arg counts: How many tags each row of ``y_pred`` stands for, or None if
+        each stands for one
+
+    """
     with torch.no_grad():
         flattened = y_pred.sigmoid().numpy().flatten()
+        if counts is not None:
+            # A repeated value contributes itself as a midpoint. Further
+            # repeats add nothing new.
+            flattened = np.repeat(flattened, np.where(counts.numpy() > 1, 2, 1))
         cutoffs = np.sort(flattened)
         if len(cutoffs) > 1:
             new_cutoffs = [(current + next) / 2 for current, next in pairwise(cutoffs)]
@@ -88,16 +123,17 @@ def single_cutoff(cutoffs):
     return cutoffs[pos]
 
 
-def find_optimal_cutoff(y, y_pred, num_prunes):
+@phase('find cutoff')
+def find_optimal_cutoff(y, y_pred, num_prunes, counts=None):
     """Evaluates possible cutoff values using accuracy as the metric.
     If more than 1 cutoff gives the highest accuracy the midpoint
     between the min and max cutoff is used."""
     max_accuracy = 0
     optimal_cutoffs = []
 
-    possibles = possible_cutoffs(y_pred)
+    possibles = possible_cutoffs(y_pred, counts)
     for test_cutoff in possibles:
-        accuracy, _, _ = accuracy_per_tag(y, y_pred, test_cutoff, num_prunes)
+        accuracy, _, _ = accuracy_per_tag(y, y_pred, test_cutoff, num_prunes, counts)
         if accuracy == max_accuracy:
             optimal_cutoffs.append(test_cutoff)
         elif accuracy > max_accuracy:
@@ -107,10 +143,137 @@ def find_optimal_cutoff(y, y_pred, num_prunes):
     return single_cutoff(optimal_cutoffs)
 
 
+def fit(learning_rate, iterations, x, y, num_prunes, positives, validation=None, standardize=False, model=None, deduplicate=False, negative_ratio=None, **kwargs):
+    """Train a model with ``learn()``, and return it along with its optimal
+    cutoff on the training set.
+
+    :arg standardize: Whether to train on standardized features. Either way,
+        the returned model works on unscaled ones.
+    :arg model: A model to start from, working on unscaled features, or None
+    :arg deduplicate: Whether to train on only the unique rows of ``x`` and
+        ``y``, each weighted by how many times it occurs. This gives the same
+        model and cutoff with less work when many tags look alike.
+    :arg negative_ratio: If truthy, train on all the positive rows but only
+        about this many randomly chosen negative ones per positive, weighted
+        to stand for the rest. See ``subsampled_negatives()``.
+    :arg kwargs: Any further keyword arguments for ``learn()``
+
+    """
+    num_samples = len(x) + num_prunes
+    counts = None
+    if negative_ratio:
+        x, y, counts = subsampled_negatives(x, y, negative_ratio)
+    if deduplicate:
+        x, y, counts = deduplicated(x, y, counts)
+    if standardize:
+        mean, std = standardization(x, counts)
+        training_ins = (x - mean) / std
+        if validation:
+            validation_ins, validation_outs = validation
+            validation = (validation_ins - mean) / std, validation_outs
+        if model is not None:
+            unfold_standardization(model, mean, std)
+    else:
+        training_ins = x
+    model = learn(learning_rate,
+                  iterations,
+                  training_ins,
+                  y,
+                  num_prunes,
+                  num_samples,
+                  positives,
+                  validation=validation,
+                  model=model,
+                  counts=counts,
+                  **kwargs)
+    if standardize:
+        fold_standardization(model, mean, std)
+    with torch.no_grad():
+        return model, find_optimal_cutoff(y, model(x), num_prunes, counts)
+
+
+def split_into_folds(pages, folds):
+    """Deal pages randomly into ``folds`` groups of nearly equal size.
+
+    Return, for each fold, a tuple of (a tensor of the indices of its rows in
+    the unshuffled output of ``tensors_from(pages)``, its number of targets,
+    its number of prunes). Splitting by page rather than by node keeps a
+    page's nodes, which tend to resemble each other, from leaking across
+    folds.
+
+    """
+    unpruned, targets, prunes = page_sizes(pages)
+    page_starts = np.cumsum(unpruned) - unpruned
+    shuffled = sample(range(len(pages)), len(pages))
+    result = []
+    for fold in range(folds):
+        fold_pages = shuffled[fold::folds]
+        rows = np.concatenate([np.arange(page_starts[p], page_starts[p] + unpruned[p]) for p in fold_pages]).astype(np.int64)
+        result.append((torch.from_numpy(rows),
+                       int(targets[fold_pages].sum()),
+                       int(prunes[fold_pages].sum())))
+    return result
+
+
+def train_fold(fold):
+    """Train a model on all the folds in ``worker_state`` but one, and return
+    its ``accuracy_metrics()`` on that one."""
+    x, y = worker_state['x'], worker_state['y']
+    folds = worker_state['folds']
+    held_out_rows, held_out_yes, held_out_prunes = folds[fold]
+    others = [f for i, f in enumerate(folds) if i != fold]
+    training_rows = torch.cat([rows for rows, _, _ in others])
+    settings = dict(worker_state['settings'])
+    settings['model'] = deepcopy(settings['model'])  # Each fold starts fresh.
+    settings['run_comment'] += f',fold={fold + 1}'
+
+    held_out_ins, held_out_outs = x[held_out_rows], y[held_out_rows]
+    model, optimal_cutoff = fit(x=x[training_rows],
+                                y=y[training_rows],
+                                num_prunes=sum(prunes for _, _, prunes in others),
+                                positives=sum(yes for _, yes, _ in others),
+                                validation=(held_out_ins, held_out_outs),
+                                quiet=True,
+                                **settings)
+    with torch.no_grad():
+        accuracy, false_positives, false_negatives = accuracy_per_tag(held_out_outs, model(held_out_ins), optimal_cutoff, held_out_prunes)
+    return accuracy_metrics(accuracy, len(held_out_rows) + held_out_prunes, false_positives, false_negatives, held_out_yes)
+
+
+def cross_validation_report(metricses):
+    """Return a printable table of per-fold metrics and their mean and
+    standard deviation.
+
+    :arg metricses: A list of ``accuracy_metrics()`` dicts, one per fold
+
+    """
+    keys = ['accuracy', 'false_positive_rate', 'false_negative_rate', 'mcc']
+    lines = ['',
+             'Fold   Accuracy        FPR        FNR        MCC']
+    for fold, metrics in enumerate(metricses, start=1):
+        lines.append(f'{fold: >4}' + ''.join(f'   {metrics[key]:8.4f}' for key in keys))
+    lines.append('Mean' + ''.join(f'   {mean(m[key] for m in metricses):8.4f}' for key in keys))
+    lines.append('  SD' + ''.join(f'   {stdev(m[key] for m in metricses):8.4f}' for key in keys))
+    return '\n'.join(lines)
+
+
 def confidences(model, x):
     return model(x).sigmoid()
 
 
+def aligned_weights(weights, feature_names):
+    """Return a copy of decoded JSON ``weights`` with exactly one coefficient
+    per feature, in the order of ``feature_names``.
+
+    Features the weights don't mention get a coefficient of 0. Coefficients
+    for features that no longer exist are dropped.
+
+    """
+    coeffs = dict(weights['coeffs'])
+    return {'coeffs': [[name, coeffs.get(name, 0.0)] for name in feature_names],
+            'bias': weights['bias']}
+
+
 def pretty_coeffs(model, feature_names):
     """Format coefficient and bias numbers for easy pasting into JS."""
     dict_params = {}
@@ -126,31 +289,6 @@ def pretty_coeffs(model, feature_names):
      "bias": {bias}}}""".format(coeffs=pretty, bias=dict_params['0.bias'][0]))
 
 
-def exclude_indices(excluded_indices, list):
-    """Remove the elements at the given indices from the list, and return
-    it."""
-    # I benched this, and del turns out to be over twice as fast as
-    # concatenating a bunch of slices on a list of 32 items.
-    vacuum = 0
-    for i in excluded_indices:
-        del list[i - vacuum]
-        vacuum += 1
-    return list
-
-
-def exclude_features(exclude, vector_data):
-    """Given a JSON-decoded vector file, remove any excluded features, and
-    return the modified object."""
-    feature_names = vector_data['header']['featureNames']
-    excluded_indices = [feature_names.index(e) for e in exclude]
-    exclude_indices(excluded_indices, feature_names)
-    for page in vector_data['pages']:
-        for tag in page['nodes']:
-            if not tag.get('pruned'):
-                exclude_indices(excluded_indices, tag['features'])
-    return vector_data
-
-
 @command()
 @argument('training_set',
           type=click.Path(exists=True, resolve_path=True),
@@ -189,7 +327,7 @@ def exclude_features(exclude, vector_data):
         type=click.Path(exists=True, resolve_path=True),
         callback=path_or_none,
         metavar='FOLDER',
-        help="Either a folder of validation pages or a JSON file made manually by FathomFox's Vectorizer. Validation pages are used to avoid overfitting.")
+        help="Either a folder of validation pages, a manifest of them from `fathom pick --manifest`, or a JSON file made manually by FathomFox's Vectorizer. Validation pages are used to avoid overfitting.")
 @option('--stop-early/--no-early-stopping', '-s',
         default=True,
         show_default=True,
@@ -222,7 +360,56 @@ def exclude_features(exclude, vector_data):
         type=str,
         multiple=True,
         help='Exclude a rule while training. This helps with before-and-after tests to see if a rule is effective.')
-def train(training_set, validation_set, ruleset, trainee, training_cache, validation_cache, delay, tabs, show_browser, stop_early, learning_rate, iterations, pos_weight, comment, quiet, layers, exclude):
+@option('--standardize',
+        default=False,
+        is_flag=True,
+        help='Rescale each feature to mean 0 and standard deviation 1 while training. This usually converges in far fewer iterations when features have very different ranges, and it tolerates lower learning rates. The printed coefficients are adjusted to work on unscaled features, so you can paste them into your ruleset as usual.')
+@option('--deduplicate',
+        default=False,
+        is_flag=True,
+        help='Train on only the distinct tags, counting each as many times as it occurs. This gives the same results with less work when many tags have identical features, like the hundreds of boring <div>s on a typical page.')
+@option('--negative-ratio',
+        type=click.FloatRange(min=0),
+        default=0,
+        metavar='RATIO',
+        help='Train on all the targets but only about this many randomly chosen non-targets per target, each counted as standing for the ones left out. Training then scales with the number of targets rather than of tags. Accuracy is still reported on every tag. 0 turns it off. [default: 0]')
+@option('--init-weights', '-w',
+        callback=decode_weights,
+        metavar='WEIGHTS',
+        help='Start training from previously trained coefficients rather than random ones, which can save many iterations after a small ruleset change. Takes the same JSON object as `fathom test` and the output of this command. Coefficients for new rules start at 0, and those for rules no longer present are ignored. Cannot be combined with --layer.')
+@option('--folds', '-k',
+        type=click.IntRange(min=2),
+        default=None,
+        help='Instead of training one model, estimate how well training generalizes using k-fold cross-validation: split the training pages into this many groups, train one model per group on all the others in parallel, and report the mean and spread of accuracy on the held-out groups. Cannot be combined with --validation-set.')
+@option('--number-of-workers',
+        default=cpu_count(),
+        show_default=True,
+        help='The number of --folds to train at once')
+@option('--bootstrap', '-b',
+        type=click.IntRange(min=0),
+        default=0,
+        metavar='RESAMPLES',
+        help='Compute confidence intervals by resampling pages this many times (1000 is a good start) rather than with the normal approximation. This accounts for tags on a page succeeding or failing together and is sound even for small sets. 0 turns it off. [default: 0]')
+@option('--only-errors',
+        default=False,
+        is_flag=True,
+        help='Show only false positives and false negatives in the per-tag report.')
+@option('--worst',
+        type=click.IntRange(min=1),
+        default=None,
+        metavar='N',
+        help='Show only the N pages with the most errors in the per-tag report, worst first.')
+@option('--min-score',
+        type=click.FloatRange(0, 1),
+        default=None,
+        metavar='SCORE',
+        help='Show only tags the model scored at least this confident in the per-tag report.')
+@option('--json-report',
+        type=click.File('w', encoding='utf-8'),
+        default=None,
+        metavar='FILE',
+        help='Write the per-tag report to a file as JSON lines, one page per line, instead of printing it. Pass - for stdout.')
+def train(training_set, validation_set, ruleset, trainee, training_cache, validation_cache, delay, tabs, show_browser, stop_early, learning_rate, iterations, pos_weight, comment, quiet, layers, exclude, standardize, deduplicate, negative_ratio, init_weights, folds, number_of_workers, bootstrap, only_errors, worst, min_score, json_report):
     """Compute optimal numerical parameters for a Fathom ruleset.
 
     The usual invocation is something like this::
@@ -230,7 +417,8 @@ def train(training_set, validation_set, ruleset, trainee, training_cache, valida
         fathom train samples/training --validation-set samples/validation --ruleset rulesets.js --trainee new
 
     The first argument is a directory of labeled training pages. It can also
-    be, for backward compatibility, a JSON file of vectors from FathomFox's
+    be a manifest listing them, written by ``fathom pick --manifest``, or,
+    for backward compatibility, a JSON file of vectors from FathomFox's
     Vectorizer.
 
     To see graphs of loss functions, install TensorBoard, then run
@@ -252,67 +440,103 @@ def train(training_set, validation_set, ruleset, trainee, training_cache, valida
 
     """
     training_set = Path(training_set)
-
-    # If they pass in a dir for either the training or validation sets, we need
-    # a ruleset and a trainee for vectorizing:
-    if (validation_set and validation_set.is_dir()) or training_set.is_dir():
+    if init_weights and layers:
+        raise BadOptionUsage('init_weights', '--init-weights can be used only with models that have no hidden --layers.')
+    if folds and validation_set:
+        raise BadOptionUsage('folds', '--folds makes its own validation sets out of the training set, so it cannot be combined with --validation-set.')
+
+    # If they pass in a dir or manifest for either the training or validation
+    # sets, we need a ruleset and a trainee for vectorizing:
+    if (validation_set and needs_vectorizing(validation_set)) or needs_vectorizing(training_set):
         if not ruleset:
-            raise BadOptionUsage('ruleset', 'A --ruleset file must be specified when TRAINING_SET_FOLDER or --validation-set are passed a directory.')
+            raise BadOptionUsage('ruleset', 'A --ruleset file must be specified when TRAINING_SET_FOLDER or --validation-set are passed a directory or manifest.')
         if not trainee:
-            raise BadOptionUsage('trainee', 'A --trainee ID must be specified when TRAINING_SET_FOLDER or --validation-set are passed a directory.')
-
-    training_data = exclude_features(
-        exclude,
-        make_or_find_vectors(ruleset,
-                             trainee,
-                             training_set,
-                             training_cache,
-                             show_browser,
-                             'training',
-                             delay,
-                             tabs))
+            raise BadOptionUsage('trainee', 'A --trainee ID must be specified when TRAINING_SET_FOLDER or --validation-set are passed a directory or manifest.')
+
+    training_data = make_or_find_vectors(ruleset,
+                                         trainee,
+                                         training_set,
+                                         training_cache,
+                                         show_browser,
+                                         'training',
+                                         delay,
+                                         tabs)
     training_pages = training_data['pages']
-    x, y, num_yes, num_prunes = tensors_from(training_pages, shuffle=True)
+    columns, feature_names = feature_columns(training_data['header']['featureNames'], exclude)
+    # Row order doesn't matter to full-batch training, and cross-validation
+    # and bootstrapping rely on rows staying grouped by page:
+    x, y, num_yes, num_prunes = tensors_from(training_pages, shuffle=not (folds or bootstrap), columns=columns)
     num_samples = len(x) + num_prunes
 
     if validation_set:
-        validation_pages = exclude_features(
-            exclude,
-            make_or_find_vectors(ruleset,
-                                 trainee,
-                                 validation_set,
-                                 validation_cache,
-                                 show_browser,
-                                 'validation',
-                                 delay,
-                                 tabs))['pages']
-        validation_ins, validation_outs, validation_yes, validation_prunes = tensors_from(validation_pages)
+        validation_data = make_or_find_vectors(ruleset,
+                                               trainee,
+                                               validation_set,
+                                               validation_cache,
+                                               show_browser,
+                                               'validation',
+                                               delay,
+                                               tabs)
+        validation_pages = validation_data['pages']
+        validation_columns, _ = feature_columns(validation_data['header']['featureNames'], exclude)
+        validation_ins, validation_outs, validation_yes, validation_prunes = tensors_from(validation_pages, columns=validation_columns)
         validation_arg = validation_ins, validation_outs
     else:
         validation_arg = None
 
     layers = list(layers)  # Comes in as tuple
-    full_comment = '.LR={l},i={i}{c}'.format(
+    full_comment = '.LR={l},i={i}{s}{c}'.format(
         l=learning_rate,
         i=iterations,
+        s=',standardized' if standardize else '',
         c=(',' + comment) if comment else '')
 
-    model = learn(learning_rate,
-                  iterations,
-                  x,
-                  y,
-                  num_prunes,
-                  num_samples,
-                  num_yes,
-                  validation=validation_arg,
-                  stop_early=stop_early,
-                  run_comment=full_comment,
-                  pos_weight=pos_weight,
-                  layers=layers)
-
-    optimal_cutoff = find_optimal_cutoff(y, model(x), num_prunes)
-
-    print(pretty_coeffs(model, training_data['header']['featureNames']))
+    if init_weights:
+        previous_features = [name for name, _ in init_weights['coeffs']]
+        new_features = [name for name in feature_names if name not in previous_features]
+        dropped_features = [name for name in previous_features if name not in feature_names]
+        if new_features:
+            print(f'Starting these new rules at 0: {", ".join(new_features)}')
+        if dropped_features:
+            print(f'Ignoring initial weights for these absent rules: {", ".join(dropped_features)}')
+        initial_model = model_from_json(aligned_weights(init_weights, feature_names), len(y[0]), feature_names)
+    else:
+        initial_model = None
+
+    settings = {'learning_rate': learning_rate,
+                'iterations': iterations,
+                'standardize': standardize,
+                'deduplicate': deduplicate,
+                'negative_ratio': negative_ratio,
+                'model': initial_model,
+                'stop_early': stop_early,
+                'run_comment': full_comment,
+                'pos_weight': pos_weight,
+                'layers': layers}
+
+    if folds:
+        if folds > len(training_pages):
+            raise BadOptionUsage('folds', f'There are only {len(training_pages)} training pages to split into {folds} folds.')
+        with Pool(min(number_of_workers, folds),
+                  initializer=init_worker,
+                  initargs=({'x': x,
+                             'y': y,
+                             'folds': split_into_folds(training_pages, folds),
+                             'settings': settings},)) as pool:
+            with phase('cross-validate'), progressbar(pool.imap(train_fold, range(folds)),
+                                                      label=f'Training {folds} folds',
+                                                      length=folds) as bar:
+                print(cross_validation_report(list(bar)))
+        return
+
+    model, optimal_cutoff = fit(x=x,
+                                y=y,
+                                num_prunes=num_prunes,
+                                positives=num_yes,
+                                validation=validation_arg,
+                                **settings)
+
+    print(pretty_coeffs(model, feature_names))
     print(f'\nOptimal cutoff: {optimal_cutoff:.2f}')
     accuracy, false_positives, false_negatives = accuracy_per_tag(y, model(x), optimal_cutoff, num_prunes)
     print(pretty_accuracy('Training',
@@ -320,15 +544,21 @@ def train(training_set, validation_set, ruleset, trainee, training_cache, valida
                           num_samples,
                           false_positives,
                           false_negatives,
-                          num_yes))
+                          num_yes,
+                          bootstrap_cis=bootstrap_confidence_intervals(
+                              page_confusion_counts(y, model(x), optimal_cutoff, training_pages),
+                              bootstrap) if bootstrap else None))
     if validation_set:
         accuracy, false_positives, false_negatives = accuracy_per_tag(validation_outs, model(validation_ins), optimal_cutoff, validation_prunes)
         print(pretty_accuracy('Validation',
                               accuracy,
-                              len(validation_ins),
+                              len(validation_ins) + validation_prunes,
                               false_positives,
                               false_negatives,
-                              validation_yes))
+                              validation_yes,
+                              bootstrap_cis=bootstrap_confidence_intervals(
+                                  page_confusion_counts(validation_outs, model(validation_ins), optimal_cutoff, validation_pages),
+                                  bootstrap) if bootstrap else None))
 
     # Print timing information:
     if training_pages and 'time' in training_pages[0]:
@@ -338,8 +568,7 @@ def train(training_set, validation_set, ruleset, trainee, training_cache, valida
             print(speed_readout(training_pages))
 
     if not quiet:
-        print('\nTraining per-tag results:')
-        print_per_tag_report([per_tag_metrics(page, model, optimal_cutoff) for page in training_pages])
+        filters = {'only_errors': only_errors, 'worst': worst, 'min_score': min_score}
+        report_per_tag('Training', training_pages, model, optimal_cutoff, columns, json_report, training_set, **filters)
         if validation_set:
-            print('\nValidation per-tag results:')
-            print_per_tag_report([per_tag_metrics(page, model, optimal_cutoff) for page in validation_pages])
+            report_per_tag('Validation', validation_pages, model, optimal_cutoff, validation_columns, json_report, validation_set, **filters)
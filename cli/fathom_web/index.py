@@ -0,0 +1,245 @@
+"""An index of the samples in a directory, kept in a SQLite database there,
+so commands can look up their hashes, original URLs, and labels without
+rereading every file"""
+
+from collections import namedtuple
+import hashlib
+from json import dumps, loads
+from multiprocessing import Pool
+from os import walk
+from pathlib import Path
+import re
+import sqlite3
+from time import time_ns
+from urllib.parse import urlparse
+
+from click import progressbar
+
+from .utils import read_chunks, samples_from_dir, stop_timings
+
+
+INDEX_NAME = '.fathom-index.sqlite3'
+SCHEMA_VERSION = 3
+ORIGINAL_URL = re.compile(rb'<link rel="original" href="([^"]+)">')
+LABEL = re.compile(rb'data-fathom="([^"]*)"')
+#: The coarsest modification-time resolution of the filesystems we expect,
+#: in ns: FAT's 2 seconds
+MTIME_GRANULARITY = 2_000_000_000
+
+#: What the index knows about a sample. ``path`` is relative to the indexed
+#: directory, the same as the filenames in a vector file. ``labels`` is a
+#: sorted list of the ``data-fathom`` types on the page.
+Sample = namedtuple('Sample', ['path', 'size', 'mtime', 'hash', 'original_url', 'domain', 'labels', 'resource_bytes'])
+
+
+def index_path(directory):
+    """Return the Path of the index database of a sample directory."""
+    return Path(directory) / INDEX_NAME
+
+
+def connect(directory):
+    """Return a connection to the index of ``directory``, creating it if
+    necessary."""
+    connection = sqlite3.connect(index_path(directory))
+    version, = connection.execute('PRAGMA user_version').fetchone()
+    if version != SCHEMA_VERSION:
+        # It's only a cache, so rebuilding it is always safe.
+        connection.executescript(f"""
+            DROP TABLE IF EXISTS samples;
+            DROP TABLE IF EXISTS signatures;
+            CREATE TABLE samples (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime INTEGER NOT NULL,
+                hash TEXT NOT NULL,
+                original_url TEXT NOT NULL,
+                domain TEXT NOT NULL,
+                labels TEXT NOT NULL,
+                resource_bytes INTEGER NOT NULL,
+                indexed INTEGER NOT NULL);
+            CREATE TABLE signatures (
+                hash TEXT PRIMARY KEY,
+                signature BLOB NOT NULL);
+            PRAGMA user_version = {SCHEMA_VERSION};
+            """)
+    return connection
+
+
+def described_sample(directory, relative_path):
+    """Read a sample, and return a Sample describing it."""
+    path = Path(directory) / relative_path
+    stat = path.stat()
+    hash = hashlib.new('sha256')
+    original_url = None
+    labels = set()
+    tail = b''
+    with path.open('rb') as file:
+        for chunk in read_chunks(file, 1024 * 1024):
+            hash.update(chunk)
+            # Overlap the chunks a bit so we don't miss matches spanning them:
+            text = tail + chunk
+            if original_url is None:
+                match = ORIGINAL_URL.search(text)
+                if match:
+                    original_url = match.group(1).decode('utf-8', errors='replace')
+            labels.update(match.group(1).decode('utf-8', errors='replace') for match in LABEL.finditer(text))
+            tail = text[-4096:]
+    original_url = original_url or ''
+    resources = path.parent / 'resources' / path.stem
+    resource_bytes = sum((Path(folder) / name).stat().st_size
+                         for folder, _, names in walk(resources)
+                         for name in names)
+    return Sample(path=relative_path,
+                  size=stat.st_size,
+                  mtime=stat.st_mtime_ns,
+                  hash=hash.hexdigest(),
+                  original_url=original_url,
+                  domain=urlparse(original_url).hostname or '',
+                  labels=sorted(labels),
+                  resource_bytes=resource_bytes)
+
+
+def _described_sample(directory_and_path):
+    return described_sample(*directory_and_path)
+
+
+def update_index(directory, number_of_workers=1, show_progress=False):
+    """Bring the index of a sample directory up to date, creating it if
+    necessary, and return a dict of relative paths to Samples, in the order
+    ``samples_from_dir()`` finds them.
+
+    Only samples whose size or modification time changed since they were
+    last indexed are reread, so this is fast when little has changed. Like
+    git, we can't see a change that keeps both the same, but we do reread
+    samples modified so soon before they were indexed that a later change
+    could have kept the same time on a filesystem with coarse timestamps.
+
+    :arg number_of_workers: How many processes to read changed samples with
+    :arg show_progress: Whether to show a progress bar while reading them
+
+    """
+    directory = Path(directory)
+    started = time_ns()
+    with connect(directory) as connection:
+        known = {row[0]: (Sample(*row[:6], loads(row[6]), row[7]), row[8])
+                 for row in connection.execute('SELECT * FROM samples')}
+        current = {}
+        stale = []
+        for sample in samples_from_dir(directory):
+            relative_path = str(sample.relative_to(directory))
+            stat = sample.stat()
+            row, indexed = known.get(relative_path, (None, None))
+            if (row is not None and row.size == stat.st_size and row.mtime == stat.st_mtime_ns and
+                    row.mtime < indexed - MTIME_GRANULARITY):
+                current[relative_path] = row
+            else:
+                current[relative_path] = None
+                stale.append(relative_path)
+
+        if stale:
+            jobs = [(directory, relative_path) for relative_path in stale]
+            if number_of_workers > 1 and len(stale) > 1:
+                with Pool(number_of_workers, initializer=stop_timings) as pool:
+                    described = _progress(pool.imap_unordered(_described_sample, jobs, chunksize=16), len(jobs), show_progress)
+                    fresh = list(described)
+            else:
+                fresh = list(_progress(map(_described_sample, jobs), len(jobs), show_progress))
+            for sample in fresh:
+                current[sample.path] = sample
+            connection.executemany('INSERT OR REPLACE INTO samples VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                   (_row(sample, started) for sample in fresh))
+        connection.executemany('DELETE FROM samples WHERE path = ?',
+                               ((path,) for path in known.keys() - current.keys()))
+    connection.close()
+    return current
+
+
+def _progress(iterable, length, show):
+    """Wrap an iterable in a progress bar if ``show``."""
+    if not show:
+        return iterable
+    with progressbar(iterable, length=length, label='Indexing samples') as bar:
+        return list(bar)
+
+
+def _row(sample, indexed):
+    return sample[:6] + (dumps(sample.labels), sample.resource_bytes, indexed)
+
+
+def indexed_samples(directory):
+    """If ``directory`` is a sample directory with an index, bring the index
+    up to date, and return what ``update_index()`` does. Otherwise, return
+    None.
+
+    This is what commands call to use the index when there is one.
+
+    """
+    if directory is None or not index_path(directory).is_file():
+        return None
+    return update_index(directory)
+
+
+def original_urls(directory):
+    """Return a dict of the paths of the samples in the index of
+    ``directory``, relative to it, to their original URLs, leaving out those
+    without one.
+
+    Unlike ``indexed_samples()``, this only reads the index as it is, neither
+    rereading samples nor writing to it. Return an empty dict if there is no
+    index.
+
+    """
+    path = index_path(directory)
+    if not path.is_file():
+        return {}
+    connection = sqlite3.connect(f'{path.resolve().as_uri()}?mode=ro', uri=True)
+    try:
+        version, = connection.execute('PRAGMA user_version').fetchone()
+        if version != SCHEMA_VERSION:
+            return {}
+        return dict(connection.execute("SELECT path, original_url FROM samples WHERE original_url != ''"))
+    finally:
+        connection.close()
+
+
+def cached_signatures(directory):
+    """Return a dict of content hashes to the near-duplicate signatures
+    ``fathom dedupe`` cached in the index of ``directory``."""
+    with connect(directory) as connection:
+        signatures = dict(connection.execute('SELECT * FROM signatures'))
+    connection.close()
+    return signatures
+
+
+def cache_signatures(directory, signatures):
+    """Add a dict of content hashes to signatures to the index of
+    ``directory``, and forget those of samples no longer in it."""
+    with connect(directory) as connection:
+        connection.executemany('INSERT OR REPLACE INTO signatures VALUES (?, ?)', signatures.items())
+        connection.execute('DELETE FROM signatures WHERE hash NOT IN (SELECT hash FROM samples)')
+    connection.close()
+
+
+def transfer_samples(from_dir, to_dir, relative_paths, keep=False):
+    """Tell the indices of two sample directories, if they have them, that
+    some samples moved from one to the other, keeping the same relative
+    paths, so the destination needn't reread them.
+
+    :arg keep: Whether the samples were linked or copied rather than moved,
+        so the source still has them
+
+    """
+    from_index = index_path(from_dir)
+    if not from_index.is_file():
+        return
+    with sqlite3.connect(from_index) as connection:
+        rows = [row for row in (connection.execute('SELECT * FROM samples WHERE path = ?', (path,)).fetchone()
+                                for path in relative_paths)
+                if row is not None]
+        if not keep:
+            connection.executemany('DELETE FROM samples WHERE path = ?', ((path,) for path in relative_paths))
+    connection.close()
+    if rows and index_path(to_dir).is_file():
+        with connect(to_dir) as connection:
+            connection.executemany('INSERT OR REPLACE INTO samples VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+        connection.close()
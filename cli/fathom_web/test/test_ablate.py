@@ -0,0 +1,14 @@
+from click import unstyle
+
+from ..commands.ablate import ablation_report
+
+
+def test_ablation_report_shows_most_helpful_rules_first():
+    baseline = {'accuracy': 0.9, 'mcc': 0.5}
+    results = [(['useless'], {'accuracy': 0.9, 'mcc': 0.5}),
+               (['crucial'], {'accuracy': 0.7, 'mcc': 0.1}),
+               (['harmful', 'other'], {'accuracy': 0.95, 'mcc': 0.6})]
+    lines = unstyle(ablation_report(baseline, results)).splitlines()
+    assert [line.split('   ')[0].strip() for line in lines[3:6]] == ['crucial', 'useless', 'harmful, other']
+    assert '-0.2000' in lines[3] and '-0.4000' in lines[3]
+    assert '+0.0500' in lines[5]
@@ -0,0 +1,127 @@
+from io import StringIO
+from json import loads
+
+import numpy
+
+from ..accuracy import accuracy_metrics, accuracy_per_tag, bootstrap_confidence_intervals, filtered_per_tag_metrics, page_color, page_confusion_counts, report_per_tag
+from ..index import index_path, update_index
+from ..utils import classifier, tensor, tensors_from
+
+
+def make_pages():
+    """Return pages whose nodes score as their first feature, for feeding
+    straight through as logits."""
+    def node(score, is_target):
+        return {'features': [score], 'isTarget': is_target}
+    return [{'nodes': [node(3, True), node(-3, False), node(2, False)]},
+            {'nodes': [node(-1, True), node(-2, False),
+                       {'pruned': True, 'isTarget': True, 'features': []}]},
+            {'nodes': []},
+            {'nodes': [node(4, True), node(-4, False), node(-5, False)]}]
+
+
+def test_page_confusion_counts():
+    pages = make_pages()
+    x, y, num_yes, num_prunes = tensors_from(pages)
+    counts = page_confusion_counts(y, x, 0.5, pages)
+    assert counts.tolist() == [[1, 1, 0, 1],
+                               [0, 0, 2, 1],
+                               [0, 0, 0, 0],
+                               [1, 0, 0, 2]]
+    # The totals should agree with the usual per-tag accounting:
+    accuracy, false_positives, false_negatives = accuracy_per_tag(y, x, 0.5, num_prunes)
+    true_positives, fps, fns, true_negatives = counts.sum(axis=0)
+    assert (fps, fns) == (false_positives, false_negatives)
+    assert (true_positives + true_negatives) / counts.sum() == accuracy
+
+
+def test_bootstrap_confidence_intervals():
+    pages = make_pages()
+    x, y, num_yes, num_prunes = tensors_from(pages)
+    counts = page_confusion_counts(y, x, 0.5, pages)
+    cis = bootstrap_confidence_intervals(counts, resamples=2000)
+    accuracy, false_positives, false_negatives = accuracy_per_tag(y, x, 0.5, num_prunes)
+    metrics = accuracy_metrics(accuracy, len(x) + num_prunes, false_positives, false_negatives, num_yes)
+    for key in ['accuracy', 'false_positive_rate', 'false_negative_rate', 'precision', 'mcc']:
+        low, high = cis[key]
+        assert low <= metrics[key] <= high
+
+
+def test_bootstrap_of_identical_pages_has_no_spread():
+    counts = numpy.array([[1, 0, 1, 8]] * 5)
+    cis = bootstrap_confidence_intervals(counts, resamples=100)
+    assert cis['accuracy'] == (0.9, 0.9)
+    assert cis['false_negative_rate'] == (0.5, 0.5)
+    assert cis['precision'] == (1.0, 1.0)
+
+
+def test_filtered_per_tag_metrics():
+    pages = make_pages()
+    for number, page in enumerate(pages):
+        page['filename'] = f'{number}.html'
+        for i, node in enumerate(page['nodes']):
+            node['markup'] = f'<div id="{i}">'
+    model = classifier(1, 1)
+    model.load_state_dict({'0.weight': tensor([[1.0]]), '0.bias': tensor([0.0])})
+
+    def summary(**filters):
+        return [(m['filename'], [t['error_type'] for t in m['tags']])
+                for m in filtered_per_tag_metrics(pages, model, 0.5, **filters)]
+
+    assert summary() == [('0.html', ['', 'FP']),
+                         ('1.html', ['FN', 'FN']),
+                         ('2.html', []),
+                         ('3.html', [''])]
+    assert summary(only_errors=True) == [('0.html', ['FP']),
+                                         ('1.html', ['FN', 'FN'])]
+    assert summary(worst=2) == [('1.html', ['FN', 'FN']),
+                                ('0.html', ['', 'FP'])]
+    # The pruned tag drops out, as do pages with nothing left to show:
+    assert summary(min_score=0.2) == [('0.html', ['', 'FP']),
+                                      ('1.html', ['FN']),
+                                      ('3.html', [''])]
+
+
+def test_filters_dont_change_page_colors():
+    """A page's color should reflect all its tags, even ones filtered out."""
+    def node(score, is_target):
+        return {'features': [score], 'isTarget': is_target, 'markup': '<div>'}
+    pages = [{'filename': 'fp.html', 'nodes': [node(3, True), node(2, False)]},
+             {'filename': 'weak-fn.html', 'nodes': [node(3, True), node(-3, True)]},
+             {'filename': 'all-wrong.html', 'nodes': [node(-3, True), node(2, False)]}]
+    model = classifier(1, 1)
+    model.load_state_dict({'0.weight': tensor([[1.0]]), '0.bias': tensor([0.0])})
+
+    def colors(**filters):
+        return {m['filename']: page_color(m) for m in filtered_per_tag_metrics(pages, model, 0.5, **filters)}
+
+    expected = {'fp.html': 'medium', 'weak-fn.html': 'medium', 'all-wrong.html': 'bad'}
+    assert colors() == expected
+    # Hiding the true positive shouldn't make the page look all wrong:
+    assert colors(only_errors=True) == expected
+    # Hiding the low-scoring false negative shouldn't make the page look all
+    # right:
+    assert colors(min_score=0.2) == expected
+
+
+def test_report_urls_of_nested_samples(tmp_path):
+    """Reports should find the URLs of samples in subfolders, without
+    touching the index."""
+    (tmp_path / 'sub').mkdir()
+    (tmp_path / 'sub' / '1.html').write_text('<html><head><link rel="original" href="https://example.com/1"></head></html>')
+    (tmp_path / '3.html').write_text('<html></html>')
+    update_index(tmp_path)
+    index_bytes = index_path(tmp_path).read_bytes()
+    (tmp_path / '3.html').write_text('<html><head><link rel="original" href="https://example.com/3"></head></html>')
+
+    pages = make_pages()
+    for number, page in enumerate(pages):
+        page['filename'] = f'{number}.html'
+    model = classifier(1, 1)
+    model.load_state_dict({'0.weight': tensor([[1.0]]), '0.bias': tensor([0.0])})
+    report = StringIO()
+    report_per_tag('Testing', pages, model, 0.5, json_file=report, sample_set=tmp_path)
+    urls = {line['filename']: line.get('url') for line in map(loads, report.getvalue().splitlines())}
+    # 3.html's new URL isn't indexed yet:
+    assert urls == {'0.html': None, '1.html': 'https://example.com/1', '2.html': None, '3.html': None}
+    assert index_path(tmp_path).read_bytes() == index_bytes
@@ -0,0 +1,96 @@
+from importlib import import_module
+
+from click.testing import CliRunner
+
+from ..commands.dedupe import dedupe, near_duplicate_clusters, signature, similarity, visible_text
+
+
+# The package exports the command under the module's name, so get at the
+# module itself this way:
+dedupe_module = import_module('..commands.dedupe', __package__)
+
+
+STORY = ' '.join(f'Paragraph {i} of a long story about sample number {i * 7}.' for i in range(60))
+
+
+def test_visible_text():
+    assert visible_text('<p class="a">Hi <b>there</b></p><script>var x = "<b>no</b>";</script><STYLE>p {}</STYLE>').split() == ['Hi', 'there']
+
+
+def test_similarity():
+    """Signatures of nearly identical texts should be nearly identical, and
+    those of unrelated ones not."""
+    original = signature(STORY)
+    assert similarity(original, signature(STORY + ' Page 2 of 3.')) > .9
+    assert similarity(original, signature('Something else entirely, about gardening.')) < .1
+    assert similarity(original, signature(STORY)) == 1
+
+
+def test_clusters():
+    a = signature(STORY)
+    b = signature('Unrelated: ' + ' '.join(reversed(STORY.split())))
+    assert near_duplicate_clusters([a, b, signature(STORY + ' The end.'), a], .9) == [[0, 2, 3]]
+
+
+def test_end_to_end(tmp_path, monkeypatch):
+    """Make sure duplicates are reported, that a labeled sample is the one
+    kept, that --move-to moves the others with their resources, and that
+    signatures are reused from the cache."""
+    samples = tmp_path / 'samples'
+    (samples / 'sub').mkdir(parents=True)
+    (samples / '1.html').write_text(f'<html><body><p>{STORY}</p><p>Page 1</p></body></html>')
+    (samples / 'sub' / '2.html').write_text(f'<html data-fathom="article"><body><div>{STORY}</div><p>Page 2</p></body></html>')
+    (samples / '3.html').write_text('<html><body>Something else entirely, about gardening.</body></html>')
+    (samples / 'resources' / '1').mkdir(parents=True)
+    (samples / 'resources' / '1' / '1.png').write_bytes(b'PNG')
+
+    computed = []
+    signature_of_path = dedupe_module.signature_of_path
+
+    def counting_signature_of_path(path):
+        computed.append(path.name)
+        return signature_of_path(path)
+    monkeypatch.setattr(dedupe_module, 'signature_of_path', counting_signature_of_path)
+
+    runner = CliRunner()
+    result = runner.invoke(dedupe, [samples.as_posix(), '--number-of-workers', '1'])
+    assert result.exit_code == 0
+    assert 'sub/2.html has 1 near-duplicate:\n    1.html (' in result.output.replace('\\', '/')
+    assert sorted(computed) == ['1.html', '2.html', '3.html']
+
+    computed.clear()
+    aside = tmp_path / 'aside'
+    result = runner.invoke(dedupe, [samples.as_posix(), '--number-of-workers', '1', '--move-to', aside.as_posix()])
+    assert result.exit_code == 0
+    assert computed == []
+    assert 'Moved 1 near-duplicates' in result.output
+    assert not (samples / '1.html').exists()
+    assert (aside / '1.html').exists()
+    assert (aside / 'resources' / '1' / '1.png').read_bytes() == b'PNG'
+    assert (samples / 'sub' / '2.html').exists()
+
+    result = runner.invoke(dedupe, [samples.as_posix(), '--number-of-workers', '1'])
+    assert 'Found no near-duplicates.' in result.output
+
+
+def test_move_to_inside(tmp_path):
+    (tmp_path / '1.html').write_text('<html></html>')
+    result = CliRunner().invoke(dedupe, [tmp_path.as_posix(), '--move-to', (tmp_path / 'dupes').as_posix()])
+    assert result.exit_code == 2
+    assert 'would still count' in result.output
+
+
+def test_pages_without_text(tmp_path):
+    """Pages with too little text to compare shouldn't all be lumped
+    together as duplicates."""
+    assert signature('Just three words') is None
+    (tmp_path / '1.html').write_text('<html><body><script>var a = 1;</script></body></html>')
+    (tmp_path / '2.html').write_text('<html><body><img src="a.png"></body></html>')
+    (tmp_path / '3.html').write_text('<html><body><img src="b.png"></body></html>')
+    (tmp_path / '4.html').write_text(f'<html><body>{STORY}</body></html>')
+    result = CliRunner().invoke(dedupe, [tmp_path.as_posix(), '--number-of-workers', '1',
+                                         '--move-to', (tmp_path.parent / 'aside').as_posix()])
+    assert result.exit_code == 0
+    assert 'Skipped 3 samples with fewer than 5 words of text.' in result.output
+    assert 'Found no near-duplicates.' in result.output
+    assert len(list(tmp_path.glob('*.html'))) == 4
@@ -0,0 +1,55 @@
+import numpy
+
+from ..commands.histogram import feature_metrics
+from ..utils import tensor
+
+
+def test_feature_metrics_matches_numpy_histogram():
+    """Make sure the all-at-once binning agrees with ``numpy.histogram()``
+    for each feature, including the right-inclusive last bucket."""
+    x = tensor([[0, 0.1, 5],
+                [1, 0.2, 5],
+                [1, 0.35, 5],
+                [0, 0.9, 5],
+                [1, 1.0, 5]])
+    y = tensor([[1], [0], [1], [0], [1]])
+    metrics = dict(feature_metrics(['bool', 'float', 'constant'], x, y, 3, ['bool', 'float', 'constant']))
+
+    assert metrics['bool'] == [('0', 1, 1), ('1', 2, 1)]
+    for name, column in [('float', 1), ('constant', 2)]:
+        values = x.numpy()[:, column]
+        is_positive = y.numpy()[:, 0] == 1
+        _, boundaries = numpy.histogram(values, bins=3)
+        positives, _ = numpy.histogram(values[is_positive], bins=boundaries)
+        negatives, _ = numpy.histogram(values[~is_positive], bins=boundaries)
+        assert [(p, n) for _, p, n in metrics[name]] == list(zip(positives, negatives))
+
+
+def test_feature_metrics_skips_disabled_rules():
+    x = tensor([[0, 1], [1, 2]])
+    y = tensor([[0], [1]])
+    assert [name for name, _ in feature_metrics(['a', 'b'], x, y, 10, ['b'])] == ['b']
+
+
+def test_feature_metrics_values_on_edges():
+    """Values that fall exactly on bucket edges should land where
+    ``numpy.histogram()`` puts them, which depends on computing the edges in
+    the values' own precision."""
+    x = tensor([[i / 10] for i in range(11)])
+    y = tensor([[1]] * 11)
+    (_, bars), = feature_metrics(['f'], x, y, 10, ['f'])
+    counts, boundaries = numpy.histogram(x.numpy()[:, 0], bins=10)
+    assert [positives for _, positives, _ in bars] == list(counts) == [1, 1, 1, 1, 1, 1, 1, 1, 1, 2]
+    assert [label for label, _, _ in bars] == [f'{boundary:.1f}' for boundary in boundaries[:-1]]
+
+
+def test_feature_metrics_matches_numpy_histogram_on_quantized_values():
+    random = numpy.random.RandomState(0)
+    for _ in range(200):
+        values = (random.randint(0, 20, size=(30, 1)) / random.choice([3, 7, 10])).tolist()
+        x = tensor(values)
+        y = tensor([[1]] * len(values))
+        (_, bars), = feature_metrics(['f'], x, y, 10, ['f'])
+        column = x.numpy()[:, 0]
+        counts, _ = numpy.histogram(column, bins=2 if ((column == 0) | (column == 1)).all() else 10)
+        assert [positives for _, positives, _ in bars] == list(counts)
@@ -0,0 +1,85 @@
+import os
+
+from click.testing import CliRunner
+
+from ..commands.list import list as list_main
+from ..commands.pick import pick
+from ..index import indexed_samples, index_path, update_index
+from ..vectorizer import hash_path, hashed_samples
+
+
+def make_samples(directory):
+    (directory / 'sub').mkdir(parents=True)
+    (directory / 'a.html').write_text('<html><head><link rel="original" href="https://www.example.com/a"></head>'
+                                      '<body><div data-fathom="price">1</div><p data-fathom="title"></p></body></html>')
+    (directory / 'sub' / 'b.html').write_text('<html><body>No URL</body></html>')
+    (directory / 'resources' / 'a').mkdir(parents=True)
+    (directory / 'resources' / 'a' / '1.png').write_bytes(b'x' * 10)
+    (directory / 'resources' / 'a' / 'nope.html').write_text('not a sample')
+
+
+def test_update_index(tmp_path):
+    """The index should describe each sample and notice changes."""
+    make_samples(tmp_path)
+    assert indexed_samples(tmp_path) is None
+
+    samples = update_index(tmp_path)
+    assert index_path(tmp_path).is_file()
+    assert list(samples) == ['a.html', 'sub/b.html']
+    a = samples['a.html']
+    assert a.original_url == 'https://www.example.com/a'
+    assert a.domain == 'www.example.com'
+    assert a.labels == ['price', 'title']
+    assert a.resource_bytes == 10 + len('not a sample')
+    assert a.hash == hash_path(tmp_path / 'a.html')
+    assert samples['sub/b.html'].original_url == ''
+    assert {path: sample.hash for path, sample in samples.items()} == hashed_samples(tmp_path)
+
+    (tmp_path / 'sub' / 'b.html').unlink()
+    (tmp_path / 'a.html').write_text('<html data-fathom="article"></html>')
+    (tmp_path / 'c.html').write_text('<html></html>')
+    samples = indexed_samples(tmp_path)
+    assert sorted(samples) == ['a.html', 'c.html']
+    assert samples['a.html'].labels == ['article']
+    assert samples['a.html'].hash == hash_path(tmp_path / 'a.html')
+
+
+def test_recently_modified_samples_are_reread(tmp_path):
+    """A change that keeps a sample's size and mtime should be noticed if the
+    sample was modified too soon before it was indexed to tell them apart."""
+    sample = tmp_path / 'a.html'
+    sample.write_text('<html data-fathom="price"></html>')
+    stat = sample.stat()
+    assert update_index(tmp_path)['a.html'].labels == ['price']
+    sample.write_text('<html data-fathom="title"></html>')
+    os.utime(sample, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert update_index(tmp_path)['a.html'].labels == ['title']
+
+
+def test_list_and_pick_use_index(tmp_path):
+    """list should get URLs from the index, and pick should hand entries to
+    the destination's index."""
+    source = tmp_path / 'source'
+    make_samples(source)
+    destination = tmp_path / 'destination'
+    destination.mkdir()
+    # Date the sample well before indexing so the index trusts its mtime:
+    a = source / 'a.html'
+    stat = a.stat()
+    os.utime(a, ns=(stat.st_atime_ns, stat.st_mtime_ns - 60 * 10 ** 9))
+    stat = a.stat()
+    update_index(source)
+    update_index(destination)
+
+    # Change the file behind the index's back, keeping its size and mtime,
+    # to prove the index is what's read:
+    a.write_text(a.read_text().replace('example', 'exanple'))
+    os.utime(a, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    result = CliRunner().invoke(list_main, [source.as_posix(), '-u'])
+    assert result.exit_code == 0
+    assert 'a.html https://www.example.com/a' in result.output
+
+    result = CliRunner().invoke(pick, [source.as_posix(), destination.as_posix(), '1'])
+    assert result.exit_code == 0
+    assert list(indexed_samples(source)) == ['sub/b.html']
+    assert indexed_samples(destination)['a.html'].original_url == 'https://www.example.com/a'
@@ -1,4 +1,8 @@
-from ..commands.label import label_html_tags_in_html_string
+import stat
+
+import pytest
+
+from ..commands.label import label_html_tags_in_html_bytes, label_html_tags_in_html_string, label_task
 
 
 IN_TYPE = 'test'
@@ -65,3 +69,60 @@ def test_html_string_has_comments():
     expected_string = f'<!-- this is a comment --><html data-fathom="{IN_TYPE}" lang="en">\n' + \
         '<!-- this is another comment --></html><!-- this is yet another comment -->'
     assert label_html_tags_in_html_string(input_string, IN_TYPE) == expected_string
+
+
+@pytest.mark.parametrize('input_string', [
+    '<html>',
+    '<html lang="en-us">',
+    '<html><div></div><html>',
+    '<html data-bracket=">" class="foo">',
+    '<html\nclass="foo"\nid="bar"\n>',
+    '<html   >',
+    '<!-- this is a comment --><html lang="en">\n<!-- this is another comment --></html>',
+    '<!DOCTYPE html>\n<html><head><title>Hi</title></head></html>',
+    '<head></head><html>',
+    '<htmlx><html>',
+    'no tags at all'])
+def test_bytes_match_string(input_string):
+    """The byte-splicing fast path should label just as the parser does."""
+    assert (label_html_tags_in_html_bytes(input_string.encode('utf-8'), IN_TYPE) ==
+            label_html_tags_in_html_string(input_string, IN_TYPE).encode('utf-8'))
+
+
+def test_bytes_skip_commented_out_html_tag():
+    """An ``<html>`` tag in a comment before the real one shouldn't get the
+    label."""
+    input_bytes = b'\xef\xbb\xbf<!-- <html> -->\r\n<!DOCTYPE html>\r\n<html lang="en">\r\n</html>'
+    expected_bytes = f'\ufeff<!-- <html> -->\r\n<!DOCTYPE html>\r\n<html data-fathom="{IN_TYPE}" lang="en">\r\n</html>'.encode('utf-8')
+    assert label_html_tags_in_html_bytes(input_bytes, IN_TYPE) == expected_bytes
+
+
+def test_bytes_leave_non_utf8_alone():
+    """Pages needn't be UTF-8. Only the tag should change."""
+    input_bytes = '<html><body>caf\xe9</body></html>'.encode('latin-1')
+    expected_bytes = f'<html data-fathom="{IN_TYPE}"><body>caf\xe9</body></html>'.encode('latin-1')
+    assert label_html_tags_in_html_bytes(input_bytes, IN_TYPE) == expected_bytes
+
+
+def test_label_task_preserves_original(tmp_path):
+    """Labeling should replace the page and move the original aside."""
+    originals = tmp_path / 'originals'
+    originals.mkdir()
+    (tmp_path / 'page.html').write_bytes(b'<!DOCTYPE html><html><body></body></html>')
+    (tmp_path / 'page.html').chmod(0o644)
+    assert label_task(tmp_path, IN_TYPE, originals, True, 'page.html') is None
+    assert stat.S_IMODE((tmp_path / 'page.html').stat().st_mode) == 0o644
+    assert (tmp_path / 'page.html').read_bytes() == f'<!DOCTYPE html><html data-fathom="{IN_TYPE}"><body></body></html>'.encode('utf-8')
+    assert (originals / 'page.html').read_bytes() == b'<!DOCTYPE html><html><body></body></html>'
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['originals', 'page.html']
+
+
+def test_label_task_keeps_permissions(tmp_path):
+    """The labeled page should keep the permissions of the original, not
+    those of the temp file it was written to."""
+    page = tmp_path / 'page.html'
+    for permissions in [0o644, 0o640]:
+        page.write_bytes(b'<html><body></body></html>')
+        page.chmod(permissions)
+        label_task(tmp_path, IN_TYPE, None, False, 'page.html')
+        assert stat.S_IMODE(page.stat().st_mode) == permissions
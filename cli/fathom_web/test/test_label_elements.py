@@ -0,0 +1,70 @@
+from click import BadParameter
+import pytest
+
+from ..commands.label_elements import (label_elements_task, label_matching_elements, parsed_selector,
+                                       selector_for_domain)
+
+
+IN_TYPE = 'price'
+PAGE = ('<!DOCTYPE html>\n<html><head><link rel="original" href="https://shop.example.com/item"></head>\n'
+        '<body><div class="product main"><span class="price">$1</span><img src="a.png"><p id="x">\n'
+        '<span class="price old" data-fathom="other">$2</span></p></div><span class="price">$3</span></body></html>')
+
+
+def labeled(selector, html=PAGE):
+    return label_matching_elements(html, parsed_selector(selector, 'selector'), IN_TYPE)
+
+
+def test_class_selector():
+    """Every match gets labeled except the one already labeled."""
+    new_html, matches = labeled('.price')
+    assert matches == 3
+    assert new_html == PAGE.replace('<span class="price">', f'<span data-fathom="{IN_TYPE}" class="price">')
+
+
+def test_combinators():
+    """Descendant and child combinators should look at the right ancestors,
+    even past void elements."""
+    assert labeled('div .price')[1] == 2
+    assert labeled('div > span.price')[1] == 1
+    assert labeled('body > span')[1] == 1
+    assert labeled('div p > span[data-fathom]')[1] == 1
+
+
+def test_attribute_tests():
+    assert labeled('[class~=old]')[1] == 1
+    assert labeled('[class^=pri]')[1] == 3
+    assert labeled("div[class$='main'] #x")[1] == 1
+    assert labeled('link[href*="example.com"]')[1] == 1
+    assert labeled('span.price, p')[1] == 4
+
+
+def test_unsupported_selectors():
+    for selector in ['a:hover', 'img + span', 'div >', '', 'span,']:
+        with pytest.raises(BadParameter):
+            parsed_selector(selector, 'selector')
+
+
+def test_selector_for_domain():
+    by_domain = {'example.com': 'general', 'shop.example.com': 'specific'}
+    assert selector_for_domain('shop.example.com', by_domain, None) == 'specific'
+    assert selector_for_domain('www.example.com', by_domain, None) == 'general'
+    assert selector_for_domain('example.org', by_domain, 'default') == 'default'
+
+
+def test_task_flags_and_preserves(tmp_path):
+    """Pages with too many matches stay as they are, and changed pages have
+    their originals kept."""
+    originals = tmp_path / 'originals'
+    originals.mkdir()
+    page = tmp_path / 'page.html'
+    page.write_text(PAGE, encoding='utf-8')
+    selectors = {'example.com': parsed_selector('.price', 'selector')}
+
+    assert label_elements_task(IN_TYPE, None, selectors, 2, originals, page) == ('page.html', 3, 'too many matches; left unlabeled')
+    assert page.read_text(encoding='utf-8') == PAGE
+    assert label_elements_task(IN_TYPE, None, {}, 2, originals, page) == ('page.html', None, 'no selector for shop.example.com')
+
+    assert label_elements_task(IN_TYPE, None, selectors, 3, originals, page) == ('page.html', 3, None)
+    assert page.read_text(encoding='utf-8').count(f'data-fathom="{IN_TYPE}"') == 2
+    assert (originals / 'page.html').read_text(encoding='utf-8') == PAGE
@@ -1,6 +1,9 @@
+from io import StringIO
+
 from click.testing import CliRunner
 
-from ..commands.list import list as list_main
+from ..commands.list import list as list_main, original_url
+from ..utils import samples_from_dir
 
 
 def test_end_to_end(tmp_path):
@@ -150,3 +153,22 @@ def test_base_dir_does_not_exist(tmp_path):
     assert result.exit_code == 2
     assert ('"fake_base_dir" does not exist.' in result.output or
             "'fake_base_dir' does not exist." in result.output)
+
+
+def test_original_url():
+    """The URL should be found in the head, or anywhere else as a fallback."""
+    link = '<link rel="original" href="https://example.com/">'
+    assert original_url(StringIO(f'<html><head>{link}</head>' + 'x' * 100), head_size=20) == 'https://example.com/'
+    assert original_url(StringIO('<html><head>' + 'x' * 100 + link), head_size=20) == 'https://example.com/'
+    assert original_url(StringIO('<html><head></head></html>'), head_size=20) == ''
+
+
+def test_show_urls_in_order(tmp_path):
+    """URLs should come out next to their files, in the usual order."""
+    _, in_directory = make_directories(tmp_path)
+    for name in 'abcdefgh':
+        (in_directory / f'{name}.html').write_text(f'<link rel="original" href="https://{name}.com/">')
+    result = CliRunner().invoke(list_main, [in_directory.as_posix(), '-u'])
+    assert result.exit_code == 0
+    expected = [f'{file.name} https://{file.stem}.com/' for file in samples_from_dir(in_directory)]
+    assert result.output.splitlines() == expected
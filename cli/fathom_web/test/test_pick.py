@@ -1,6 +1,8 @@
+from random import Random
+
 from click.testing import CliRunner
 
-from ..commands.pick import pick
+from ..commands.pick import pick, stratified_sample, stratum
 
 
 def test_end_to_end(tmp_path):
@@ -91,3 +93,135 @@ def test_resource_directory_path_collision(tmp_path):
     files_in_destination = list(destination.glob('*.html'))
     assert len(files_in_destination) == 0
     assert (destination / 'resources' / '1').exists()
+
+
+def make_samples(directory, names):
+    directory.mkdir()
+    for name in names:
+        (directory / name).write_text(f'<html>{name}</html>')
+
+
+def test_manifest(tmp_path):
+    """Make sure --manifest leaves the samples alone and lists the picked
+    ones relative to the manifest, and that --exclude keeps later picks from
+    overlapping."""
+    source = tmp_path / 'source'
+    make_samples(source, ['1.html', '2.html', '3.html', '4.html'])
+    runner = CliRunner()
+    result = runner.invoke(pick, [source.as_posix(), (tmp_path / 'training.txt').as_posix(), '3', '--manifest'])
+    assert result.exit_code == 0
+    assert len(list(source.glob('*.html'))) == 4
+    training = (tmp_path / 'training.txt').read_text().splitlines()
+    assert len(training) == 3
+    assert all(line.startswith('source/') for line in training)
+
+    result = runner.invoke(pick, [source.as_posix(), (tmp_path / 'validation.txt').as_posix(), '1', '--manifest',
+                                  '-x', (tmp_path / 'training.txt').as_posix()])
+    assert result.exit_code == 0
+    validation = (tmp_path / 'validation.txt').read_text().splitlines()
+    assert set(training) | set(validation) == {f'source/{i}.html' for i in range(1, 5)}
+
+    # There is nothing left to pick:
+    result = runner.invoke(pick, [source.as_posix(), (tmp_path / 'test.txt').as_posix(), '1', '--manifest',
+                                  '-x', (tmp_path / 'training.txt').as_posix(),
+                                  '-x', (tmp_path / 'validation.txt').as_posix()])
+    assert result.exit_code == 2
+    assert 'only 0 to pick from' in result.output
+    assert not (tmp_path / 'test.txt').exists()
+
+
+def test_manifest_outside_samples(tmp_path):
+    """A manifest in a folder unrelated to the samples couldn't point to
+    them."""
+    source = tmp_path / 'source'
+    make_samples(source, ['1.html'])
+    (tmp_path / 'elsewhere').mkdir()
+    result = CliRunner().invoke(pick, [source.as_posix(), (tmp_path / 'elsewhere' / 'set.txt').as_posix(), '1', '--manifest'])
+    assert result.exit_code == 2
+    assert 'FROM_DIR or a folder above it' in result.output
+
+
+def test_link(tmp_path):
+    """Make sure --link leaves the source as it was and puts the same files,
+    resources included, in the destination."""
+    source = tmp_path / 'source'
+    make_samples(source, ['1.html', '2.html'])
+    (source / 'resources' / '1').mkdir(parents=True)
+    (source / 'resources' / '1' / '1.png').write_bytes(b'PNG')
+    (source / 'resources' / '2').mkdir(parents=True)
+    destination = tmp_path / 'destination'
+    destination.mkdir()
+
+    result = CliRunner().invoke(pick, [source.as_posix(), destination.as_posix(), '2', '--link'])
+    assert result.exit_code == 0
+    assert {file.name for file in source.glob('*.html')} == {'1.html', '2.html'}
+    assert {file.name for file in destination.glob('*.html')} == {'1.html', '2.html'}
+    assert (destination / '1.html').read_text() == '<html>1.html</html>'
+    assert (destination / 'resources' / '1' / '1.png').read_bytes() == b'PNG'
+    assert (source / 'resources' / '1' / '1.png').exists()
+    assert (destination / 'resources' / '2').is_dir()
+
+
+def make_freeze_dried(directory, domains_and_labels):
+    """Write samples with the given original domains, labeled or not, and
+    return their names."""
+    directory.mkdir()
+    names = []
+    for i, (domain, labeled) in enumerate(domains_and_labels):
+        label = ' data-fathom="article"' if labeled else ''
+        (directory / f'{i}.html').write_text(
+            f'<html{label}><head><link rel="original" href="https://{domain}/{i}"></head>'
+            f'<body>{"x" * 100000}</body></html>')
+        names.append(f'{i}.html')
+    return names
+
+
+def test_stratum(tmp_path):
+    names = make_freeze_dried(tmp_path / 'source', [('www.example.com', True), ('example.org', False)])
+    assert stratum(tmp_path / 'source' / names[0], chunk_size=64) == ('www.example.com', True)
+    assert stratum(tmp_path / 'source' / names[1], chunk_size=64) == ('example.org', False)
+
+
+def test_stratified_sample():
+    population = list(range(10))
+    strata = ['a'] * 5 + ['b'] * 4 + ['c']
+    picked = stratified_sample(population, strata, 4, Random(0))
+    assert len(set(picked)) == 4
+    assert sum(1 for item in picked if strata[item] == 'a') == 2
+    # b deserves 1.6 and c .4; b's larger remainder wins the last pick.
+    assert sum(1 for item in picked if strata[item] == 'b') == 2
+
+
+def test_stratify(tmp_path):
+    """Make sure --stratify picks from each domain in proportion and --seed
+    makes the pick repeatable."""
+    source = tmp_path / 'source'
+    make_freeze_dried(source, [('a.com', True)] * 6 + [('b.com', True)] * 2 + [('b.com', False)] * 2)
+    runner = CliRunner()
+    for name in ['first.txt', 'second.txt']:
+        result = runner.invoke(pick, [source.as_posix(), (tmp_path / name).as_posix(), '5',
+                                      '--manifest', '--stratify', '--seed', '7'])
+        assert result.exit_code == 0
+    first = (tmp_path / 'first.txt').read_text().splitlines()
+    assert first == (tmp_path / 'second.txt').read_text().splitlines()
+    numbers = [int(line[len('source/'):-len('.html')]) for line in first]
+    assert len([n for n in numbers if n < 6]) == 3
+    assert len([n for n in numbers if n in (6, 7)]) == 1
+    assert len([n for n in numbers if n in (8, 9)]) == 1
+
+
+def test_sample_name_collision(tmp_path):
+    """Make sure neither moving nor linking overwrites a sample already in
+    the destination."""
+    source = tmp_path / 'source'
+    make_samples(source, ['1.html'])
+    destination = tmp_path / 'destination'
+    destination.mkdir()
+    (destination / '1.html').write_text('precious')
+    runner = CliRunner()
+    for how in ['--move', '--link']:
+        result = runner.invoke(pick, [source.as_posix(), destination.as_posix(), '1', how])
+        assert result.exit_code == 2
+        assert 'Error: Tried to make file' in result.output
+        assert (destination / '1.html').read_text() == 'precious'
+        assert (source / '1.html').exists()
@@ -0,0 +1,144 @@
+import os
+import struct
+import zlib
+
+from click.testing import CliRunner
+
+from ..commands.slim import css_without_unused_fonts, image_size, placeholder_for, placeholder_png, png_chunk, slim
+
+
+def noisy_png(width, height):
+    """Return a PNG of random pixels, which won't compress."""
+    raw = b''.join(b'\x00' + os.urandom(width * 3) for _ in range(height))
+    return b''.join([b'\x89PNG\r\n\x1a\n',
+                     png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)),
+                     png_chunk(b'IDAT', zlib.compress(raw)),
+                     png_chunk(b'IEND', b'')])
+
+
+def jpeg(width, height):
+    """Return the start of a baseline JPEG, after an APP0 segment."""
+    return (b'\xff\xd8'
+            + b'\xff\xe0' + struct.pack('>H', 16) + b'JFIF\x00' + bytes(9)
+            + b'\xff\xc0' + struct.pack('>HBHH', 17, 8, height, width) + bytes(10)
+            + os.urandom(20000))
+
+
+def test_image_size():
+    assert image_size(noisy_png(30, 20)) == (30, 20)
+    assert image_size(jpeg(640, 480)) == (640, 480)
+    assert image_size(b'GIF89a' + struct.pack('<HH', 7, 9) + bytes(10)) == (7, 9)
+    assert image_size(b'RIFF\x00\x00\x00\x00WEBPVP8X' + bytes(8) + (99).to_bytes(3, 'little') + (49).to_bytes(3, 'little')) == (100, 50)
+    assert image_size(b'<svg/>') is None
+    assert image_size(b'\x89PNG\r\n\x1a\n\x00\x00\x00\x0dIHDR\x00') is None
+
+
+def test_placeholder_png():
+    placeholder = placeholder_png(3000, 2000)
+    assert image_size(placeholder) == (3000, 2000)
+    assert len(placeholder) < 2000
+    # The pixel data is complete:
+    idat_length, = struct.unpack('>I', placeholder[48:52])
+    assert len(zlib.decompress(placeholder[56:56 + idat_length])) == 2000 * (1 + 375)
+
+
+def test_unused_fonts():
+    css = """@font-face {
+  font-family: "A";
+  src: url("a.eot");
+  src: url("a.eot?#iefix") format("embedded-opentype"), local("A"), url(a.woff2) format("woff2"), url(a.woff) format("woff");
+  font-weight: bold;
+}
+@font-face { font-family: B; src: url(data:font/ttf;base64,AAA=) format('truetype') }
+p { src: url(ignored.woff) }"""
+    new_css, dropped = css_without_unused_fonts(css)
+    assert new_css == """@font-face {
+  font-family: "A";
+  src: local("A"), url(a.woff2) format("woff2");
+  font-weight: bold;
+}
+@font-face { font-family: B; src: url(data:font/ttf;base64,AAA=) format('truetype') }
+p { src: url(ignored.woff) }"""
+    assert sorted(dropped) == ['a.eot', 'a.eot?#iefix', 'a.woff']
+
+
+def test_end_to_end(tmp_path):
+    resources = tmp_path / 'resources' / 'page'
+    resources.mkdir(parents=True)
+    (resources / '1.png').write_bytes(noisy_png(200, 100))
+    (resources / '2.jpg').write_bytes(jpeg(640, 480))
+    (resources / '3.png').write_bytes(placeholder_png(10, 10))  # too small to shrink
+    for name in ['4.eot', '5.woff2', '6.woff']:
+        (resources / name).write_bytes(os.urandom(1000))
+    html = ('<html><head><style>@font-face { font-family: F; src: url(resources/page/4.eot) format("embedded-opentype"),'
+            ' url(resources/page/5.woff2) format("woff2"), url(resources/page/6.woff) format("woff"); }</style></head>'
+            '<body><img src="resources/page/1.png"><img src="resources/page/2.jpg"><img src="resources/page/3.png"></body></html>')
+    (tmp_path / 'page.html').write_text(html)
+
+    result = CliRunner().invoke(slim, [tmp_path.as_posix(), '--number-of-workers', '1'])
+    assert result.exit_code == 0
+    assert 'Replaced 2 images and removed 2 unused font files.' in result.output
+    assert image_size((resources / '1.png').read_bytes()) == (200, 100)
+    assert image_size((resources / '2.jpg').read_bytes()) == (640, 480)
+    assert (resources / '3.png').read_bytes() == placeholder_png(10, 10)
+    assert not (resources / '4.eot').exists()
+    assert (resources / '5.woff2').exists()
+    assert not (resources / '6.woff').exists()
+    assert 'src: url(resources/page/5.woff2) format("woff2"); }' in (tmp_path / 'page.html').read_text()
+
+    # The originals are kept:
+    originals = tmp_path / 'originals'
+    assert (originals / 'page.html').read_text() == html
+    assert image_size((originals / 'resources' / 'page' / '1.png').read_bytes()) == (200, 100)
+    assert len((originals / 'resources' / 'page' / '2.jpg').read_bytes()) > 20000
+    assert sorted(path.name for path in (originals / 'resources' / 'page').iterdir()) == ['1.png', '2.jpg', '4.eot', '6.woff']
+
+
+def test_implausible_sizes():
+    """Images whose headers claim negative or enormous sizes are left
+    alone."""
+    bmp = b'BM' + bytes(16) + struct.pack('<ii', -5, 10) + os.urandom(5000)
+    assert image_size(bmp) == (-5, 10)
+    assert placeholder_for(bmp) is None
+    huge_webp = (b'RIFF\x00\x00\x00\x00WEBPVP8X' + bytes(8)
+                 + (0xffffff).to_bytes(3, 'little') * 2 + os.urandom(5000))
+    assert placeholder_for(huge_webp) is None
+    assert placeholder_for(noisy_png(30, 20)) is not None
+
+
+def exif_segment(orientation, byte_order):
+    """Return an APP1 segment holding just an EXIF orientation."""
+    order = '<' if byte_order == b'II' else '>'
+    tiff = (byte_order + struct.pack(order + 'HI', 42, 8)
+            + struct.pack(order + 'H', 1)
+            + struct.pack(order + 'HHIHH', 0x0112, 3, 1, orientation, 0)
+            + struct.pack(order + 'I', 0))
+    body = b'Exif\x00\x00' + tiff
+    return b'\xff\xe1' + struct.pack('>H', len(body) + 2) + body
+
+
+def test_jpeg_orientation():
+    """JPEGs that EXIF says to turn sideways are measured as displayed."""
+    for orientation, byte_order, size in [(1, b'II', (640, 480)), (3, b'MM', (640, 480)),
+                                          (6, b'II', (480, 640)), (8, b'MM', (480, 640))]:
+        image = jpeg(640, 480)
+        image = image[:2] + exif_segment(orientation, byte_order) + image[2:]
+        assert image_size(image) == size
+
+
+def test_fonts_still_used_by_other_css(tmp_path):
+    """A font dropped from one stylesheet but still named by another must
+    stay."""
+    resources = tmp_path / 'resources' / 'page'
+    resources.mkdir(parents=True)
+    for name in ['font.eot', 'font.woff2']:
+        (resources / name).write_bytes(os.urandom(100))
+    (resources / '1.css').write_text('@font-face { font-family: F; src: url(font.eot) format("embedded-opentype"), url(font.woff2) format("woff2"); }')
+    (resources / '2.css').write_text('@font-face { font-family: G; src: url(font.eot); }')
+    (tmp_path / 'page.html').write_text('<html><head><link rel="stylesheet" href="resources/page/1.css"></head></html>')
+
+    result = CliRunner().invoke(slim, [tmp_path.as_posix(), '--number-of-workers', '1', '--no-preserve-originals'])
+    assert result.exit_code == 0
+    assert 'removed 0 unused font files' in result.output
+    assert (resources / 'font.eot').exists()
+    assert 'font.eot' not in (resources / '1.css').read_text()
@@ -1,7 +1,11 @@
+from io import StringIO
+
 from click import BadParameter
 from pytest import raises
+import torch
 
-from ..commands.test import decode_weights
+from ..commands.test import decode_weights, decode_weights_file, model_from_json, stacked_weights
+from ..utils import tensor
 
 
 def test_expected_input_format():
@@ -59,3 +63,28 @@ def test_coeff_value_not_float():
         '{"coeffs": [["rule1", "rule1"], ["rule2", 0.2]], "bias": 0.5}',
         r'Coeffs must be a list of 2-element lists.*'
     )
+
+
+def test_weights_file():
+    file = StringIO('{"coeffs": [["rule1", 0.1]], "bias": 0.5}\n'
+                    '\n'
+                    '{"coeffs": [["rule1", 0.3]], "bias": -0.5}\n')
+    assert [w['bias'] for w in decode_weights_file(None, None, file)] == [0.5, -0.5]
+    assert decode_weights_file(None, None, None) == []
+
+
+def test_stacked_weights_match_individual_models():
+    """Scoring all candidates in one matrix multiplication should agree with
+    running each as its own model, regardless of coefficient order."""
+    feature_names = ['a', 'b']
+    weightses = [{'coeffs': [['a', 1.0], ['b', -2.0]], 'bias': 0.5},
+                 {'coeffs': [['b', 3.0], ['a', 0.25]], 'bias': -1.0}]
+    x = tensor([[1, 2], [3, 4], [0, 1]])
+    coeffs, biases = stacked_weights(weightses, feature_names)
+    scores = x @ coeffs + biases
+    for i, weights in enumerate(weightses):
+        with torch.no_grad():
+            assert torch.allclose(scores[:, [i]], model_from_json(weights, 1, feature_names)(x))
+
+    with raises(BadParameter, match='#1 have no coefficients for these rules: b'):
+        stacked_weights([{'coeffs': [['a', 1.0]], 'bias': 0.5}], feature_names)
@@ -3,15 +3,37 @@ import operator
 
 from click.testing import CliRunner
 
-from ..commands.train import exclude_indices, train, find_optimal_cutoff, single_cutoff, possible_cutoffs, accuracy_per_tag
-from ..utils import tensor
-
-
-def test_exclude_indices():
-    assert exclude_indices([0, 2, 3], ['a', 'b', 'c', 'd', 'e', 'f']) == ['b', 'e', 'f']  # omit first, last, and some consecutive
-    assert exclude_indices([1], ['a', 'b', 'c', 'd']) == ['a', 'c', 'd']  # leave ends alone
-    assert exclude_indices([], ['a', 'b', 'c']) == ['a', 'b', 'c']  # do nothing
-    assert exclude_indices([0], ['a']) == []  # omit everything
+from ..commands.train import aligned_weights, split_into_folds, train, find_optimal_cutoff, single_cutoff, possible_cutoffs, accuracy_per_tag
+from ..utils import deduplicated, tensor, tensors_from
+
+
+def test_aligned_weights():
+    """New features should start at 0, and removed ones should be dropped."""
+    weights = {'coeffs': [['gone', 3.0], ['b', 2.0], ['a', 1.0]], 'bias': -1.5}
+    assert aligned_weights(weights, ['a', 'b', 'new']) == {
+        'coeffs': [['a', 1.0], ['b', 2.0], ['new', 0.0]],
+        'bias': -1.5}
+
+
+def test_split_into_folds():
+    """Folds should partition the pages, carrying each page's rows and
+    counts along intact."""
+    pages = [{'nodes': [{'features': [page, 0], 'isTarget': True}] +
+                       [{'features': [page, 1], 'isTarget': False}] * page +
+                       [{'pruned': True, 'isTarget': True, 'features': []}] * (page % 2)}
+             for page in range(7)]
+    x, y, num_targets, num_prunes = tensors_from(pages)
+    folds = split_into_folds(pages, 3)
+
+    assert sorted(len(set(x[rows, 0].tolist())) for rows, _, _ in folds) == [2, 2, 3]
+    all_rows = sorted(row for rows, _, _ in folds for row in rows.tolist())
+    assert all_rows == list(range(len(x)))
+    for rows, targets, prunes in folds:
+        fold_pages = set(x[rows, 0].tolist())
+        assert len(rows) == sum(page + 1 for page in fold_pages)
+        assert prunes == sum(page % 2 for page in fold_pages)
+        assert targets == len(fold_pages) + prunes
+    assert sum(targets for _, targets, _ in folds) == num_targets
 
 
 def test_auto_vectorization_smoke(tmp_path):
@@ -113,6 +135,23 @@ def test_find_optimal_cutoff_multiple_cutoffs_with_highest_accuracy():
     assert optimal_cutoff == 0.56
 
 
+def test_deduplicated_rows_give_identical_cutoffs_and_accuracy():
+    """Counting each unique row as many times as it occurs should give the
+    same cutoffs and accuracy as keeping every copy."""
+    y_pred = tensor([[-2.1605], [-0.5696], [0.4886], [0.8633], [-1.3479],
+                     [-0.5813], [-0.5696], [0.5696], [-0.5950], [-0.5696], [0.4886]])
+    y = tensor([[0.], [0.], [1.], [1.], [0.], [0.], [0.], [1.], [0.], [0.], [0.]])
+    unique_pred, unique_y, counts = deduplicated(y_pred, y)
+    assert len(unique_pred) == 9
+    assert counts.sum() == len(y_pred)
+
+    assert possible_cutoffs(unique_pred, counts) == possible_cutoffs(y_pred)
+    assert find_optimal_cutoff(unique_y, unique_pred, 2, counts) == find_optimal_cutoff(y, y_pred, 2)
+    for cutoff in [0.2, 0.4, 0.5, 0.65]:
+        assert (accuracy_per_tag(unique_y, unique_pred, cutoff, 2, counts) ==
+                accuracy_per_tag(y, y_pred, cutoff, 2))
+
+
 def test_single_cutoff():
     # single
     cutoffs = [0]
@@ -1,4 +1,15 @@
-from ..utils import fit_unicode
+from contextlib import contextmanager
+from json import load
+import re
+import tracemalloc
+
+from click import BadOptionUsage
+from pytest import raises
+import torch
+
+from ..utils import classifier, feature_columns, fit_unicode, fold_standardization, init_worker, page_markup, phase, phase_timings, standardization, start_timings, subsampled_negatives, tensor, tensors_from, timing_records, unfold_standardization
+from .. import vectorizer
+from ..vectorizer import point_to_markup, write_vectors
 
 
 def test_fit_unicode():
@@ -11,3 +22,193 @@ def test_fit_unicode():
     assert fit_unicode('a母母母s', 5) == 'a母母'
     assert fit_unicode('a母母', 4) == 'a母 '
     assert fit_unicode('a母', 6) == 'a母   '
+
+
+def test_feature_columns():
+    names = ['a', 'b', 'c', 'd', 'e', 'f']
+    assert feature_columns(names, ['a', 'c', 'd']) == ([1, 4, 5], ['b', 'e', 'f'])  # omit first and some consecutive
+    assert feature_columns(names, ['f']) == ([0, 1, 2, 3, 4], ['a', 'b', 'c', 'd', 'e'])  # omit last
+    assert feature_columns(names, []) == ([0, 1, 2, 3, 4, 5], names)  # do nothing
+    assert feature_columns(['a'], ['a']) == ([], [])  # omit everything
+    with raises(BadOptionUsage, match='unknown feature: z'):
+        feature_columns(names, ['z'])
+
+
+def test_tensors_from_selects_columns():
+    """Excluding features should drop columns without touching the pages."""
+    pages = [{'nodes': [{'features': [1, 2, 3], 'isTarget': True},
+                        {'features': [4, 5, 6], 'isTarget': False},
+                        {'pruned': True, 'isTarget': True}]}]
+    x, y, num_targets, num_prunes = tensors_from(pages, columns=[0, 2])
+    assert x.tolist() == [[1, 3], [4, 6]]
+    assert y.tolist() == [[1], [0]]
+    assert (num_targets, num_prunes) == (2, 1)
+    assert pages[0]['nodes'][0]['features'] == [1, 2, 3]
+
+
+def test_tensors_from_rejects_ragged_features():
+    """A node with the wrong number of features should be an error, not
+    misalign the rows after it."""
+    pages = [{'filename': 'a.html', 'nodes': [{'features': [1, 2], 'isTarget': True}]},
+             {'filename': 'b.html', 'nodes': [{'features': [3, 4, 5], 'isTarget': False},
+                                              {'features': [6], 'isTarget': False}]}]
+    with raises(ValueError, match='b.html'):
+        tensors_from(pages)
+
+
+def test_tensors_from_shuffles_whole_pages():
+    """Shuffling should reorder pages but keep each page's rows together and
+    in order."""
+    pages = [{'nodes': [{'features': [page, row], 'isTarget': row == 0} for row in range(page + 1)] +
+                       [{'pruned': True, 'isTarget': True, 'features': []}] * (page % 2)}
+             for page in range(20)]
+    x, y, num_targets, num_prunes = tensors_from(pages, shuffle=True)
+    assert (num_targets, num_prunes) == (30, 10)
+    rows = x.tolist()
+    assert sorted(rows) == [[page, row] for page in range(20) for row in range(page + 1)]
+    for (page, row), target in zip(rows, y.flatten().tolist()):
+        assert target == (row == 0)
+    # Each page's rows are contiguous, starting at row 0:
+    starts = [i for i, (page, row) in enumerate(rows) if row == 0]
+    assert all(rows[i + row][0] == rows[i][0] for i in starts for row in range(int(rows[i][0]) + 1))
+
+
+def test_fold_standardization():
+    """A model trained on standardized inputs should, once folded, give the
+    same outputs on the raw inputs."""
+    x = tensor([[0, 100, 3], [1, 250, 3], [1, 75, 3], [0, 900, 3]])
+    mean, std = standardization(x)
+    assert std[2] == 1  # Constant features shouldn't divide by zero.
+    for layers in [[], [4]]:
+        model = classifier(3, 1, layers)
+        scaled_outputs = model((x - mean) / std)
+        fold_standardization(model, mean, std)
+        assert torch.allclose(model(x), scaled_outputs, atol=1e-4)
+
+
+def test_unfold_standardization():
+    x = tensor([[0, 100], [1, 250], [1, 75]])
+    mean, std = standardization(x)
+    model = classifier(2, 1)
+    raw_outputs = model(x)
+    unfold_standardization(model, mean, std)
+    assert torch.allclose(model((x - mean) / std), raw_outputs, atol=1e-4)
+
+
+def test_markup_round_trips_through_side_file(tmp_path):
+    """Make sure markup moved out of line when writing a vector cache comes
+    back node for node, and that pages without markup don't get a line."""
+    vectors = {'header': {'version': 2},
+               'pages': [{'filename': 'a.html',
+                          'nodes': [{'markup': '<div>母</div>', 'features': [1]},
+                                    {'markup': '<p>', 'features': [0]},
+                                    {'pruned': True, 'features': []}]},
+                         {'filename': 'b.html',
+                          'nodes': [{'features': [1]}]}]}
+    vector_path = tmp_path / 'vectors' / 'training_x.json'
+    write_vectors(vectors, vector_path)
+    with vector_path.open(encoding='utf-8') as file:
+        vectors = load(file)
+    markup_name = vectors['header']['markupFile']
+    assert re.fullmatch(r'training_x\.[0-9a-f]{16}\.markup', markup_name)
+    assert sorted(p.name for p in vector_path.parent.iterdir()) == sorted(['training_x.json', markup_name])
+    assert all('markup' not in node for page in vectors['pages'] for node in page['nodes'])
+    assert 'markupOffset' not in vectors['pages'][1]
+
+    point_to_markup(vectors, vector_path)
+    assert page_markup(vectors['pages'][0]) == ['<div>母</div>', '<p>', None]
+    assert page_markup(vectors['pages'][1]) == [None]
+
+
+def test_rewriting_vectors_keeps_old_pair_until_done(tmp_path, monkeypatch):
+    """Writing new vectors must not touch the side file the old vector file
+    points to until the new vector file is in place, and then should keep it
+    for one more write, for readers that loaded the old vector file."""
+    vector_path = tmp_path / 'training_x.json'
+    write_vectors({'header': {}, 'pages': [{'filename': 'a.html', 'nodes': [{'markup': '<a>'}]}]}, vector_path)
+    old_markup = load(vector_path.open(encoding='utf-8'))['header']['markupFile']
+    old_offsets = (tmp_path / old_markup).read_bytes()
+
+    # Interrupt the write just before the vector file is replaced:
+    @contextmanager
+    def interrupted_replacing(path, mode, **kwargs):
+        raise KeyboardInterrupt
+        yield
+
+    with monkeypatch.context() as patch:
+        patch.setattr(vectorizer, 'replacing', interrupted_replacing)
+        with raises(KeyboardInterrupt):
+            write_vectors({'header': {}, 'pages': [{'filename': 'a.html', 'nodes': [{'markup': '<b>'}]}]}, vector_path)
+    assert load(vector_path.open(encoding='utf-8'))['header']['markupFile'] == old_markup
+    assert (tmp_path / old_markup).read_bytes() == old_offsets
+
+    write_vectors({'header': {}, 'pages': [{'filename': 'a.html', 'nodes': [{'markup': '<b>'}]}]}, vector_path)
+    new_markup = load(vector_path.open(encoding='utf-8'))['header']['markupFile']
+    assert new_markup != old_markup
+    assert sorted(p.name for p in tmp_path.iterdir()) == sorted(['training_x.json', old_markup, new_markup])
+    assert (tmp_path / old_markup).read_bytes() == old_offsets
+
+    write_vectors({'header': {}, 'pages': [{'filename': 'a.html', 'nodes': [{'markup': '<c>'}]}]}, vector_path)
+    newest_markup = load(vector_path.open(encoding='utf-8'))['header']['markupFile']
+    assert sorted(p.name for p in tmp_path.iterdir()) == sorted(['training_x.json', new_markup, newest_markup])
+
+
+def test_subsampled_negatives():
+    """All positives should be kept, and the kept negatives should stand for
+    all the negatives."""
+    x = tensor([[i] for i in range(103)])
+    y = tensor([[1] if i % 50 == 0 else [0] for i in range(103)])
+    sub_x, sub_y, counts = subsampled_negatives(x, y, 2)
+    assert sub_y.flatten().tolist() == [1, 1, 1] + [0] * 6
+    assert sub_x[:3].flatten().tolist() == [0, 50, 100]
+    assert len(set(sub_x[3:].flatten().tolist())) == 6
+    assert counts.sum().item() == 103
+
+    # Asking for more negatives than there are keeps them all, unweighted:
+    sub_x, sub_y, counts = subsampled_negatives(x, y, 1000)
+    assert sorted(sub_x.flatten().tolist()) == list(range(103))
+    assert counts.tolist() == [1] * 103
+
+
+def test_phase_timings():
+    """Nested phases should be totaled separately, and phases should cost
+    nothing when timing is off."""
+    @phase('inner')
+    def inner():
+        return [0] * 100000
+
+    inner()
+    assert not phase_timings
+    start_timings('outer')
+    try:
+        for _ in range(3):
+            inner()
+        with phase('other'):
+            pass
+        records = timing_records()
+    finally:
+        tracemalloc.stop()
+        phase_timings.clear()
+    assert [(r['phase'], r['calls']) for r in records] == [(['outer'], 1),
+                                                           (['outer', 'inner'], 3),
+                                                           (['outer', 'other'], 1)]
+    outer, inner, _ = records
+    assert outer['wall_seconds'] >= inner['wall_seconds'] > 0
+    assert outer['peak_bytes'] >= inner['peak_bytes'] >= 800000
+
+
+def test_workers_stop_timing():
+    """Pool workers forked mid-run shouldn't keep tracing memory or totaling
+    phases nobody will read."""
+    num_threads = torch.get_num_threads()
+    start_timings('outer')
+    try:
+        init_worker({})
+        assert not tracemalloc.is_tracing()
+        with phase('inner'):
+            pass
+        assert not phase_timings
+    finally:
+        tracemalloc.stop()
+        phase_timings.clear()
+        torch.set_num_threads(num_threads)
@@ -0,0 +1,84 @@
+from pathlib import Path
+
+from .. import vectorizer
+from ..utils import manifest_samples, page_markup
+from ..vectorizer import make_or_find_vectors
+
+
+def fake_vectorize(vectorized):
+    """Return a stand-in for ``vectorize()`` that records which samples it was
+    asked for and, like FathomFox, names the pages by their last path
+    segment."""
+    def vectorize(ruleset_path, trainee_id, samples_directory, show_browser, kind_of_set, delay, tabs, sample_filenames=None):
+        vectorized.extend(sample_filenames)
+        return {'header': {'version': 2, 'featureNames': ['a']},
+                'pages': [{'filename': Path(filename).name,
+                           'nodes': [{'isTarget': True, 'features': [1], 'markup': f'<p>{filename}</p>'}]}
+                          for filename in sample_filenames]}
+    return vectorize
+
+
+def test_manifest_samples(tmp_path):
+    manifest = tmp_path / 'set.txt'
+    manifest.write_text('# Picked by hand\na/1.html\n\nb/2.html\n')
+    assert manifest_samples(manifest) == [str(Path('a', '1.html')), str(Path('b', '2.html'))]
+
+
+def test_manifests_share_vectors(tmp_path, monkeypatch):
+    """Pages vectorized for one manifest should be reused for another, and
+    only changed or new pages revectorized."""
+    vectorized = []
+    monkeypatch.setattr(vectorizer, 'vectorize', fake_vectorize(vectorized))
+    ruleset = tmp_path / 'rulesets.js'
+    ruleset.write_text('// rules')
+    for folder in 'ab':
+        (tmp_path / folder).mkdir()
+        for number in '123':
+            (tmp_path / folder / f'{folder}{number}.html').write_text(f'<html>{folder}{number}</html>')
+    training = tmp_path / 'training.txt'
+    training.write_text('a/a1.html\nb/b1.html\n')
+    validation = tmp_path / 'validation.txt'
+    validation.write_text('b/b1.html\na/a2.html\n')
+
+    def vectors(manifest):
+        return make_or_find_vectors(ruleset, 'trainee', manifest, None, False, 'training', 0, 1)
+
+    json = vectors(training)
+    assert [page['filename'] for page in json['pages']] == [str(Path('a', 'a1.html')), str(Path('b', 'b1.html'))]
+    assert sorted(vectorized) == [str(Path('a', 'a1.html')), str(Path('b', 'b1.html'))]
+
+    vectorized.clear()
+    json = vectors(validation)
+    assert vectorized == [str(Path('a', 'a2.html'))]
+    assert [page['filename'] for page in json['pages']] == [str(Path('b', 'b1.html')), str(Path('a', 'a2.html'))]
+
+    # Markup of reused pages survives being rewritten to the new cache:
+    vectorized.clear()
+    (tmp_path / 'a' / 'a1.html').write_text('<html>changed</html>')
+    json = vectors(training)
+    assert vectorized == [str(Path('a', 'a1.html'))]
+    assert page_markup(json['pages'][1]) == [f'<p>{Path("b", "b1.html")}</p>']
+
+    vectorized.clear()
+    vectors(validation)
+    assert vectorized == []
+
+
+def test_manifests_in_different_folders(tmp_path, monkeypatch):
+    """Manifests in different folders shouldn't evict each other's pages
+    from a shared cache."""
+    vectorized = []
+    monkeypatch.setattr(vectorizer, 'vectorize', fake_vectorize(vectorized))
+    ruleset = tmp_path / 'rulesets.js'
+    ruleset.write_text('// rules')
+    manifests = []
+    for folder in ['one', 'two']:
+        (tmp_path / folder).mkdir()
+        (tmp_path / folder / f'{folder}.html').write_text(f'<html>{folder}</html>')
+        manifest = tmp_path / folder / 'set.txt'
+        manifest.write_text(f'{folder}.html\n')
+        manifests.append(manifest)
+
+    for manifest in manifests * 2:
+        make_or_find_vectors(ruleset, 'trainee', manifest, None, False, 'training', 0, 1)
+    assert vectorized == ['one.html', 'two.html']
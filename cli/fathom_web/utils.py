@@ -1,45 +1,237 @@
 """Additional factored-up routines for which no clear pattern of organization
 has yet emerged"""
 
+from contextlib import contextmanager
 import io
+from itertools import chain
+from json import loads
 from os import walk
-from pathlib import Path
-from random import sample
+from pathlib import Path, PurePosixPath
+from time import perf_counter, process_time
+import tracemalloc
 from unicodedata import east_asian_width
 
+from click import BadOptionUsage
 from more_itertools import ilen, pairwise
+import numpy
 from numpy import array, histogram
 from sklearn.preprocessing import minmax_scale
 import torch
 from torch.nn import Sequential, Linear, ReLU
 
 
+# Whatever a pool's worker processes need to share across all their tasks,
+# like big tensors. Set once per process by init_worker().
+worker_state = {}
+
+
+def init_worker(state):
+    """Stash a dict of ``state`` in a pool worker so it gets sent over once
+    per process rather than once per task.
+
+    Pass this as the ``initializer`` of a ``multiprocessing.Pool`` whose
+    workers each train a model. Their tasks find the state in
+    ``worker_state``.
+
+    """
+    # Each worker trains its own model, so letting each also spread its matrix
+    # math across every core just makes them fight:
+    torch.set_num_threads(1)
+    stop_timings()
+    worker_state.update(state)
+
+
+# Totals for each phase of work timed by phase(), once start_timings() has
+# been called. Keys are tuples of the names of the phase and those it's nested
+# in. Values are [calls, wall seconds, CPU seconds, peak traced bytes].
+phase_timings = {}
+_open_phases = []  # [path, wall start, CPU start, peak bytes so far]
+
+
+def stop_timings():
+    """Forget any phases timed so far, and stop tracing memory.
+
+    Pass this as the ``initializer`` of any ``multiprocessing.Pool``. A
+    forked worker inherits the parent's timing, but nobody would ever read
+    its phase totals, and tracing memory would only slow it down.
+
+    """
+    _open_phases.clear()
+    phase_timings.clear()
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def start_timings(name):
+    """Start timing phases of work and tracing memory, with the whole run
+    counting as the outermost phase, ``name``."""
+    tracemalloc.start()
+    _begin_phase(name)
+
+
+def _begin_phase(name):
+    path = (_open_phases[-1][0] if _open_phases else ()) + (name,)
+    phase_timings.setdefault(path, [0, 0.0, 0.0, 0])
+    if _open_phases:
+        # Credit the enclosing phase with its peak so far, since we're about
+        # to reset it:
+        _open_phases[-1][3] = max(_open_phases[-1][3], tracemalloc.get_traced_memory()[1])
+    if hasattr(tracemalloc, 'reset_peak'):  # Python 3.9+. Otherwise, peaks are process-wide.
+        tracemalloc.reset_peak()
+    _open_phases.append([path, perf_counter(), process_time(), 0])
+
+
+def _end_phase():
+    path, wall_start, cpu_start, peak = _open_phases.pop()
+    peak = max(peak, tracemalloc.get_traced_memory()[1])
+    totals = phase_timings[path]
+    totals[0] += 1
+    totals[1] += perf_counter() - wall_start
+    totals[2] += process_time() - cpu_start
+    totals[3] = max(totals[3], peak)
+    if _open_phases:
+        _open_phases[-1][3] = max(_open_phases[-1][3], peak)
+    if hasattr(tracemalloc, 'reset_peak'):
+        tracemalloc.reset_peak()
+
+
+@contextmanager
+def phase(name):
+    """Add the wall time, CPU time, and peak memory of a block of code to the
+    totals for the phase of work called ``name``, if timing is on.
+
+    Phases can nest. This can also be used as a function decorator.
+
+    """
+    if not _open_phases:  # Timing is off.
+        yield
+        return
+    _begin_phase(name)
+    try:
+        yield
+    finally:
+        _end_phase()
+
+
+def timings_report():
+    """Close any open phases, and return a printable table of the totals of
+    each, nested phases indented under their parents."""
+    while _open_phases:
+        _end_phase()
+    lines = [f'{"Phase": <36}{"Calls": >7}{"Wall s": >11}{"CPU s": >11}{"Peak MB": >11}']
+    for path, (calls, wall, cpu, peak) in phase_timings.items():
+        name = '  ' * (len(path) - 1) + path[-1]
+        lines.append(f'{name: <36}{calls: >7}{wall: >11.3f}{cpu: >11.3f}{peak / 1e6: >11.1f}')
+    return '\n'.join(lines)
+
+
+def timing_records():
+    """Close any open phases, and return the totals of each as a list of
+    JSON-ready dicts, for tracking over time."""
+    while _open_phases:
+        _end_phase()
+    return [{'phase': list(path),
+             'calls': calls,
+             'wall_seconds': wall,
+             'cpu_seconds': cpu,
+             'peak_bytes': peak}
+            for path, (calls, wall, cpu, peak) in phase_timings.items()]
+
+
 def tensor(some_list):
     """Cast a list to a tensor of the proper type for our problem."""
     return torch.tensor(some_list, dtype=torch.float)
 
 
-def tensors_from(pages, shuffle=False):
+@phase('tensorize')
+def tensors_from(pages, shuffle=False, columns=None):
     """Return (inputs, correct outputs, number of tags that are recognition
     targets, number of tags that were prematurely pruned) tuple.
 
-    Can also shuffle to improve training performance.
+    Can also shuffle to improve training performance. Pages are shuffled as
+    wholes, keeping their tags together.
+
+    :arg columns: The indices of the features to keep, as returned by
+        ``feature_columns()``, or None to keep them all
 
     """
-    xs = []
-    ys = []
-    num_targets = num_prunes = 0
-    maybe_shuffled_pages = sample(pages, len(pages)) if shuffle else pages
-    for page in maybe_shuffled_pages:
+    # Count the rows first so we can fill preallocated float32 arrays
+    # straight from the decoded JSON, rather than building nested lists of
+    # Python floats that take several times the memory of the finished
+    # tensors. Pruned nodes are all at the end of a page, so we find them by
+    # looking backward from there.
+    unpruned = []
+    num_prunes = num_pruned_targets = 0
+    num_features = None
+    for page in pages:
+        nodes = page['nodes']
+        rows = len(nodes)
+        while rows and nodes[rows - 1].get('pruned'):
+            rows -= 1
+            num_prunes += 1
+            num_pruned_targets += nodes[rows]['isTarget']
+        unpruned.append(rows)
+        if rows:
+            if num_features is None:
+                num_features = len(nodes[0]['features'])
+            # Filling a fixed-size array would otherwise quietly shift every
+            # later row if one had the wrong number of features:
+            if any(len(node['features']) != num_features for node in nodes[:rows]):
+                raise ValueError(f'Every node should have {num_features} features, but some on {page.get("filename", "a page")} do not. Try revectorizing.')
+    num_rows = sum(unpruned)
+    num_features = num_features or 0
+
+    # Shuffle by visiting the pages in a permuted order, so nothing is copied:
+    order = numpy.random.permutation(len(pages)) if shuffle else range(len(pages))
+    unpruned_nodes = [pages[i]['nodes'][:unpruned[i]] for i in order]
+    x = numpy.fromiter(chain.from_iterable(node['features'] for nodes in unpruned_nodes for node in nodes),
+                       dtype=numpy.float32,
+                       count=num_rows * num_features).reshape(num_rows, num_features)
+    y = numpy.fromiter((node['isTarget'] for nodes in unpruned_nodes for node in nodes),
+                       dtype=numpy.float32,
+                       count=num_rows).reshape(num_rows, 1)  # Tried 0.1 and 0.9 instead of 1 and 0. Was much worse.
+    if columns is not None and num_rows and len(columns) != num_features:
+        x = x[:, columns]
+    # from_numpy() shares the arrays' memory rather than copying them.
+    return torch.from_numpy(x), torch.from_numpy(y), int(y.sum()) + num_pruned_targets, num_prunes
+
+
+def page_sizes(pages):
+    """Return numpy arrays of the number of unpruned nodes, the number of
+    targets, and the number of prunes on each page, in order.
+
+    The unpruned counts say how many rows of the unshuffled output of
+    ``tensors_from(pages)`` belong to each page.
+
+    """
+    unpruned = numpy.zeros(len(pages), dtype=numpy.int64)
+    targets = numpy.zeros(len(pages), dtype=numpy.int64)
+    prunes = numpy.zeros(len(pages), dtype=numpy.int64)
+    for i, page in enumerate(pages):
         for tag in page['nodes']:
             if tag.get('pruned'):
-                num_prunes += 1
+                prunes[i] += 1
             else:
-                xs.append(tag['features'])
-                ys.append([1 if tag['isTarget'] else 0])  # Tried 0.1 and 0.9 instead. Was much worse.
+                unpruned[i] += 1
             if tag['isTarget']:
-                num_targets += 1
-    return tensor(xs), tensor(ys), num_targets, num_prunes
+                targets[i] += 1
+    return unpruned, targets, prunes
+
+
+def feature_columns(feature_names, exclude):
+    """Return the indices of the features not named in ``exclude``, along
+    with their names.
+
+    Pass the indices to ``tensors_from()`` to drop the excluded features.
+    Doing it there, as a column selection, spares us a pass over every node of
+    the decoded vector file and leaves that file unmodified.
+
+    """
+    unknown = [name for name in exclude if name not in feature_names]
+    if unknown:
+        raise BadOptionUsage('exclude', f'Cannot exclude unknown feature{"s" if len(unknown) > 1 else ""}: {", ".join(unknown)}. Known features are: {", ".join(feature_names)}.')
+    columns = [i for i, name in enumerate(feature_names) if name not in exclude]
+    return columns, [feature_names[i] for i in columns]
 
 
 def classifier(num_inputs, num_outputs, hidden_layer_sizes=None):
@@ -67,6 +259,112 @@ def classifier(num_inputs, num_outputs, hidden_layer_sizes=None):
     return Sequential(*layers)
 
 
+def deduplicated(x, y, counts=None):
+    """Collapse identical (input, output) rows into one each.
+
+    Return a tuple of (unique inputs, their outputs, a 1-D tensor of how many
+    times each occurred). Weighting each row by its count, as the ``counts``
+    args of ``learn()`` and ``accuracy_per_tag()`` do, gives the same losses
+    and accuracies as the original rows, with less work.
+
+    :arg counts: How many tags each row of ``x`` already stands for, as from
+        ``subsampled_negatives()``, or None if each stands for one
+
+    """
+    rows, inverse, unique_counts = torch.unique(torch.cat([x, y], dim=1), dim=0, return_inverse=True, return_counts=True)
+    if counts is not None:
+        unique_counts = torch.zeros(len(rows), dtype=counts.dtype).index_add_(0, inverse, counts)
+    width = x.shape[1]
+    return rows[:, :width].contiguous(), rows[:, width:].contiguous(), unique_counts
+
+
+def subsampled_negatives(x, y, ratio):
+    """Keep every positive row and a random selection of the negative ones,
+    about ``ratio`` per positive.
+
+    Return a tuple of (inputs, outputs, a 1-D float64 tensor of how many tags
+    each row stands for). Each kept negative stands for all the negatives
+    that weren't kept, so weighting losses and accuracies by the counts keeps
+    them unbiased estimates of those on the full set.
+
+    """
+    is_positive = y[:, 0] == 1
+    positives = is_positive.nonzero().flatten()
+    negatives = (~is_positive).nonzero().flatten()
+    num_kept = min(len(negatives), max(1, round(ratio * len(positives))))
+    kept_negatives = negatives[torch.randperm(len(negatives))[:num_kept]]
+    rows = torch.cat([positives, kept_negatives.sort().values])
+    counts = torch.ones(len(rows), dtype=torch.float64)
+    if num_kept:
+        counts[len(positives):] = len(negatives) / num_kept
+    return x[rows], y[rows], counts
+
+
+def standardization(x, counts=None):
+    """Return the per-feature means and standard deviations of the inputs
+    ``x``.
+
+    Features that never vary get a standard deviation of 1 so they don't
+    divide by zero.
+
+    :arg counts: How many times each row of ``x`` should be counted, as from
+        ``deduplicated()``, or None to count each once
+
+    """
+    if counts is None:
+        mean = x.mean(dim=0)
+        std = x.std(dim=0, unbiased=False)
+    else:
+        weights = counts.to(x.dtype).reshape(-1, 1) / counts.sum()
+        mean = (weights * x).sum(dim=0)
+        std = (weights * (x - mean) ** 2).sum(dim=0).sqrt()
+    std[std == 0] = 1
+    return mean, std
+
+
+def fold_standardization(model, mean, std):
+    """Adjust a model trained on ``(x - mean) / std`` in place so it gives
+    the same outputs when fed plain ``x``, and return it.
+
+    Only the first layer needs to change: its weights get divided by ``std``,
+    and its bias absorbs the shift by ``mean``. The resulting coefficients
+    work with the raw scores a ruleset emits.
+
+    """
+    first_layer = model[0]
+    with torch.no_grad():
+        first_layer.bias -= first_layer.weight @ (mean / std)
+        first_layer.weight /= std
+    return model
+
+
+def unfold_standardization(model, mean, std):
+    """Undo ``fold_standardization()``: adjust a model that works on plain
+    ``x`` in place so it gives the same outputs when fed
+    ``(x - mean) / std``, and return it."""
+    first_layer = model[0]
+    with torch.no_grad():
+        first_layer.bias += first_layer.weight @ mean
+        first_layer.weight *= std
+    return model
+
+
+def page_markup(page):
+    """Return a list of the markup of each of a page's nodes, None for any
+    that have none.
+
+    The markup may be stored in the page's nodes or, for vector caches, out
+    of line in a side file. In the latter case, we read only this page's line
+    of it.
+
+    """
+    if 'markupOffset' in page:
+        with open(page['markupFile'], 'rb') as file:
+            file.seek(page['markupOffset'])
+            return loads(file.readline())
+    return [node.get('markup') for node in page['nodes']]
+
+
 def mini_histogram(data):
     """Return a histogram of a list of numbers with min and max numbers
     labeled."""
@@ -118,6 +416,34 @@ def samples_from_dir(in_dir):
                     if file.endswith('.html'))
 
 
+def is_manifest(path):
+    """Return whether a Path is a manifest: a text file listing samples,
+    as written by ``fathom pick --manifest``."""
+    return path.suffix == '.txt' and path.is_file()
+
+
+def needs_vectorizing(sample_set):
+    """Return whether a sample set given on the commandline is samples to
+    vectorize—a folder or a manifest—rather than a ready-made vector
+    file."""
+    return sample_set.is_dir() or is_manifest(sample_set)
+
+
+def manifest_samples(manifest):
+    """Return a list of the paths of the samples listed in a manifest,
+    relative to the folder it is in, as strings.
+
+    A manifest has one path per line, slash-separated and relative to its
+    folder, like the output of ``fathom list``. Blank lines and lines
+    starting with # are ignored.
+
+    """
+    with manifest.open(encoding='utf-8') as file:
+        paths = [line.strip() for line in file]
+    # Use the local separator, like the filenames in vector files:
+    return [str(Path(*PurePosixPath(path).parts)) for path in paths if path and not path.startswith('#')]
+
+
 def read_chunks(file, size=io.DEFAULT_BUFFER_SIZE):
     """Yield pieces of data from a file-like object until EOF."""
     while True:
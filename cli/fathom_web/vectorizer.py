@@ -2,7 +2,7 @@ from click import style
 from contextlib import contextmanager
 from datetime import timedelta
 from functools import partial
-from json import dump, JSONDecodeError, load
+from json import dump, dumps, JSONDecodeError, load
 import hashlib
 from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
 from importlib.resources import open_binary
@@ -11,13 +11,15 @@ from os import devnull, kill, makedirs
 from os.path import expanduser, expandvars
 from pathlib import Path
 import platform
-from shutil import copyfileobj, move, rmtree, which
+import re
+from shutil import copyfileobj, rmtree, which
 import signal
 import socket
+import stat
 import subprocess
 from subprocess import CalledProcessError
 from sys import exc_info
-from tempfile import TemporaryDirectory
+from tempfile import NamedTemporaryFile, TemporaryDirectory
 from threading import Thread
 from time import sleep, time
 from zipfile import ZipFile, ZIP_DEFLATED
@@ -28,7 +30,21 @@ from selenium import webdriver
 from selenium.common.exceptions import NoSuchElementException, NoSuchWindowException
 from selenium.webdriver.support.ui import Select
 
-from .utils import read_chunks, samples_from_dir
+from .index import indexed_samples
+from .utils import is_manifest, manifest_samples, page_markup, phase, read_chunks, samples_from_dir
+
+
+def new_file_permissions():
+    """Return the permissions ``open()`` gives a new file.
+
+    The umask can be read only by setting it, so we do that only when we are
+    about to make a file, rather than at import, where it could race with the
+    threads of whatever imported us.
+
+    """
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
 
 
 class GracefulError(ClickException):
@@ -51,32 +67,238 @@ def make_or_find_vectors(ruleset, trainee, sample_set, sample_cache, show_browse
     Otherwise, we build the vectors, based on the given ``ruleset`` and
     ``trainee`` ID, and then cache them at Path ``sample_cache``.
 
+    If passed a manifest, we do the same but with a cache of pages shared by
+    all manifests, vectorizing only the listed pages it lacks. See
+    ``vectors_for_manifest()``.
+
     :arg sample_cache: A Path to possibly-pre-existing vector files or None to
         use the default location
 
     """
+    if is_manifest(sample_set):
+        return vectors_for_manifest(ruleset, trainee, sample_set, sample_cache, show_browser, kind_of_set, delay, tabs)
     if not sample_set.is_dir():
         final_path = sample_set  # It's just a vector file.
     else:
         if not sample_cache:
             sample_cache = ruleset.parent / 'vectors' / f'{kind_of_set}_{trainee}.json'
-        updated_hashes = out_of_date(sample_cache, ruleset, sample_set)
+        with phase('check for changes'):
+            updated_hashes = out_of_date(sample_cache, ruleset, sample_set)
         if updated_hashes:
-            # Make a vectors file, replacing it if already present:
-            vectorize(ruleset, trainee, sample_set, sample_cache, show_browser, kind_of_set, delay, tabs)
-            # Stick the new hashes in it:
-            with sample_cache.open(encoding='utf-8') as file:
-                json = load(file)
+            json = vectorize(ruleset, trainee, sample_set, show_browser, kind_of_set, delay, tabs)
+            # Stick the new hashes in it, and cache it, replacing any old
+            # cache. We hand back what we already have in memory rather than
+            # reading the cache back.
             json['header'].update(updated_hashes)
-            with sample_cache.open('w', encoding='utf-8') as file:
-                dump(json, file, separators=(',', ':'))
+            with phase('write vectors'):
+                write_vectors(json, sample_cache)
+            point_to_markup(json, sample_cache)
             return json
         final_path = sample_cache
-    with open(final_path, encoding='utf-8') as file:
+    with phase('load vectors'), open(final_path, encoding='utf-8') as file:
         json = load(file)
         if json['header']['version'] > 2:
             raise GracefulError(f'The vector file {final_path} has a newer format than these tools can handle. Please run `pip install -U fathom-web` to upgrade your tools.')
-        return json
+    point_to_markup(json, final_path)
+    return json
+
+
+def vectors_for_manifest(ruleset, trainee, manifest, page_cache, show_browser, kind_of_set, delay, tabs):
+    """Return the contents of a vector file of the samples listed in a
+    manifest, vectorizing only those not already in a page cache.
+
+    The page cache is a vector file of every page vectorized for any
+    manifest in the same folder with the same ruleset and trainee, keyed by
+    their paths relative to the folder. Since a page's vectors depend only on
+    the page and the ruleset, re-splitting a corpus into different manifests
+    costs no vectorization at all.
+
+    :arg page_cache: A Path to the page cache or None to use the default
+        location
+
+    """
+    root = manifest.parent
+    filenames = manifest_samples(manifest)
+    names = {}
+    for filename in filenames:
+        if Path(filename).is_absolute() or '..' in Path(filename).parts or not (root / filename).is_file():
+            raise GracefulError(f'The manifest {manifest} lists {filename}, which is not a sample in {root} or below.')
+        # FathomFox records only the last path segment of each page.
+        other = names.setdefault(Path(filename).name, filename)
+        if other != filename:
+            raise GracefulError(f'The manifest {manifest} lists both {other} and {filename}. Samples in one set must have different filenames.')
+    if not page_cache:
+        # Pages are keyed by paths relative to the manifest's folder, so
+        # manifests in different folders need different caches:
+        folder_hash = hashlib.sha256(str(root.resolve()).encode('utf-8')).hexdigest()[:12]
+        page_cache = ruleset.parent / 'vectors' / f'pages_{trainee}_{folder_hash}.json'
+
+    with phase('check for changes'):
+        ruleset_hash = hash_path(ruleset)
+        index = indexed_samples(root) or {}
+        page_hashes = {filename: index[filename].hash if filename in index else hash_path(root / filename)
+                       for filename in filenames}
+    header, pages = {}, {}
+    if page_cache.exists():
+        with phase('load vectors'), page_cache.open(encoding='utf-8') as file:
+            try:
+                cached = load(file)
+            except JSONDecodeError:
+                cached = {'header': {}}
+        if cached['header'].get('rulesetHash') == ruleset_hash and cached['header'].get('version', 0) <= 2:
+            point_to_markup(cached, page_cache)
+            header = cached['header']
+            pages = {page['filename']: page for page in cached['pages']}
+    cached_hashes = header.get('pageHashes', {})
+    stale = [filename for filename in filenames
+             if filename not in pages or cached_hashes.get(filename) != page_hashes[filename]]
+
+    if stale:
+        json = vectorize(ruleset, trainee, root, show_browser, kind_of_set, delay, tabs, sample_filenames=stale)
+        by_name = {Path(filename).name: filename for filename in stale}
+        for page in json['pages']:
+            page['filename'] = by_name[page['filename']]
+        # Keep pages other manifests may want, as long as they still exist.
+        # Their markup has to come back inline to be rewritten to the new
+        # side file.
+        kept = [page for filename, page in pages.items()
+                if filename not in by_name.values() and (root / filename).is_file()]
+        for page in kept:
+            for node, markup in zip(page['nodes'], page_markup(page)):
+                if markup is not None:
+                    node['markup'] = markup
+            page.pop('markupOffset', None)
+            page.pop('markupFile', None)
+        json['pages'] = kept + json['pages']
+        json['header'].update({'pageHashes': dict({page['filename']: cached_hashes[page['filename']] for page in kept},
+                                                  **{filename: page_hashes[filename] for filename in stale}),
+                               'rulesetHash': ruleset_hash})
+        with phase('write vectors'):
+            write_vectors(json, page_cache)
+        point_to_markup(json, page_cache)
+        header = json['header']
+        pages = {page['filename']: page for page in json['pages']}
+    return {'header': header, 'pages': [pages[filename] for filename in filenames]}
+
+
+def write_vectors(json, vector_path):
+    """Write the contents of a vector file to ``vector_path``, with its
+    markup split off into a side file next to it.
+
+    The side file is named after a hash of its contents, so writing a new one
+    never touches the one an existing vector file points to. We move it into
+    place first and the vector file last, so an interrupted run leaves either
+    the old pair or the new one. Then we delete old side files, except the
+    one the replaced vector file pointed to, since another process may have
+    loaded that vector file and not yet read its markup. It goes the next
+    time we write.
+
+    """
+    vector_path.parent.mkdir(parents=True, exist_ok=True)
+    markup_pattern = re.compile(re.escape(vector_path.stem) + r'(\.[0-9a-f]{16})?\.markup')
+    previous_markup = previous_side_file(vector_path, markup_pattern)
+    markup_file = NamedTemporaryFile('wb', dir=vector_path.parent, prefix=vector_path.name, suffix='.tmp', delete=False)
+    try:
+        with markup_file:
+            digest = split_off_markup(json, markup_file)
+        os.chmod(markup_file.name, new_file_permissions())
+        markup_path = vector_path.with_name(f'{vector_path.stem}.{digest[:16]}.markup')
+        os.replace(markup_file.name, markup_path)
+    except BaseException:
+        unlink_if_exists(Path(markup_file.name))
+        raise
+    json['header']['markupFile'] = markup_path.name
+    with replacing(vector_path, 'w', encoding='utf-8') as file:
+        dump(json, file, separators=(',', ':'))
+
+    for path in vector_path.parent.iterdir():
+        if path not in (markup_path, previous_markup) and markup_pattern.fullmatch(path.name):
+            unlink_if_exists(path)
+
+
+def previous_side_file(vector_path, markup_pattern):
+    """Return the Path of the markup side file an existing vector file points
+    to, without the bother of parsing it, or None if there isn't one.
+
+    That's the newest side file no newer than the vector file, since each is
+    moved into place just before its vector file is written. Newer ones are
+    left over from interrupted writes.
+
+    """
+    try:
+        vectors_mtime = vector_path.stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
+    side_files = []
+    for path in vector_path.parent.iterdir():
+        if markup_pattern.fullmatch(path.name):
+            try:
+                mtime = path.stat().st_mtime_ns
+            except FileNotFoundError:  # Deleted by a concurrent write
+                continue
+            if mtime <= vectors_mtime:
+                side_files.append((mtime, path))
+    return max(side_files, default=(None, None))[1]
+
+
+@contextmanager
+def replacing(path, mode, **kwargs):
+    """Return a temp file, opened for writing, that replaces ``path`` when
+    the ``with`` block exits successfully and is deleted otherwise.
+
+    The replacement keeps the permissions of the file it replaces, or gets
+    those ``open()`` would give a new file, rather than the owner-only ones
+    temp files are made with. (We note them up front, since callers may move
+    the old file away inside the block.)
+
+    """
+    try:
+        permissions = stat.S_IMODE(path.stat().st_mode)
+    except FileNotFoundError:
+        permissions = new_file_permissions()
+    file = NamedTemporaryFile(mode, dir=path.parent, prefix=path.name, suffix='.tmp', delete=False, **kwargs)
+    try:
+        with file:
+            yield file
+        os.chmod(file.name, permissions)
+    except BaseException:
+        unlink_if_exists(Path(file.name))
+        raise
+    os.replace(file.name, path)
+
+
+def split_off_markup(json, markup_file):
+    """Move the markup of every node of a vector file's pages into
+    ``markup_file``, leaving each page with the byte offset of its line
+    there.
+
+    Markup is often more than half of a vector file, yet it's needed only to
+    show the few nodes a per-tag report prints. Keeping it out of line means
+    loading the vectors for training doesn't parse it or hold it in memory.
+    The side file has one JSON list per page, with an entry (null if there is
+    no markup) for each node. Return the SHA-256 hex digest of what we wrote.
+
+    """
+    digest = hashlib.sha256()
+    for page in json['pages']:
+        markups = [node.pop('markup', None) for node in page['nodes']]
+        if any(markup is not None for markup in markups):
+            page['markupOffset'] = markup_file.tell()
+            line = dumps(markups).encode('utf-8') + b'\n'
+            markup_file.write(line)
+            digest.update(line)
+    return digest.hexdigest()
+
+
+def point_to_markup(json, vector_path):
+    """Tell each page of a loaded vector file where to find its out-of-line
+    markup, if it has any, so ``page_markup()`` can fetch it on demand."""
+    markup_name = json['header'].get('markupFile')
+    if markup_name:
+        markup_path = vector_path.parent / markup_name
+        for page in json['pages']:
+            if 'markupOffset' in page:
+                page['markupFile'] = markup_path
 
 
 def out_of_date(sample_cache, ruleset, sample_set):
@@ -104,9 +326,27 @@ def out_of_date(sample_cache, ruleset, sample_set):
                 cache_header = load(file)['header']
             except JSONDecodeError:
                 cache_header = {}
+        markup_name = cache_header.get('markupFile')
+        if markup_name and not (sample_cache.parent / markup_name).exists():
+            cache_header = {}
     else:
         cache_header = {}
     ruleset_hash = hash_path(ruleset)
+    index = indexed_samples(sample_set)
+    if index is not None:
+        # The index rereads only what changed since it was last updated.
+        page_hashes = {path: sample.hash for path, sample in index.items()}
+    else:
+        page_hashes = hashed_samples(sample_set)
+    if (ruleset_hash != cache_header.get('rulesetHash') or
+        page_hashes != cache_header.get('pageHashes')):
+        return {'pageHashes': page_hashes,
+                'rulesetHash': ruleset_hash}
+
+
+def hashed_samples(sample_set):
+    """Return a dict of the paths of the samples in a folder, relative to
+    it, and the hashes of their contents."""
     page_hashes = {}
     with progressbar(samples_from_dir(sample_set), label='Checking for changes') as bar:
         for sample in bar:
@@ -117,14 +357,12 @@ def out_of_date(sample_cache, ruleset, sample_set):
             # make this revectorize only the new samples if some are
             # added—and delete the ones deleted.
             page_hashes[str(sample.relative_to(sample_set))] = hash_path(sample)
-    if (ruleset_hash != cache_header.get('rulesetHash') or
-        page_hashes != cache_header.get('pageHashes')):
-        return {'pageHashes': page_hashes,
-                'rulesetHash': ruleset_hash}
+    return page_hashes
 
 
-def vectorize(ruleset_path, trainee_id, samples_directory, output_path, show_browser, kind_of_set, delay, tabs):
-    """Create feature vectors for a directory of training samples.
+def vectorize(ruleset_path, trainee_id, samples_directory, show_browser, kind_of_set, delay, tabs, sample_filenames=None):
+    """Create feature vectors for a directory of training samples, and return
+    the contents of the resulting vector file.
 
     We unpack an embedded version of FathomFox, fetch its npm dependencies,
     copy the ruleset into it, bundle it up, run it in a copy of Firefox, and
@@ -133,8 +371,9 @@ def vectorize(ruleset_path, trainee_id, samples_directory, output_path, show_bro
     :arg ruleset_path: Path to the rulesets.js file
     :arg trainee_id: The ID of the desired Fathom trainee in rulesets.js
     :arg samples_directory: Path to the directory containing the sample pages
-    :arg output_path: Where to save the resulting vector file
     :arg show_browser: Whether to show Firefox vs. running it in headless mode
+    :arg sample_filenames: The paths, relative to ``samples_directory``, of
+        the samples to vectorize, or None for all of them
 
     Required for this to work are...
       * node (and npm, which ships with it)
@@ -153,9 +392,11 @@ def vectorize(ruleset_path, trainee_id, samples_directory, output_path, show_bro
                                  show_browser,
                                  geckodriver_path) as firefox:  # TODO: I can probably run FF once and share it across the training and validation vectorizations.
                 with serving(samples_directory) as port:
-                    sample_filenames = [str(sample.relative_to(samples_directory))
-                                        for sample in samples_from_dir(samples_directory)]
-                    run_vectorizer(firefox, trainee_id, sample_filenames, output_path, kind_of_set, port, delay, tabs)
+                    if sample_filenames is None:
+                        sample_filenames = [str(sample.relative_to(samples_directory))
+                                            for sample in samples_from_dir(samples_directory)]
+                    with phase('vectorize'):
+                        return run_vectorizer(firefox, trainee_id, sample_filenames, kind_of_set, port, delay, tabs)
 
 
 @contextmanager
@@ -166,7 +407,7 @@ def fathom_fox_addon(ruleset_file):
     with TemporaryDirectory() as temp:
         temp_dir = Path(temp)
 
-        with locked_cached_fathom() as source:
+        with phase('build FathomFox'), locked_cached_fathom() as source:
             fathom_fox = source / 'fathom_fox'
 
             # Copy in your ruleset:
@@ -410,14 +651,14 @@ def running_firefox(fathom_fox, show_browser, geckodriver_path):
         profile.set_preference('browser.cache.offline.enable', False)
         profile.set_preference('devtools.chrome.enabled', True)
 
-        firefox = webdriver.Firefox(
-            executable_path=str(geckodriver_path.resolve()),
-            options=options,
-            firefox_profile=profile,
-            service_log_path=devnull,
-        )
-
-        firefox.install_addon(str(fathom_fox), temporary=True)
+        with phase('start Firefox'):
+            firefox = webdriver.Firefox(
+                executable_path=str(geckodriver_path.resolve()),
+                options=options,
+                firefox_profile=profile,
+                service_log_path=devnull,
+            )
+            firefox.install_addon(str(fathom_fox), temporary=True)
         firefox_pid = firefox.capabilities['moz:processID']
         geckodriver_pid = firefox.service.process.pid
         print('done.')
@@ -453,10 +694,10 @@ def running_firefox(fathom_fox, show_browser, geckodriver_path):
 FAILURE_SIGNIFIER = 'failed:'
 
 
-def run_vectorizer(firefox, trainee_id, sample_filenames, output_path, kind_of_set, port, delay, tabs):
+def run_vectorizer(firefox, trainee_id, sample_filenames, kind_of_set, port, delay, tabs):
     """Set up the vectorizer and run it, creating the vector file.
 
-    Move the vector file to ``output_path``, replacing any file already there.
+    Return the parsed contents of the vector file.
 
     We navigate to the vectorizer page of FathomFox, paste the sample filenames
     into the text area, and hit the Vectorize button. We monitor the status
@@ -513,9 +754,8 @@ def run_vectorizer(firefox, trainee_id, sample_filenames, output_path, kind_of_s
 
     download_dir = Path(firefox.profile.default_preferences['browser.download.dir'])
     new_file = wait_for_vectors_in(download_dir)
-    unlink_if_exists(output_path)  # move() won't overwrite a file on Windows.
-    output_path.parent.mkdir(parents=True, exist_ok=True)
-    move(str(new_file.resolve()), str(output_path.resolve()))
+    with new_file.open(encoding='utf-8') as file:
+        return load(file)
 
 
 def get_fathom_fox_uuid(firefox):